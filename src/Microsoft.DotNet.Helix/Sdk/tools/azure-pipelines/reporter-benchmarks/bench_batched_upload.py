@@ -0,0 +1,175 @@
+# Licensed to the .NET Foundation under one or more agreements.
+# The .NET Foundation licenses this file to you under the MIT license.
+
+"""Benchmarks BatchedReporter publishing to a local stand-in results server.
+
+Generates a work item with deterministic xunit, junit and TRX files, starts
+a local HTTP server (in a separate process) that accepts the batches
+HttpSink posts and answers each after a fixed latency, and compares:
+
+    sequential - parse every file, then publish the batches one at a time
+    batched    - publish batches from a pool of workers while parsing runs
+
+Each scenario records the time to the first acknowledged batch and the
+total wall time, and the server's count of received results is checked
+against what was parsed. Prints the report as JSON.
+
+    python bench_batched_upload.py [--tests 20000] [--batch-size 1000]
+                                   [--workers 4] [--latency-ms 50]
+"""
+
+import argparse
+import gzip
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "reporter"))
+
+import _helix_compat  # noqa: E402
+from batched_reporter import BatchedReporter, HttpSink, ResultSink  # noqa: E402
+from test_results_reader import read_results  # noqa: E402
+
+import generate  # noqa: E402
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def _serve(latency):
+    received = {"results": 0, "requests": 0}
+    lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers["Content-Length"]))
+            if self.headers.get("Content-Encoding") == "gzip":
+                body = gzip.decompress(body)
+            document = json.loads(body.decode("utf-8"))
+            time.sleep(latency)
+            with lock:
+                received["requests"] += 1
+                received["results"] += len(document["results"])
+            self.send_response(200)
+            self.end_headers()
+
+        def do_GET(self):
+            with lock:
+                payload = json.dumps(received).encode("utf-8")
+                received["results"] = received["requests"] = 0
+            self.send_response(200)
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = _ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    sys.stdout.write("%d\n" % server.server_address[1])
+    sys.stdout.flush()
+    server.serve_forever()
+
+
+class _TimingSink(ResultSink):
+    """Records when the first batch was acknowledged by the wrapped sink."""
+
+    def __init__(self, sink, start):
+        self._sink = sink
+        self._start = start
+        self.first = None
+
+    @property
+    def name(self):
+        return self._sink.name
+
+    def publish(self, results):
+        self._sink.publish(results)
+        if self.first is None:
+            self.first = time.perf_counter() - self._start
+
+
+def _run(scenario, results_dir, url, args):
+    parameters = _helix_compat.AzureDevOpsReportingParameters("https://dev.azure.com/dnceng/", "internal", "1", None)
+    start = time.perf_counter()
+    sink = _TimingSink(HttpSink(url, parameters, retries=0), start)
+    if scenario == "sequential":
+        results = list(read_results([results_dir]))
+        workers = 1
+    else:
+        results = read_results([results_dir])
+        workers = args.workers
+    BatchedReporter([sink], batch_size=args.batch_size, workers=workers).report_results(results)
+    return {
+        "first_batch_seconds": round(sink.first, 4) if sink.first is not None else None,
+        "wall_seconds": round(time.perf_counter() - start, 4),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--tests", type=int, default=20000, help="tests per generated file")
+    parser.add_argument("--stdout-bytes", type=int, default=4096)
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--latency-ms", type=int, default=50, help="time the stand-in server takes per batch")
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        _serve(args.latency_ms / 1000.0)
+        return
+
+    os.environ.setdefault("_commandExitCode", "0")
+    os.environ.setdefault("HELIX_WORKITEM_FRIENDLYNAME", "benchmark")
+
+    server = subprocess.Popen([sys.executable, os.path.abspath(__file__), "--serve", "--latency-ms", str(args.latency_ms)],
+                              stdout=subprocess.PIPE)
+    work_dir = tempfile.mkdtemp(prefix="reporter-bench-")
+    try:
+        url = "http://127.0.0.1:%d/results" % int(server.stdout.readline())
+        results_dir = os.path.join(work_dir, "results")
+        for format_name, write in sorted(generate.writers.items()):
+            directory = os.path.join(results_dir, format_name)
+            os.makedirs(directory)
+            write(os.path.join(directory, generate.file_names[format_name]), args.tests,
+                  stdout_bytes=args.stdout_bytes)
+
+        report = {
+            "python": sys.version.split()[0],
+            "parameters": {
+                "tests_per_file": args.tests,
+                "stdout_bytes": args.stdout_bytes,
+                "batch_size": args.batch_size,
+                "workers": args.workers,
+                "latency_ms": args.latency_ms,
+            },
+            "scenarios": {},
+        }
+        for scenario in ("sequential", "batched"):
+            measurement = _run(scenario, results_dir, url, args)
+            with urllib.request.urlopen(url, timeout=60) as response:
+                measurement["server_received"] = json.loads(response.read().decode("utf-8"))
+            if measurement["server_received"]["results"] != args.tests * len(generate.writers):
+                sys.exit("The server received %d results, expected %d" % (
+                    measurement["server_received"]["results"], args.tests * len(generate.writers)))
+            report["scenarios"][scenario] = measurement
+    finally:
+        server.kill()
+        server.wait()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    json.dump(report, sys.stdout, indent=2)
+    sys.stdout.write("\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,206 @@
+# Licensed to the .NET Foundation under one or more agreements.
+# The .NET Foundation licenses this file to you under the MIT license.
+
+"""Compares the columnar results file with __test_report_v2.json, in size and read speed.
+
+Writes both files from the same generated xunit, junit and TRX files, timing
+each writer, then reads them in a fresh process per scenario, so peak RSS is
+not shared:
+
+    json_load            - _helix_compat.load_json_results (json.load of the file)
+    json_durations       - the sum of every duration, from load_json_results
+    json_failed          - only "Fail" results, without attachments, through JsonResultsReader
+    columnar_all         - every result, through ColumnarResults
+    columnar_durations   - the sum of every duration, from ColumnarResults.durations()
+    columnar_failed      - only "Fail" results, without attachments, through ColumnarResults
+
+Each scenario records wall time, peak RSS and a hash of what it read; the
+columnar hashes must match their JSON counterparts. Prints the report as JSON.
+
+    python bench_columnar.py [--tests 100000] [--stdout-bytes 4096] [--repeat 3]
+"""
+
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "reporter"))
+
+import _helix_compat  # noqa: E402
+
+import generate  # noqa: E402
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows; peak RSS is reported as null there.
+    resource = None
+
+SCENARIOS = ["json_load", "json_durations", "json_failed", "columnar_all", "columnar_durations", "columnar_failed"]
+
+
+def _peak_rss_bytes():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def _hash_results(digest, results):
+    count = 0
+    for d in results:
+        digest.update(_helix_compat._json_encoder.encode(d).encode("utf-8"))
+        count += 1
+    return count
+
+
+def _run_scenario(scenario, work_dir):
+    json_path = os.path.join(work_dir, _helix_compat.JSON_RESULTS_FILENAME)
+    columnar_path = os.path.join(work_dir, _helix_compat.COLUMNAR_RESULTS_FILENAME)
+    digest = hashlib.sha256()
+    start = time.perf_counter()
+    if scenario == "json_load":
+        count = _hash_results(digest, _helix_compat.load_json_results(json_path)["results"])
+    elif scenario == "json_durations":
+        results = _helix_compat.load_json_results(json_path)["results"]
+        count = len(results)
+        digest.update(repr(sum(r["duration_seconds"] or 0.0 for r in results)).encode("utf-8"))
+    elif scenario == "json_failed":
+        reader = _helix_compat.JsonResultsReader(json_path, results=("Fail",), include_attachments=False)
+        count = _hash_results(digest, (_helix_compat._result_to_dict(r) for r in reader))
+    else:
+        with _helix_compat.ColumnarResults(columnar_path) as columns:
+            if scenario == "columnar_all":
+                count = _hash_results(digest, (_helix_compat._result_to_dict(r) for r in columns))
+            elif scenario == "columnar_durations":
+                durations = columns.durations()
+                count = len(durations)
+                # NaN marks a result without a duration
+                digest.update(repr(sum(d for d in durations if d == d)).encode("utf-8"))
+                del durations
+            elif scenario == "columnar_failed":
+                results = columns.results(columns.where("result", ("Fail",)), include_attachments=False)
+                count = _hash_results(digest, (_helix_compat._result_to_dict(r) for r in results))
+            else:
+                raise ValueError("Unknown scenario " + scenario)
+    return {
+        "results": count,
+        "wall_seconds": round(time.perf_counter() - start, 4),
+        "peak_rss_bytes": _peak_rss_bytes(),
+        "sha256": digest.hexdigest(),
+    }
+
+
+def _write_results_files(work_dir, args):
+    from test_results_reader import read_results
+
+    os.environ.setdefault("_commandExitCode", "0")
+    os.environ.setdefault("HELIX_WORKITEM_FRIENDLYNAME", "benchmark")
+    os.environ["HELIX_WORKITEM_ROOT"] = work_dir
+    results_dir = os.path.join(work_dir, "results")
+    for format_name, write in sorted(generate.writers.items()):
+        directory = os.path.join(results_dir, format_name)
+        os.makedirs(directory)
+        write(os.path.join(directory, generate.file_names[format_name]), args.tests, stdout_bytes=args.stdout_bytes)
+    parameters = _helix_compat.AzureDevOpsReportingParameters("https://dev.azure.com/dnceng/", "internal", "1", None)
+
+    # Both writers are timed on results already in memory, so that parsing is left out
+    results = list(read_results([results_dir]))
+    shutil.rmtree(results_dir)
+    write_seconds = {}
+    for name, reporter in (("json", _helix_compat.JsonReporter(parameters)),
+                           ("columnar", _helix_compat.ColumnarReporter(parameters))):
+        start = time.perf_counter()
+        reporter.report_results(results)
+        write_seconds[name] = round(time.perf_counter() - start, 4)
+    return write_seconds
+
+
+class _ByteCounter(object):
+
+    def __init__(self):
+        self.size = 0
+
+    def write(self, data):
+        self.size += len(data)
+
+    def flush(self):
+        pass
+
+
+def _gzip_size(path):
+    """Size of the file gzipped as the reporter would, without keeping either in memory."""
+    counter = _ByteCounter()
+    with open(path, "rb") as f, gzip.GzipFile(fileobj=counter, mode="wb", compresslevel=_helix_compat._GZIP_LEVEL,
+                                              mtime=0) as compressed:
+        shutil.copyfileobj(f, compressed, 1024 * 1024)
+    return counter.size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--tests", type=int, default=100000, help="tests per generated file")
+    parser.add_argument("--stdout-bytes", type=int, default=4096)
+    parser.add_argument("--repeat", type=int, default=3, help="runs per scenario; the fastest one is reported")
+    parser.add_argument("--run-scenario", help=argparse.SUPPRESS)
+    parser.add_argument("--write", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_scenario:
+        json.dump(_run_scenario(args.run_scenario, args.write), sys.stdout)
+        return
+    if args.write:
+        json.dump(_write_results_files(args.write, args), sys.stdout)
+        return
+
+    work_dir = tempfile.mkdtemp(prefix="reporter-bench-")
+    try:
+        write_seconds = json.loads(subprocess.check_output([
+            sys.executable, os.path.abspath(__file__), "--write", work_dir, "--tests", str(args.tests),
+            "--stdout-bytes", str(args.stdout_bytes)]).decode("utf-8"))
+        files = {}
+        for name, file_name in (("json", _helix_compat.JSON_RESULTS_FILENAME),
+                                ("columnar", _helix_compat.COLUMNAR_RESULTS_FILENAME)):
+            path = os.path.join(work_dir, file_name)
+            files[name] = {
+                "bytes": os.path.getsize(path),
+                "gzip_bytes": _gzip_size(path),
+                "write_seconds": write_seconds[name],
+            }
+        report = {
+            "python": sys.version.split()[0],
+            "parameters": {"tests_per_file": args.tests, "stdout_bytes": args.stdout_bytes},
+            "files": files,
+            "scenarios": {},
+        }
+        for scenario in SCENARIOS:
+            runs = []
+            for _ in range(args.repeat):
+                output = subprocess.check_output([
+                    sys.executable, os.path.abspath(__file__), "--run-scenario", scenario, "--write", work_dir])
+                runs.append(json.loads(output.decode("utf-8")))
+            report["scenarios"][scenario] = min(runs, key=lambda run: run["wall_seconds"])
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    scenarios = report["scenarios"]
+    mismatched = [columnar for json_scenario, columnar in (("json_load", "columnar_all"),
+                                                            ("json_durations", "columnar_durations"),
+                                                            ("json_failed", "columnar_failed"))
+                  if scenarios[json_scenario]["sha256"] != scenarios[columnar]["sha256"]]
+    json.dump(report, sys.stdout, indent=2)
+    sys.stdout.write("\n")
+    if mismatched:
+        sys.exit("The columnar file read differently than the JSON file: " + ", ".join(mismatched))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+# Licensed to the .NET Foundation under one or more agreements.
+# The .NET Foundation licenses this file to you under the MIT license.
+
+"""Compares loading a results file whole with streaming it through JsonResultsReader.
+
+Writes a __test_report_v2.json from generated xunit, junit and TRX files,
+then reads it in a fresh process per scenario, so peak RSS is not shared:
+
+    load          - _helix_compat.load_json_results (json.load of the file)
+    stream        - every result, through JsonResultsReader
+    stream_failed - only "Fail" results, without attachments
+
+Each scenario records wall time, peak RSS and a hash of what it read; the
+stream hash must match the load hash. Prints the report as JSON.
+
+    python bench_json_reader.py [--tests 100000] [--stdout-bytes 4096] [--repeat 3]
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "reporter"))
+
+import _helix_compat  # noqa: E402
+
+import generate  # noqa: E402
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows; peak RSS is reported as null there.
+    resource = None
+
+
+def _peak_rss_bytes():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def _run_scenario(scenario, path):
+    digest = hashlib.sha256()
+    count = 0
+    start = time.perf_counter()
+    if scenario == "load":
+        for d in _helix_compat.load_json_results(path)["results"]:
+            digest.update(_helix_compat._json_encoder.encode(d).encode("utf-8"))
+            count += 1
+    elif scenario in ("stream", "stream_failed"):
+        if scenario == "stream":
+            reader = _helix_compat.JsonResultsReader(path)
+        else:
+            reader = _helix_compat.JsonResultsReader(path, results=("Fail",), include_attachments=False)
+        for result in reader:
+            digest.update(_helix_compat._json_encoder.encode(_helix_compat._result_to_dict(result)).encode("utf-8"))
+            count += 1
+    else:
+        raise ValueError("Unknown scenario " + scenario)
+    return {
+        "results": count,
+        "wall_seconds": round(time.perf_counter() - start, 4),
+        "peak_rss_bytes": _peak_rss_bytes(),
+        "sha256": digest.hexdigest(),
+    }
+
+
+def _write_results_file(work_dir, args):
+    from test_results_reader import read_results
+
+    os.environ.setdefault("_commandExitCode", "0")
+    os.environ.setdefault("HELIX_WORKITEM_FRIENDLYNAME", "benchmark")
+    os.environ["HELIX_WORKITEM_ROOT"] = work_dir
+    results_dir = os.path.join(work_dir, "results")
+    for format_name, write in sorted(generate.writers.items()):
+        directory = os.path.join(results_dir, format_name)
+        os.makedirs(directory)
+        write(os.path.join(directory, generate.file_names[format_name]), args.tests, stdout_bytes=args.stdout_bytes)
+    parameters = _helix_compat.AzureDevOpsReportingParameters("https://dev.azure.com/dnceng/", "internal", "1", None)
+    _helix_compat.JsonReporter(parameters).report_results(read_results([results_dir]))
+    shutil.rmtree(results_dir)
+    return _helix_compat.json_results_path()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--tests", type=int, default=100000, help="tests per generated file")
+    parser.add_argument("--stdout-bytes", type=int, default=4096)
+    parser.add_argument("--repeat", type=int, default=3, help="runs per scenario; the fastest one is reported")
+    parser.add_argument("--run-scenario", help=argparse.SUPPRESS)
+    parser.add_argument("--write", help=argparse.SUPPRESS)
+    parser.add_argument("--path", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_scenario:
+        json.dump(_run_scenario(args.run_scenario, args.path), sys.stdout)
+        return
+    if args.write:
+        sys.stdout.write(_write_results_file(args.write, args))
+        return
+
+    work_dir = tempfile.mkdtemp(prefix="reporter-bench-")
+    try:
+        # Written in its own process too: a child process starts out with the
+        # peak RSS of the process it was forked from.
+        path = subprocess.check_output([
+            sys.executable, os.path.abspath(__file__), "--write", work_dir, "--tests", str(args.tests),
+            "--stdout-bytes", str(args.stdout_bytes)]).decode("utf-8")
+        report = {
+            "python": sys.version.split()[0],
+            "parameters": {"tests_per_file": args.tests, "stdout_bytes": args.stdout_bytes},
+            "file_bytes": os.path.getsize(path),
+            "scenarios": {},
+        }
+        for scenario in ("load", "stream", "stream_failed"):
+            runs = []
+            for _ in range(args.repeat):
+                output = subprocess.check_output([
+                    sys.executable, os.path.abspath(__file__), "--run-scenario", scenario, "--path", path])
+                runs.append(json.loads(output.decode("utf-8")))
+            report["scenarios"][scenario] = min(runs, key=lambda run: run["wall_seconds"])
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    if report["scenarios"]["stream"]["sha256"] != report["scenarios"]["load"]["sha256"]:
+        sys.exit("Streaming read different results than json.load")
+    json.dump(report, sys.stdout, indent=2)
+    sys.stdout.write("\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,182 @@
+# Licensed to the .NET Foundation under one or more agreements.
+# The .NET Foundation licenses this file to you under the MIT license.
+
+"""End-to-end benchmark of the Helix test reporter.
+
+Generates a work item directory with deterministic xunit, junit and TRX
+files and measures, in a fresh process per scenario so peak RSS is not
+shared between them:
+
+    read      - test_results_reader.read_results over the directory
+    report    - read_results piped into JsonReporter.report_results (what
+                run.py does when helix-scripts is not installed)
+
+Each scenario records wall time, CPU time, peak RSS and results/sec. The
+report is printed (or written with --output) as JSON so runs can be
+compared with a plain diff. Needs nothing beyond the Python standard
+library, so it runs offline and without helix-scripts.
+
+    python bench_reporter.py [--tests 100000] [--files 1] [--failure-ratio 0.1]
+                             [--stdout-bytes 4096] [--formats xunit,junit,trx]
+                             [--repeat 3] [--output report.json]
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+_REPORTER_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "reporter")
+
+sys.path.insert(0, _REPORTER_DIR)
+
+import generate  # noqa: E402
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows; peak RSS is reported as null there.
+    resource = None
+
+
+def _peak_rss_bytes():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def _run_scenario(scenario, work_dir):
+    """Runs one scenario in this process and returns its measurements."""
+    import logging
+    logging.basicConfig(level=logging.WARNING)
+
+    import _helix_compat
+    from test_results_reader import read_results
+
+    os.environ.setdefault("_commandExitCode", "0")
+    os.environ.setdefault("HELIX_WORKITEM_FRIENDLYNAME", "benchmark")
+    os.environ["HELIX_WORKITEM_ROOT"] = os.path.join(work_dir, "root")
+    results_dir = os.path.join(work_dir, "results")
+
+    start_wall = time.perf_counter()
+    start_cpu = time.process_time()
+    count = 0
+    if scenario == "read":
+        for result in read_results([results_dir]):
+            count += 1
+    elif scenario == "report":
+        def counted(results):
+            nonlocal count
+            for result in results:
+                count += 1
+                yield result
+        parameters = _helix_compat.AzureDevOpsReportingParameters("https://dev.azure.com/dnceng/", "internal", "1", None)
+        reporter = _helix_compat.JsonReporter(parameters, compression=os.environ.get("HELIX_REPORTER_JSON_COMPRESSION"))
+        reporter.report_results(counted(read_results([results_dir])))
+    else:
+        raise ValueError("Unknown scenario " + scenario)
+    wall = time.perf_counter() - start_wall
+    cpu = time.process_time() - start_cpu
+
+    measurement = {
+        "results": count,
+        "wall_seconds": round(wall, 4),
+        "cpu_seconds": round(cpu, 4),
+        "results_per_second": int(count / wall) if wall else None,
+        "peak_rss_bytes": _peak_rss_bytes(),
+    }
+    if scenario == "report":
+        measurement["output_bytes"] = os.path.getsize(_helix_compat.find_json_results())
+    return measurement
+
+
+def _generate(work_dir, args):
+    results_dir = os.path.join(work_dir, "results")
+    os.makedirs(results_dir)
+    os.makedirs(os.path.join(work_dir, "root"))
+    total_bytes = 0
+    for format_name in args.formats:
+        for index in range(args.files):
+            directory = os.path.join(results_dir, "%s-%d" % (format_name, index))
+            os.makedirs(directory)
+            path = os.path.join(directory, generate.file_names[format_name])
+            generate.writers[format_name](path, args.tests, args.failure_ratio, args.skip_ratio, args.stdout_bytes,
+                                          seed=index)
+            total_bytes += os.path.getsize(path)
+    return total_bytes
+
+
+def _best(runs):
+    # Report the fastest run; peak RSS is the same across runs of one scenario.
+    return min(runs, key=lambda run: run["wall_seconds"])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--tests", type=int, default=100000, help="tests per generated file")
+    parser.add_argument("--files", type=int, default=1, help="files generated per format")
+    parser.add_argument("--failure-ratio", type=float, default=0.1)
+    parser.add_argument("--skip-ratio", type=float, default=0.05)
+    parser.add_argument("--stdout-bytes", type=int, default=4096,
+                        help="size of the stdout attachment of each failing test")
+    parser.add_argument("--formats", default="xunit,junit,trx")
+    parser.add_argument("--scenarios", default="read,report")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per scenario; the fastest one is reported")
+    parser.add_argument("--output", help="write the JSON report to this file instead of stdout")
+    parser.add_argument("--run-scenario", help=argparse.SUPPRESS)
+    parser.add_argument("--work-dir", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_scenario:
+        json.dump(_run_scenario(args.run_scenario, args.work_dir), sys.stdout)
+        return
+
+    args.formats = [f for f in args.formats.split(",") if f]
+    for format_name in args.formats:
+        if format_name not in generate.writers:
+            sys.exit("Unknown format '%s'" % format_name)
+
+    work_dir = tempfile.mkdtemp(prefix="reporter-bench-")
+    try:
+        input_bytes = _generate(work_dir, args)
+        report = {
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "parameters": {
+                "tests_per_file": args.tests,
+                "files_per_format": args.files,
+                "formats": args.formats,
+                "failure_ratio": args.failure_ratio,
+                "skip_ratio": args.skip_ratio,
+                "stdout_bytes": args.stdout_bytes,
+            },
+            "input_bytes": input_bytes,
+            "scenarios": {},
+        }
+        for scenario in [s for s in args.scenarios.split(",") if s]:
+            runs = []
+            for _ in range(args.repeat):
+                output = subprocess.check_output([
+                    sys.executable, os.path.abspath(__file__), "--run-scenario", scenario, "--work-dir", work_dir])
+                runs.append(json.loads(output.decode("utf-8")))
+            report["scenarios"][scenario] = _best(runs)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        sys.stdout.write("\n")
+
+
+if __name__ == "__main__":
+    main()
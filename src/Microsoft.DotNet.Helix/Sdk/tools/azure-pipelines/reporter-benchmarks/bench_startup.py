@@ -0,0 +1,148 @@
+# Licensed to the .NET Foundation under one or more agreements.
+# The .NET Foundation licenses this file to you under the MIT license.
+
+"""Measures the startup cost of reporter/run.py against a checked-in budget.
+
+run.py runs once per work item, so the time spent importing it is paid
+again on every Helix machine. Each repeat runs, in a fresh process:
+
+    import   - python -X importtime -c "import run", recording the cumulative
+               import time of run.py and of each module it imports directly
+    empty    - run.py end to end on a work item without results files
+    baseline - python -c pass, the interpreter's own startup
+
+The import time (the median over the repeats) must stay within
+IMPORT_BUDGET_MS, and none of LAZY_MODULES may be imported at startup: they
+are only needed once a matching results file or an option calls for them.
+Prints the report as JSON and exits with 1 when either check fails.
+
+    python bench_startup.py [--repeat 11] [--budget-ms 75]
+"""
+
+import argparse
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+REPORTER_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "reporter")
+
+# Median cumulative import time of run.py, measured with -X importtime (which
+# adds some overhead of its own). run.py measured 55-65ms on a single vCPU
+# with Python 3.11, down from 120-130ms when every format was imported up front.
+IMPORT_BUDGET_MS = 75
+
+LAZY_MODULES = [
+    "formats.xunit",
+    "formats.junit",
+    "formats.trx",
+    "lxml",
+    "zstandard",
+    "batched_reporter",
+    "urllib.request",
+    "concurrent.futures.process",
+    # helix-scripts, where it is installed: the result types are looked up when
+    # the first results are built, and the reporter when main() reports them
+    "helix.public",
+]
+
+_IMPORT_TIME_LINE = re.compile(r"^import time:\s*(\d+)\s*\|\s*(\d+)\s*\|( *)(\S+)\s*$")
+
+
+def _median(values):
+    values = sorted(values)
+    return values[len(values) // 2]
+
+
+def _import_times():
+    """Returns the modules imported by one "import run" and run.py's direct imports.
+
+    -X importtime lists a module after everything it imported, indented one
+    level deeper, so run.py's direct imports are the top level entries
+    between the previous unindented entry and run.py's.
+    """
+    process = subprocess.run([sys.executable, "-X", "importtime", "-c", "import run"], cwd=REPORTER_DIR,
+                             stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, check=True)
+    modules = {}
+    direct = {}
+    for line in process.stderr.decode("utf-8").splitlines():
+        match = _IMPORT_TIME_LINE.match(line)
+        if not match:
+            continue
+        depth = (len(match.group(3)) - 1) // 2
+        name = match.group(4)
+        cumulative = int(match.group(2))
+        modules[name] = cumulative
+        if depth == 0 and name != "run":
+            direct = {}
+        elif depth == 1:
+            direct[name] = cumulative
+    return modules, direct
+
+
+def _wall_time(command, cwd, env=None):
+    start = time.perf_counter()
+    subprocess.run(command, cwd=cwd, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=11, help="runs per measurement; the median is reported")
+    parser.add_argument("--budget-ms", type=float, default=IMPORT_BUDGET_MS)
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix="reporter-bench-")
+    try:
+        env = dict(os.environ)
+        env.update({
+            "_commandExitCode": "0",
+            "HELIX_WORKITEM_FRIENDLYNAME": "benchmark",
+            "HELIX_WORKITEM_ROOT": work_dir,
+            "HELIX_WORKITEM_UPLOAD_ROOT": work_dir,
+        })
+        run_command = [sys.executable, os.path.join(os.path.abspath(REPORTER_DIR), "run.py"),
+                       "https://dev.azure.com/dnceng/", "internal", "1"]
+
+        runs = [_import_times() for _ in range(args.repeat)]
+        empty = [_wall_time(run_command, work_dir, env) for _ in range(args.repeat)]
+        baseline = [_wall_time([sys.executable, "-c", "pass"], work_dir) for _ in range(args.repeat)]
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    import_ms = _median(modules["run"] for modules, _ in runs) / 1000.0
+    # The modules run.py imports itself, slowest first
+    direct = {}
+    for _, run_imports in runs:
+        for name, cumulative in run_imports.items():
+            direct.setdefault(name, []).append(cumulative)
+    imported_lazy = sorted(name for name in LAZY_MODULES if any(name in modules for modules, _ in runs))
+
+    report = {
+        "python": sys.version.split()[0],
+        "parameters": {"repeat": args.repeat, "budget_ms": args.budget_ms},
+        "import_ms": round(import_ms, 2),
+        "direct_imports_ms": dict(sorted(
+            ((name, round(_median(times) / 1000.0, 2)) for name, times in direct.items()),
+            key=lambda item: -item[1])),
+        "modules_imported": _median(len(modules) for modules, _ in runs),
+        "empty_work_item_seconds": round(_median(empty), 4),
+        "interpreter_seconds": round(_median(baseline), 4),
+        "lazy_modules_imported": imported_lazy,
+        "within_budget": import_ms <= args.budget_ms and not imported_lazy,
+    }
+    json.dump(report, sys.stdout, indent=2)
+    sys.stdout.write("\n")
+
+    if imported_lazy:
+        sys.exit("Imported at startup, but should only be imported when needed: " + ", ".join(imported_lazy))
+    if import_ms > args.budget_ms:
+        sys.exit("Importing run.py took %.1fms, over the %.1fms budget" % (import_ms, args.budget_ms))
+
+
+if __name__ == "__main__":
+    main()
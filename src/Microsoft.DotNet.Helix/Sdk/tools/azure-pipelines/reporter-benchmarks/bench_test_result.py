@@ -0,0 +1,102 @@
+# Licensed to the .NET Foundation under one or more agreements.
+# The .NET Foundation licenses this file to you under the MIT license.
+
+"""Micro-benchmark for the _helix_compat TestResult / TestResultAttachment.
+
+Builds N results (one in ten failing with a Console_Output attachment, the
+way the parsers produce them) with the __slots__ based classes shipped in
+`_helix_compat` and with an equivalent __dict__ based container, and prints
+the construction time and the memory retained per result as JSON.
+
+    python bench_test_result.py [--count 1000000]
+"""
+
+import argparse
+import gc
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "reporter"))
+
+import _helix_compat  # noqa: E402
+
+
+class _DictTestResultAttachment(object):
+    def __init__(self, name, text):
+        self._name = name
+        self._text = text
+
+
+class _DictTestResult(object):
+    def __init__(self, name, kind, type_name, method, duration, result, exception_type, failure_message,
+                 stack_trace, skip_reason, attachments):
+        self._name = name
+        self._kind = kind
+        self._type = type_name
+        self._method = method
+        self._duration_seconds = duration
+        self._result = result
+        self._exception_type = exception_type
+        self._failure_message = failure_message
+        self._stack_trace = stack_trace
+        self._skip_reason = skip_reason
+        self._attachments = attachments
+        self.ignored = False
+
+
+def _build(count, result_type, attachment_type):
+    # Strings are shared between results so the measurement only covers the containers.
+    output = "x" * 64
+    results = []
+    for i in range(count):
+        if i % 10 == 0:
+            attachments = [attachment_type(u"Console_Output.log", output)]
+            results.append(result_type(u"Type.Method", u"xunit", u"Type", u"Method", 0.25, u"Fail",
+                                       u"System.Exception", u"message", u"stack", None, attachments))
+        else:
+            results.append(result_type(u"Type.Method", u"xunit", u"Type", u"Method", 0.25, u"Pass",
+                                       None, None, None, None, []))
+    return results
+
+
+def _measure(count, result_type, attachment_type):
+    gc.collect()
+    start = time.perf_counter()
+    results = _build(count, result_type, attachment_type)
+    elapsed = time.perf_counter() - start
+    del results
+
+    gc.collect()
+    tracemalloc.start()
+    results = _build(count, result_type, attachment_type)
+    retained, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del results
+
+    return {
+        "construct_seconds": round(elapsed, 4),
+        "results_per_second": int(count / elapsed) if elapsed else None,
+        "bytes_per_result": round(retained / count, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--count", type=int, default=1000000, help="number of results to build")
+    args = parser.parse_args()
+
+    report = {
+        "count": args.count,
+        "python": sys.version.split()[0],
+        "slots": _measure(args.count, _helix_compat.TestResult, _helix_compat.TestResultAttachment),
+        "dict": _measure(args.count, _DictTestResult, _DictTestResultAttachment),
+    }
+    json.dump(report, sys.stdout, indent=2)
+    sys.stdout.write("\n")
+
+
+if __name__ == "__main__":
+    main()
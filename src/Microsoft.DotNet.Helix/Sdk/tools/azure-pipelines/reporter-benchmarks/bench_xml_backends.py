@@ -0,0 +1,85 @@
+# Licensed to the .NET Foundation under one or more agreements.
+# The .NET Foundation licenses this file to you under the MIT license.
+
+"""Compares the reporter's XML backends on synthetic xunit, junit and TRX files.
+
+For every format, generates a results file with N tests and parses it with
+each available backend (lxml only when it is importable), printing the
+parse throughput as JSON. Also checks that every backend produced exactly
+the same results.
+
+    python bench_xml_backends.py [--tests 100000] [--stdout-bytes 0] [--repeat 3]
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "reporter"))
+
+import _helix_compat  # noqa: E402
+from formats import all_formats, xml_backend  # noqa: E402
+
+import generate  # noqa: E402
+
+
+def _parse(f, path):
+    digest = hashlib.sha256()
+    count = 0
+    start = time.perf_counter()
+    for result in f.read_results(path):
+        digest.update(_helix_compat._json_encoder.encode(_helix_compat._result_to_dict(result)).encode("utf-8"))
+        count += 1
+    return time.perf_counter() - start, count, digest.hexdigest()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--tests", type=int, default=100000)
+    parser.add_argument("--stdout-bytes", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=3, help="runs per backend; the fastest one is reported")
+    args = parser.parse_args()
+
+    backends = ["etree", "expat"]
+    if xml_backend._load_lxml():
+        backends.append("lxml")
+
+    report = {"tests": args.tests, "python": sys.version.split()[0], "formats": {}}
+    work_dir = tempfile.mkdtemp(prefix="reporter-bench-")
+    try:
+        for f in all_formats:
+            path = os.path.join(work_dir, generate.file_names[f.name])
+            generate.writers[f.name](path, args.tests, stdout_bytes=args.stdout_bytes)
+            timings = {}
+            digests = set()
+            for backend in backends:
+                xml_backend._backend = backend
+                best = None
+                for _ in range(args.repeat):
+                    elapsed, count, digest = _parse(f, path)
+                    digests.add(digest)
+                    best = elapsed if best is None else min(best, elapsed)
+                timings[backend] = {
+                    "seconds": round(best, 4),
+                    "results_per_second": int(count / best) if best else None,
+                }
+            if len(digests) != 1:
+                sys.exit("Backends produced different results for the %s file" % f.name)
+            report["formats"][f.name] = {
+                "file_bytes": os.path.getsize(path),
+                "backends": timings,
+            }
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    json.dump(report, sys.stdout, indent=2)
+    sys.stdout.write("\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+# Licensed to the .NET Foundation under one or more agreements.
+# The .NET Foundation licenses this file to you under the MIT license.
+
+"""Benchmarks formats/xunit.py's _unescape_xunit_message against the original.
+
+First checks, on a differential corpus of hand-picked edge cases plus
+seeded random messages, that the current implementation returns exactly
+what the original re.sub implementation (kept below as the reference)
+returns, and exits with an error if any message differs. Then times both
+on small, large and escape-free messages and prints the report as JSON.
+
+    python bench_xunit_unescape.py [--random-cases 20000] [--repeat 5]
+"""
+
+import argparse
+import json
+import os
+import random
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "reporter"))
+
+from formats.xunit import _unescape_char_map, _unescape_xunit_message  # noqa: E402
+
+
+def reference_unescape_xunit_message(value):
+    # The implementation before the fast path, unchanged.
+    def bs(match):
+        grp = match.group(0)
+        sym = grp[1]
+        if sym == 'x':
+            return chr(int(grp[2:], 16))
+        return _unescape_char_map.get(match.group(0)[1]) or sym
+    return re.sub(r'\\x[0-9a-fA-F][0-9a-fA-F][0-9a-fA-F]?[0-9a-fA-F]?|\\[^x]', bs, value)
+
+
+_EDGE_CASES = [
+    "",
+    "no escapes at all",
+    "\\",
+    "trailing backslash \\",
+    "\\\\",
+    "\\\\\\",
+    "\\\\x41",
+    "\\x",
+    "\\x4",
+    "\\x41",
+    "\\x414",
+    "\\x4142",
+    "\\x41424",
+    "\\xg1",
+    "\\x4g",
+    "\\xAbCd",
+    "\\xd800 lone surrogate",
+    "\\x0000",
+    "\\r\\n\\t\\0\\a\\b\\v\\f",
+    "\\q\\z\\\"\\'\\ ",
+    "\\\n escaped newline",
+    "\\\r\\\t",
+    "\\é \\中 \\\U0001f600",
+    "Assert.Equal() Failure\\r\\n  Expected: 1\\r\\n  Actual:   \\x3c2\\x3e\\t(\\\"quoted\\\")",
+    "\\x3c\\x3e" * 100,
+]
+
+_RANDOM_ALPHABET = "\\\\\\\\xX0123456789abcdefABCDEFgrntvq \n\"é"
+
+
+def _corpus(random_cases, seed=0):
+    rng = random.Random(seed)
+    for case in _EDGE_CASES:
+        yield case
+    for _ in range(random_cases):
+        yield "".join(rng.choice(_RANDOM_ALPHABET) for _ in range(rng.randrange(40)))
+
+
+def _check(random_cases):
+    count = 0
+    for case in _corpus(random_cases):
+        expected = reference_unescape_xunit_message(case)
+        actual = _unescape_xunit_message(case)
+        if actual != expected or type(actual) is not type(expected):
+            sys.exit("Mismatch for %r: expected %r, got %r" % (case, expected, actual))
+        count += 1
+    for case in (None, b"\\x41"):
+        if _raises_type_error(reference_unescape_xunit_message, case) != _raises_type_error(_unescape_xunit_message, case):
+            sys.exit("Different error behavior for %r" % (case,))
+    return count
+
+
+def _raises_type_error(function, value):
+    try:
+        function(value)
+    except TypeError:
+        return True
+    return False
+
+
+def _payloads():
+    line = "  \\x3cElement attr=\\\"value\\\"\\x3e text \\t(\\\"quoted\\\")\\r\\n"
+    return {
+        "small": "Assert.Equal() Failure\\r\\n  Expected: 1\\r\\n  Actual:   \\x3c2\\x3e\\t(\\\"quoted\\\")",
+        "large_diff": "Assert.Equal() Failure\\r\\n" + line * 20000,
+        "no_escapes": "Assert.True() Failure. Expected: True, Actual: False. " * 5000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--random-cases", type=int, default=20000)
+    parser.add_argument("--repeat", type=int, default=5, help="timing runs; the fastest one is reported")
+    args = parser.parse_args()
+
+    report = {"python": sys.version.split()[0], "corpus_cases": _check(args.random_cases), "payloads": {}}
+    for name, payload in _payloads().items():
+        # Aim for roughly the same total work per payload
+        number = max(1, 2000000 // (len(payload) + 100))
+        timings = {}
+        for label, function in (("reference", reference_unescape_xunit_message), ("current", _unescape_xunit_message)):
+            best = min(timeit.repeat(lambda: function(payload), number=number, repeat=args.repeat)) / number
+            timings[label] = round(best * 1e6, 2)
+        report["payloads"][name] = {
+            "chars": len(payload),
+            "microseconds": timings,
+            "speedup": round(timings["reference"] / timings["current"], 2) if timings["current"] else None,
+        }
+
+    json.dump(report, sys.stdout, indent=2)
+    sys.stdout.write("\n")
+
+
+if __name__ == "__main__":
+    main()
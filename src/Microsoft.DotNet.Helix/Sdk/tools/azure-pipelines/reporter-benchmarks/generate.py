@@ -0,0 +1,151 @@
+# Licensed to the .NET Foundation under one or more agreements.
+# The .NET Foundation licenses this file to you under the MIT license.
+
+"""Deterministic generators for synthetic xunit, junit and TRX results files.
+
+The same arguments always produce byte-identical files, so timings from
+different runs (or different machines) are comparable.
+
+    python generate.py <xunit|junit|trx> <path> [--tests N] [--failure-ratio R]
+                       [--skip-ratio R] [--stdout-bytes N] [--seed N]
+"""
+
+import argparse
+import random
+from xml.sax.saxutils import escape, quoteattr
+
+
+_TRX_NAMESPACE = "http://microsoft.com/schemas/VisualStudio/TeamTest/2010"
+
+_STDOUT_LINE = "[xUnit.net 00:00:%02d.%03d] Some.Test.Namespace.Class%d.Method%d: request %08x took %dms\n"
+
+
+def _outcomes(tests, failure_ratio, skip_ratio, seed):
+    rng = random.Random(seed)
+    for i in range(tests):
+        roll = rng.random()
+        if roll < failure_ratio:
+            yield i, "Fail"
+        elif roll < failure_ratio + skip_ratio:
+            yield i, "Skip"
+        else:
+            yield i, "Pass"
+
+
+def _stdout(i, stdout_bytes):
+    # Lines vary like real logs do, so compression ratios are not wildly optimistic.
+    rng = random.Random(i)
+    lines = []
+    size = 0
+    while size < stdout_bytes:
+        line = _STDOUT_LINE % (
+            rng.randrange(60), rng.randrange(1000), i % 50, i, rng.getrandbits(32), rng.randrange(5000))
+        lines.append(line)
+        size += len(line)
+    return "".join(lines)[:stdout_bytes]
+
+
+def _failure_message(i):
+    # Contains the escapes xunit writes into its messages, so the xunit
+    # unescaping code is exercised too.
+    return "Assert.Equal() Failure\\r\\n  Expected: %d\\r\\n  Actual:   \\x3c%d\\x3e\\t(\\\"quoted\\\")" % (i, i + 1)
+
+
+def _stack_trace(i):
+    return "   at Some.Test.Namespace.Class%d.Method%d() in /src/Tests/Class.cs:line %d\n" % (i % 50, i, i % 500)
+
+
+def write_xunit(path, tests, failure_ratio=0.1, skip_ratio=0.05, stdout_bytes=0, seed=0):
+    with open(path, "w", encoding="utf-8") as f:
+        f.write('<?xml version="1.0" encoding="utf-8"?>\n<assemblies>\n')
+        f.write('<assembly name="Synthetic.Tests.dll" total="%d">\n<collection name="Synthetic">\n' % tests)
+        for i, outcome in _outcomes(tests, failure_ratio, skip_ratio, seed):
+            type_name = "Some.Test.Namespace.Class%d" % (i % 50)
+            method = "Method%d" % i
+            f.write('<test name=%s type=%s method=%s time="%.4f" result="%s">' % (
+                quoteattr(type_name + "." + method), quoteattr(type_name), quoteattr(method), (i % 97) / 100.0, outcome))
+            if outcome == "Fail":
+                f.write('<failure exception-type="Xunit.Sdk.EqualException"><message>%s</message>'
+                        '<stack-trace>%s</stack-trace></failure>' % (escape(_failure_message(i)), escape(_stack_trace(i))))
+                if stdout_bytes:
+                    f.write("<output>%s</output>" % escape(_stdout(i, stdout_bytes)))
+            elif outcome == "Skip":
+                f.write("<reason>Skipped for test %d</reason>" % i)
+            f.write("</test>\n")
+        f.write("</collection>\n</assembly>\n</assemblies>\n")
+
+
+def write_junit(path, tests, failure_ratio=0.1, skip_ratio=0.05, stdout_bytes=0, seed=0):
+    with open(path, "w", encoding="utf-8") as f:
+        f.write('<?xml version="1.0" encoding="utf-8"?>\n<testsuites>\n<testsuite name="synthetic" tests="%d">\n' % tests)
+        for i, outcome in _outcomes(tests, failure_ratio, skip_ratio, seed):
+            f.write('<testcase name="test_%d" classname="synthetic.module%d.TestClass" time="%.4f">' % (
+                i, i % 50, (i % 97) / 100.0))
+            if outcome == "Fail":
+                f.write('<failure type="AssertionError" message=%s>%s</failure>' % (
+                    quoteattr("assert %d == %d" % (i, i + 1)), escape(_stack_trace(i))))
+                if stdout_bytes:
+                    f.write("<system-out>%s</system-out>" % escape(_stdout(i, stdout_bytes)))
+                    f.write("<system-err>stderr of test %d</system-err>" % i)
+            elif outcome == "Skip":
+                f.write("<skipped>Skipped for test %d</skipped>" % i)
+            f.write("</testcase>\n")
+        f.write("</testsuite>\n</testsuites>\n")
+
+
+def write_trx(path, tests, failure_ratio=0.1, skip_ratio=0.05, stdout_bytes=0, seed=0):
+    # Laid out the way vstest writes it: Results before TestDefinitions.
+    with open(path, "w", encoding="utf-8") as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n<TestRun id="00000000-0000-0000-0000-000000000000" xmlns="%s">\n'
+                % _TRX_NAMESPACE)
+        f.write("<Results>\n")
+        for i, outcome in _outcomes(tests, failure_ratio, skip_ratio, seed):
+            trx_outcome = {"Pass": "Passed", "Fail": "Failed", "Skip": "NotExecuted"}[outcome]
+            f.write('<UnitTestResult testId="id-%d" testName="Method%d" outcome="%s" duration="00:00:%02d.%07d">' % (
+                i, i, trx_outcome, i % 60, i % 10000000))
+            if outcome == "Fail":
+                f.write("<Output>")
+                if stdout_bytes:
+                    f.write("<StdOut>%s</StdOut><StdErr>stderr of test %d</StdErr>" % (escape(_stdout(i, stdout_bytes)), i))
+                f.write("<ErrorInfo><Message>%s</Message><StackTrace>%s</StackTrace></ErrorInfo></Output>" % (
+                    escape("Assert.AreEqual failed. Expected:<%d>. Actual:<%d>." % (i, i + 1)), escape(_stack_trace(i))))
+            elif outcome == "Skip":
+                f.write("<Output><StdOut>Skipped for test %d</StdOut></Output>" % i)
+            f.write("</UnitTestResult>\n")
+        f.write("</Results>\n<TestDefinitions>\n")
+        for i in range(tests):
+            f.write('<UnitTest name="Method%d" id="id-%d"><TestMethod className="Some.Test.Namespace.Class%d" name="Method%d" />'
+                    '</UnitTest>\n' % (i, i, i % 50, i))
+        f.write("</TestDefinitions>\n</TestRun>\n")
+
+
+writers = {
+    "xunit": write_xunit,
+    "junit": write_junit,
+    "trx": write_trx,
+}
+
+# File names each parser picks up during the directory walk.
+file_names = {
+    "xunit": "testResults.xml",
+    "junit": "junit-results.xml",
+    "trx": "results.trx",
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("format", choices=sorted(writers))
+    parser.add_argument("path")
+    parser.add_argument("--tests", type=int, default=100000)
+    parser.add_argument("--failure-ratio", type=float, default=0.1)
+    parser.add_argument("--skip-ratio", type=float, default=0.05)
+    parser.add_argument("--stdout-bytes", type=int, default=0,
+                        help="size of the stdout attachment written for each failing test")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    writers[args.format](args.path, args.tests, args.failure_ratio, args.skip_ratio, args.stdout_bytes, args.seed)
+
+
+if __name__ == "__main__":
+    main()
@@ -16,6 +16,9 @@ reporter actually consumes:
     - TestResultAttachment (data container)
     - AzureDevOpsReportingParameters (data container)
     - JsonReporter         (writes a portable JSON results file)
+    - JsonResultsReader    (streams the TestResults back out of that file)
+    - ColumnarReporter     (writes the optional columnar results file)
+    - ColumnarResults      (memory-maps that file for column scans)
 
 The constructors mirror the signatures used by the format parsers and by
 run.py so they can be swapped in transparently when the real classes are
@@ -27,11 +30,35 @@ consumed by either the legacy Python Helix client or a native (e.g. C#)
 client without spawning Python.
 """
 
+import gzip
+import hashlib
+import io
 import json
 import logging
+import mmap
 import os
+import re
+import struct
+import sys
+import tempfile
+from array import array
 from typing import Iterable, List, Optional
 
+# Optional; only needed to write or read zstd-compressed results files, so it is
+# imported by _load_zstandard() when one is.
+zstandard = None
+
+
+def _load_zstandard():
+    """Imports zstandard, returning False when it is not installed."""
+    global zstandard
+    if zstandard is None:
+        try:
+            import zstandard
+        except ImportError:
+            return False
+    return True
+
 
 # Schema version embedded in every emitted JSON file. Bump when the on-disk
 # layout changes in a backwards-incompatible way; consumers should refuse
@@ -43,6 +70,45 @@ SCHEMA_VERSION = 1
 # new file is the real JSON.
 JSON_RESULTS_FILENAME = "__test_report_v2.json"
 
+# Extension appended to JSON_RESULTS_FILENAME for each supported compression.
+JSON_COMPRESSION_SUFFIXES = {
+    "gzip": ".gz",
+    "zstd": ".zst",
+}
+
+# With sharding enabled, results go to numbered shard files instead, each a
+# complete results document, listed by a manifest written once all of them are.
+JSON_SHARD_FILENAME_FORMAT = "__test_report_v2.shard{:04d}.json"
+JSON_MANIFEST_FILENAME = "__test_report_v2.manifest.json"
+
+_RESULTS_FILE_PATTERN = re.compile(
+    r"__test_report_v2(\.shard\d+)?\.json(\.gz|\.zst)?$|__test_report_v2\.manifest\.json$")
+
+_GZIP_MAGIC = b"\x1f\x8b"
+_ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+# Favour speed: the reporter is on the critical path of every work item and
+# the text in results files compresses well even at low levels.
+_GZIP_LEVEL = 1
+_ZSTD_LEVEL = 3
+
+
+def _create_temp_file(path):
+    """Creates a new file next to path to be written and renamed over it; returns (fd, temp_path).
+
+    Unlike mkstemp, which makes its files readable by their owner only, the
+    file gets the mode open() would have given it (0666 less the umask):
+    results files are read by consumers that may run as another user.
+    """
+    flags = os.O_CREAT | os.O_EXCL | os.O_WRONLY | getattr(os, "O_BINARY", 0)
+    for _ in range(tempfile.TMP_MAX):
+        temp_path = "%s.%s.tmp" % (path, os.urandom(6).hex())
+        try:
+            return os.open(temp_path, flags, 0o666), temp_path
+        except FileExistsError:
+            continue
+    raise FileExistsError("No usable temporary file name found for '%s'" % path)
+
 
 def _results_dir():
     """Return the directory the JSON results file is written into.
@@ -55,15 +121,89 @@ def _results_dir():
     return os.environ.get("HELIX_WORKITEM_ROOT") or os.getcwd()
 
 
-def json_results_path():
+def json_results_path(compression=None):
     """Absolute path to the JSON results file for the current work item."""
-    return os.path.join(_results_dir(), JSON_RESULTS_FILENAME)
+    return os.path.join(_results_dir(), JSON_RESULTS_FILENAME + JSON_COMPRESSION_SUFFIXES.get(compression, ""))
+
+
+def json_shard_path(index, compression=None):
+    """Absolute path to the index-th shard file for the current work item."""
+    return os.path.join(_results_dir(),
+                        JSON_SHARD_FILENAME_FORMAT.format(index) + JSON_COMPRESSION_SUFFIXES.get(compression, ""))
+
+
+def json_manifest_path():
+    """Absolute path to the shard manifest for the current work item."""
+    return os.path.join(_results_dir(), JSON_MANIFEST_FILENAME)
+
+
+def find_json_results(directory=None):
+    """Path of the results file in `directory`, compressed or not, or None.
+
+    `directory` defaults to the current work item's results directory.
+    """
+    directory = directory or _results_dir()
+    for suffix in [""] + sorted(JSON_COMPRESSION_SUFFIXES.values()):
+        path = os.path.join(directory, JSON_RESULTS_FILENAME + suffix)
+        if os.path.isfile(path):
+            return path
+    return None
+
+
+def open_json_results(path):
+    """Opens a results file for reading as text, decompressing it if needed.
+
+    The compression is detected from the file's content, not its name.
+    """
+    with open(path, "rb") as f:
+        magic = f.read(len(_ZSTD_MAGIC))
+    if magic.startswith(_GZIP_MAGIC):
+        return gzip.open(path, "rt", encoding="utf-8")
+    if magic == _ZSTD_MAGIC:
+        if not _load_zstandard():
+            raise RuntimeError("'%s' is zstd-compressed but the zstandard package is not installed" % path)
+        return io.TextIOWrapper(zstandard.ZstdDecompressor().stream_reader(open(path, "rb"), closefd=True),
+                                encoding="utf-8")
+    return open(path, "r", encoding="utf-8")
+
+
+def load_json_results(path=None):
+    """Loads a results file written by JsonReporter, compressed or not.
+
+    With no `path`, loads the current work item's results file. Returns the
+    decoded document. Raises ValueError for an unknown schema_version.
+    """
+    if path is None:
+        path = find_json_results()
+        if path is None:
+            raise FileNotFoundError("No %s results file in '%s'" % (JSON_RESULTS_FILENAME, _results_dir()))
+    with open_json_results(path) as f:
+        document = json.load(f)
+    if document.get("schema_version") != SCHEMA_VERSION:
+        raise ValueError("Unsupported schema_version %r in '%s'" % (document.get("schema_version"), path))
+    return document
+
+
+def load_json_manifest(path=None):
+    """Loads the manifest written by a sharding JsonReporter.
+
+    With no `path`, loads the current work item's manifest. Returns the
+    decoded manifest; the shard paths in it are relative to its directory.
+    Raises ValueError for an unknown schema_version.
+    """
+    path = path or json_manifest_path()
+    with open(path, "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    if manifest.get("schema_version") != SCHEMA_VERSION:
+        raise ValueError("Unsupported schema_version %r in '%s'" % (manifest.get("schema_version"), path))
+    return manifest
 
 
 class TestResultAttachment(object):
     """API-compatible stand-in for helix.public.TestResultAttachment."""
 
     __test__ = False  # pytest: do not collect
+    __slots__ = ("_name", "_text")
 
     def __init__(self, name, text):
         self._name = name
@@ -86,6 +226,23 @@ class TestResult(object):
 
     __test__ = False  # pytest: do not collect
 
+    # Every parser creates one of these per test case, so they make up most
+    # of the reporter's memory. __slots__ drops the per-instance __dict__.
+    __slots__ = (
+        "_name",
+        "_kind",
+        "_type",
+        "_method",
+        "_duration_seconds",
+        "_result",
+        "_exception_type",
+        "_failure_message",
+        "_stack_trace",
+        "_skip_reason",
+        "_attachments",
+        "ignored",
+    )
+
     def __init__(self,
                  name,
                  kind,
@@ -172,6 +329,29 @@ class TestResult(object):
         }
 
 
+# (TestResult, TestResultAttachment) the parsers build results with; see result_types().
+_result_types = None
+
+
+def result_types():
+    """Returns the (TestResult, TestResultAttachment) types results are built with.
+
+    helix-scripts' own types are preferred, so that the legacy pickle keeps
+    its fully-qualified class names; the stand-ins above are used when it is
+    not installed. helix.public is imported on the first call, not when the
+    reporter is loaded, so callers look the types up when they are
+    constructed rather than at import time.
+    """
+    global _result_types
+    if _result_types is None:
+        try:
+            from helix.public import TestResult as test_result, TestResultAttachment as test_result_attachment
+        except ImportError:
+            test_result, test_result_attachment = TestResult, TestResultAttachment
+        _result_types = test_result, test_result_attachment
+    return _result_types
+
+
 class AzureDevOpsReportingParameters(object):
     """API-compatible stand-in for helix.public.AzureDevOpsReportingParameters."""
 
@@ -219,6 +399,70 @@ def _result_to_dict(r):
     }
 
 
+# Reused for every result; json.dumps() builds a new encoder per call when
+# given non-default arguments. Produces the same bytes as json.dump().
+_json_encoder = json.JSONEncoder(ensure_ascii=False)
+
+
+class _JsonResultsWriter(object):
+    """Streams one JSON results file to disk, one result at a time.
+
+    The header is written up front and each result is encoded as soon as it
+    is handed in, so only one result is held in memory at a time. Everything
+    goes to a temporary file in the destination directory that is renamed
+    over `path` by close(), so readers never see a partially written file.
+    """
+
+    def __init__(self, path, azdo_parameters, compression=None):
+        self.path = path
+        self.count = 0
+        # Uncompressed length of the results written so far, in characters
+        self.size = 0
+        directory = os.path.dirname(path)
+        try:
+            os.makedirs(directory, exist_ok=True)
+        except OSError:
+            # Directory already exists or cannot be created; let _create_temp_file() raise.
+            pass
+        fd, self._temp_path = _create_temp_file(path)
+        self._raw = io.open(fd, "wb")
+        # The text is encoded and compressed as it is written, never buffered whole.
+        if compression == "gzip":
+            stream = gzip.GzipFile(fileobj=self._raw, mode="wb", compresslevel=_GZIP_LEVEL, mtime=0)
+        elif compression == "zstd":
+            stream = zstandard.ZstdCompressor(level=_ZSTD_LEVEL).stream_writer(self._raw, closefd=False)
+        else:
+            stream = self._raw
+        self._file = io.TextIOWrapper(stream, encoding="utf-8")
+        self._file.write('{"schema_version": ')
+        self._file.write(_json_encoder.encode(SCHEMA_VERSION))
+        self._file.write(', "azdo": ')
+        self._file.write(_json_encoder.encode(_azdo_to_dict(azdo_parameters)))
+        self._file.write(', "results": [')
+
+    def write(self, result):
+        if self.count:
+            self._file.write(", ")
+        encoded = _json_encoder.encode(_result_to_dict(result))
+        self._file.write(encoded)
+        self.count += 1
+        self.size += len(encoded)
+
+    def close(self):
+        self._file.write("]}")
+        self._file.close()
+        self._raw.close()
+        os.replace(self._temp_path, self.path)
+
+    def abort(self):
+        self._file.close()
+        self._raw.close()
+        try:
+            os.remove(self._temp_path)
+        except OSError:
+            pass
+
+
 class JsonReporter(object):
     """Writes a portable, schema-versioned JSON file with the test results.
 
@@ -231,36 +475,150 @@ class JsonReporter(object):
           "azdo": { "collection_uri", "team_project", "test_run_id", "access_token" },
           "results": [ { TestResult fields }, ... ]
         }
+
+    Results are serialized one at a time as `results` yields them, so the
+    reporter never holds the full result set in memory.
+
+    With `compression` set to "gzip" or "zstd" the same document is streamed
+    through that compressor into `__test_report_v2.json.gz` / `.zst`
+    instead. zstd needs the optional zstandard package and falls back to
+    gzip without it. load_json_results() reads any of the three forms.
+
+    With `shard_max_results` and/or `shard_max_bytes` set, the results are
+    split over `__test_report_v2.shardNNNN.json` files instead, each a
+    complete document with the layout above. A new shard is started once the
+    current one holds shard_max_results results or shard_max_bytes of
+    (uncompressed) result JSON. Once every shard is written,
+    `__test_report_v2.manifest.json` lists them with their result counts,
+    sizes and SHA-256 hashes; see load_json_manifest().
     """
 
     __test__ = False
 
-    def __init__(self, azdo_parameters, log=None):
+    def __init__(self, azdo_parameters, log=None, compression=None, shard_max_results=None, shard_max_bytes=None):
         self._azdo = azdo_parameters
         self._log = log or logging.getLogger(__name__)
+        self._compression = _resolve_compression(compression, self._log)
+        self._shard_max_results = shard_max_results
+        self._shard_max_bytes = shard_max_bytes
+
+    @property
+    def _sharded(self):
+        return bool(self._shard_max_results or self._shard_max_bytes)
 
     def report_results(self, results):
-        results = [r for r in (results or []) if r is not None]
-        path = json_results_path()
-        payload = {
-            "schema_version": SCHEMA_VERSION,
-            "azdo": _azdo_to_dict(self._azdo),
-            "results": [_result_to_dict(r) for r in results],
-        }
+        if self._sharded:
+            self._report_sharded(results)
+            return
+
+        path = json_results_path(self._compression)
+        self._log.info("Writing test results to '%s' (JSON v%d)", path, SCHEMA_VERSION)
+        writer = _JsonResultsWriter(path, self._azdo, self._compression)
+        try:
+            for r in (results or []):
+                if r is not None:
+                    writer.write(r)
+        except BaseException:
+            writer.abort()
+            raise
+        writer.close()
         try:
-            os.makedirs(os.path.dirname(path), exist_ok=True)
+            size = os.path.getsize(path)
+            self._log.info("Wrote %d test results (%d bytes) to '%s'", writer.count, size, path)
         except OSError:
-            # Directory already exists or cannot be created; let open() raise.
             pass
-        self._log.info("Writing %d test results to '%s' (JSON v%d)",
-                       len(results), path, SCHEMA_VERSION)
-        with open(path, "w", encoding="utf-8") as f:
-            json.dump(payload, f, ensure_ascii=False)
+
+        _remove_stale_results([path])
+
+    def _shard_full(self, writer):
+        if self._shard_max_results and writer.count >= self._shard_max_results:
+            return True
+        return bool(self._shard_max_bytes) and writer.size >= self._shard_max_bytes
+
+    def _report_sharded(self, results):
+        self._log.info("Writing test results to '%s' shards (JSON v%d)", json_shard_path(0, self._compression),
+                       SCHEMA_VERSION)
+        # The shards are overwritten one by one; if writing fails partway, a manifest from an earlier
+        # run must not be left listing them
         try:
-            size = os.path.getsize(path)
-            self._log.info("Wrote %d bytes to '%s'", size, path)
+            os.remove(json_manifest_path())
         except OSError:
             pass
+        shards = []
+        writer = _JsonResultsWriter(json_shard_path(0, self._compression), self._azdo, self._compression)
+        try:
+            for r in (results or []):
+                if r is None:
+                    continue
+                if writer.count and self._shard_full(writer):
+                    writer.close()
+                    shards.append(_shard_entry(writer))
+                    writer = _JsonResultsWriter(json_shard_path(len(shards), self._compression), self._azdo,
+                                                self._compression)
+                writer.write(r)
+        except BaseException:
+            writer.abort()
+            raise
+        writer.close()
+        shards.append(_shard_entry(writer))
+
+        manifest = {
+            "schema_version": SCHEMA_VERSION,
+            "total_results": sum(shard["results"] for shard in shards),
+            "shards": shards,
+        }
+        path = json_manifest_path()
+        fd, temp_path = _create_temp_file(path)
+        with io.open(fd, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(temp_path, path)
+        self._log.info("Wrote %d test results to %d shards listed in '%s'", manifest["total_results"], len(shards),
+                       path)
+
+        _remove_stale_results([path] + [os.path.join(os.path.dirname(path), shard["file"]) for shard in shards])
+
+
+def _shard_entry(writer):
+    digest = hashlib.sha256()
+    with open(writer.path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return {
+        "file": os.path.basename(writer.path),
+        "results": writer.count,
+        "bytes": os.path.getsize(writer.path),
+        "sha256": digest.hexdigest(),
+    }
+
+
+def _resolve_compression(compression, log):
+    """Validates a requested results file compression, falling back where needed."""
+    if compression and compression not in JSON_COMPRESSION_SUFFIXES:
+        log.warning("Unknown results file compression '%s'; writing uncompressed JSON", compression)
+        compression = None
+    if compression == "zstd" and not _load_zstandard():
+        log.warning("zstandard is not installed; compressing the results file with gzip instead")
+        compression = "gzip"
+    return compression or None
+
+
+def _remove_stale_results(keep):
+    # Don't leave results files from an earlier run next to the ones just
+    # written (in another compression, or shards that are no longer listed); a
+    # consumer could pick up a stale file first.
+    directory = _results_dir()
+    try:
+        names = os.listdir(directory)
+    except OSError:
+        return
+    keep = set(os.path.normcase(os.path.abspath(path)) for path in keep)
+    for name in names:
+        path = os.path.join(directory, name)
+        if _RESULTS_FILE_PATTERN.match(name) and os.path.normcase(os.path.abspath(path)) not in keep:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
 
 
 def _azdo_to_dict(p):
@@ -272,3 +630,622 @@ def _azdo_to_dict(p):
         "test_run_id": getattr(p, "test_run_id", None),
         "access_token": getattr(p, "access_token", None),
     }
+
+
+_WHITESPACE = re.compile(r"[ \t\n\r]*")
+# The rest of a JSON string up to (not including) its closing quote. Stops
+# early at a backslash that is the last character of the buffer.
+_STRING_BODY = re.compile(r'[^"\\]*(?:\\.[^"\\]*)*', re.DOTALL)
+# A key of the object being read, with its colon and the surrounding
+# whitespace and comma, and the end of that object.
+_KEY = re.compile(r'[ \t\n\r,]*"((?:[^"\\]|\\.)*)"[ \t\n\r]*:[ \t\n\r]*', re.DOTALL)
+_OBJECT_END = re.compile(r"[ \t\n\r,]*}")
+# Text up to the next bracket, taking in any complete strings on the way.
+_SKIP_TEXT = re.compile(r'[^"\[\]{}]*(?:"[^"\\]*(?:\\.[^"\\]*)*"[^"\[\]{}]*)*', re.DOTALL)
+_SCALAR_END = re.compile(r"[,\]}\s]")
+# The start of a result up to its outcome, when only scalars come before it
+# (as in every file JsonReporter writes). Lets a filtered-out result be
+# recognized with a single match.
+_RESULT_PREFIX = re.compile(
+    r'\{[ \t\n\r]*(?:"(?:[^"\\]|\\.)*"[ \t\n\r]*:[ \t\n\r]*(?:"(?:[^"\\]|\\.)*"|[^"\[\]{},\s]*)[ \t\n\r]*,[ \t\n\r]*)*?'
+    r'"result"[ \t\n\r]*:[ \t\n\r]*"([^"\\]*)"', re.DOTALL)
+_json_decoder = json.JSONDecoder()
+
+_READ_CHUNK_SIZE = 1024 * 1024
+
+
+class JsonResultsReader(object):
+    """Streams the TestResults out of a results file written by JsonReporter.
+
+    Unlike load_json_results(), the file is never loaded whole: it is read
+    in chunks and scanned incrementally, so memory use is bounded by the
+    largest single result rather than by the file. Compressed files and
+    shards are read the same way. schema_version is checked before the first
+    result is yielded (and so must come before `results` in the file, as it
+    does in every file the reporter writes); `azdo` holds the file's azdo
+    object once iteration has started.
+
+    `results` restricts the iteration to results with one of the given
+    outcomes, e.g. ("Fail",), and `include_attachments=False` leaves the
+    attachments out. Either way, the parts of the file that are filtered out
+    are skipped over by the scanner without being decoded.
+    """
+
+    __test__ = False
+
+    def __init__(self, path=None, results=None, include_attachments=True):
+        self._path = path
+        self._results = frozenset(results) if results is not None else None
+        self._include_attachments = include_attachments
+        self.azdo = None
+        self._file = None
+        self._buffer = ""
+        self._pos = 0
+        self._eof = False
+
+    def __iter__(self):
+        path = self._path
+        if path is None:
+            path = find_json_results()
+            if path is None:
+                raise FileNotFoundError("No %s results file in '%s'" % (JSON_RESULTS_FILENAME, _results_dir()))
+        with open_json_results(path) as f:
+            self._file = f
+            self._buffer = ""
+            self._pos = 0
+            self._eof = False
+
+            self._expect("{")
+            schema_version = None
+            for key in self._keys():
+                if key == "schema_version":
+                    schema_version = self._decode()
+                    if schema_version != SCHEMA_VERSION:
+                        raise ValueError("Unsupported schema_version %r in '%s'" % (schema_version, path))
+                elif key == "azdo":
+                    self.azdo = self._decode()
+                elif key == "results":
+                    if schema_version is None:
+                        raise ValueError("'%s' cannot be streamed: 'results' comes before 'schema_version'" % path)
+                    for result in self._read_results():
+                        yield result
+                else:
+                    self._skip()
+            if schema_version is None:
+                raise ValueError("No schema_version in '%s'" % path)
+
+    def _read_results(self):
+        self._expect("[")
+        while True:
+            c = self._peek()
+            if c == "]":
+                self._pos += 1
+                return
+            if c == ",":
+                self._pos += 1
+                continue
+            if self._results is not None:
+                match = _RESULT_PREFIX.match(self._buffer, self._pos)
+                if match is not None and match.group(1) not in self._results:
+                    self._pos = match.end()
+                    self._skip(depth=1)
+                    continue
+            if self._results is None and self._include_attachments:
+                # Nothing to filter, so let the json module decode the whole result
+                result = self._decode()
+            else:
+                result = self._read_result()
+            if result is not None:
+                yield _result_from_json(result)
+
+    def _read_result(self):
+        self._expect("{")
+        result = {}
+        while True:
+            key = self._next_key()
+            if key is None:
+                return result
+            if key == "attachments" and not self._include_attachments:
+                self._skip()
+                continue
+            value = result[key] = self._decode()
+            if key == "result" and self._results is not None and value not in self._results:
+                # Skip the rest of this result, which is usually where its messages and attachments are
+                self._skip(depth=1)
+                return None
+
+    def _keys(self):
+        """Yields each key of the object being read, leaving the reader at its value."""
+        while True:
+            key = self._next_key()
+            if key is None:
+                return
+            yield key
+
+    def _next_key(self):
+        """Moves past the next key of the object being read and returns it, or None at its end."""
+        while True:
+            match = _KEY.match(self._buffer, self._pos)
+            if match is not None:
+                self._pos = match.end()
+                key = match.group(1)
+                return key if "\\" not in key else json.loads('"' + key + '"')
+            match = _OBJECT_END.match(self._buffer, self._pos)
+            if match is not None:
+                self._pos = match.end()
+                return None
+            if not self._fill(grow=True):
+                raise ValueError("Expected a key at '%s' in the results file" % self._buffer[self._pos:self._pos + 20])
+
+    def _fill(self, grow=False):
+        """Reads another chunk, dropping what has been consumed. Returns False at EOF."""
+        if self._eof:
+            return False
+        size = _READ_CHUNK_SIZE
+        if grow:
+            # Retrying a value that did not fit: read at least as much again so
+            # huge values are rescanned a logarithmic number of times
+            size = max(size, len(self._buffer) - self._pos)
+        chunk = self._file.read(size)
+        self._buffer = self._buffer[self._pos:] + chunk
+        self._pos = 0
+        if not chunk:
+            self._eof = True
+        return bool(chunk)
+
+    def _peek(self):
+        while True:
+            self._pos = _WHITESPACE.match(self._buffer, self._pos).end()
+            if self._pos < len(self._buffer):
+                return self._buffer[self._pos]
+            if not self._fill():
+                raise ValueError("Unexpected end of the results file")
+
+    def _expect(self, c):
+        if self._peek() != c:
+            raise ValueError("Expected '%s' at '%s' in the results file" % (c, self._buffer[self._pos:self._pos + 20]))
+        self._pos += 1
+
+    def _decode(self):
+        c = self._buffer[self._pos:self._pos + 1]
+        if not c or c in " \t\n\r":
+            c = self._peek()
+        if c not in '[{"':
+            # A number or literal is only complete once what follows it is in
+            # the buffer; "1." would otherwise decode as 1
+            while _SCALAR_END.search(self._buffer, self._pos) is None and self._fill(grow=True):
+                pass
+        while True:
+            try:
+                value, self._pos = _json_decoder.raw_decode(self._buffer, self._pos)
+                return value
+            except ValueError:
+                if not self._fill(grow=True):
+                    raise
+
+    def _skip(self, depth=0):
+        """Moves past the next value without decoding it.
+
+        With depth > 0, moves past the end of the object or array that many
+        levels up instead. The skipped text is only scanned far enough to find
+        where it ends, not validated.
+        """
+        if depth == 0:
+            c = self._peek()
+            if c not in '[{"':
+                while True:
+                    match = _SCALAR_END.search(self._buffer, self._pos)
+                    if match is not None:
+                        self._pos = match.start()
+                        return
+                    self._pos = len(self._buffer)
+                    if not self._fill():
+                        return
+            self._pos += 1
+            if c != '"':
+                depth = 1
+            in_string = c == '"'
+        else:
+            in_string = False
+
+        while True:
+            if in_string:
+                # Strings are streamed through rather than buffered, however large
+                end = _STRING_BODY.match(self._buffer, self._pos).end()
+                if end < len(self._buffer) and self._buffer[end] == '"':
+                    self._pos = end + 1
+                    in_string = False
+                    if depth == 0:
+                        return
+                else:
+                    self._pos = end
+                    if not self._fill():
+                        raise ValueError("Unexpected end of the results file")
+                continue
+            self._pos = _SKIP_TEXT.match(self._buffer, self._pos).end()
+            if self._pos == len(self._buffer):
+                if not self._fill():
+                    raise ValueError("Unexpected end of the results file")
+                continue
+            c = self._buffer[self._pos]
+            self._pos += 1
+            if c == '"':
+                in_string = True
+            elif c in "[{":
+                depth += 1
+            else:
+                depth -= 1
+                if depth == 0:
+                    return
+
+
+def iter_json_results(path=None, results=None, include_attachments=True):
+    """Iterates over the TestResults in a results file without loading it whole.
+
+    See JsonResultsReader for the arguments.
+    """
+    return iter(JsonResultsReader(path, results=results, include_attachments=include_attachments))
+
+
+def _result_from_json(d, test_result=None, test_result_attachment=None):
+    """Builds a result from its JSON form, by default as this module's TestResult.
+
+    The parse cache passes helix.public's types instead, when installed, so
+    that cached results pickle the same as freshly parsed ones.
+    """
+    test_result = test_result or TestResult
+    test_result_attachment = test_result_attachment or TestResultAttachment
+    attachments = [test_result_attachment(name=a.get("name"), text=a.get("text"))
+                   for a in d.get("attachments") or []]
+    result = test_result(d.get("name"), d.get("kind"), d.get("type"), d.get("method"), d.get("duration_seconds"),
+                         d.get("result"), d.get("exception_type"), d.get("failure_message"), d.get("stack_trace"),
+                         d.get("skip_reason"), attachments)
+    # Results are created with ignored = False
+    if d.get("ignored"):
+        result.ignored = True
+    return result
+
+
+# Filename of the optional columnar results file, written next to the JSON
+# results file with HELIX_REPORTER_COLUMNAR=1. See ColumnarReporter.
+COLUMNAR_RESULTS_FILENAME = "__test_report_v2.columns"
+
+# Version of the columnar layout, independent of SCHEMA_VERSION.
+COLUMNAR_SCHEMA_VERSION = 1
+
+_COLUMNAR_MAGIC = b"HXRC"
+# magic, COLUMNAR_SCHEMA_VERSION
+_COLUMNAR_HEADER = struct.Struct("<4sI")
+# length of the footer, magic
+_COLUMNAR_TRAILER = struct.Struct("<Q4s")
+
+# Columns whose values repeat across results; stored once each, in the footer
+_DICTIONARY_COLUMNS = ("kind", "type", "result", "exception_type")
+# Columns stored in the blob region, as a file offset and length per result
+_STRING_COLUMNS = ("name", "method", "failure_message", "stack_trace", "skip_reason")
+_BLOB_COLUMNS = _STRING_COLUMNS + ("attachments",)
+
+_NAN = float("nan")
+
+
+def columnar_results_path():
+    """Absolute path to the columnar results file for the current work item."""
+    return os.path.join(_results_dir(), COLUMNAR_RESULTS_FILENAME)
+
+
+def remove_columnar_results():
+    """Removes the columnar results file of an earlier run, for runs that don't write one.
+
+    _remove_stale_results leaves it alone, as it is written alongside the JSON
+    results file, not instead of it.
+    """
+    try:
+        os.remove(columnar_results_path())
+    except OSError:
+        pass
+
+
+def _to_little_endian(values):
+    if sys.byteorder == "big":
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+class _ColumnarResultsWriter(object):
+    """Streams one columnar results file to disk.
+
+    Strings go to the blob region of the file as each result is handed in;
+    only the fixed size columns (about 100 bytes per result) are held in
+    memory, and written after the blobs by close(). As with
+    _JsonResultsWriter, everything goes to a temporary file that is renamed
+    over `path` once complete.
+    """
+
+    def __init__(self, path, azdo_parameters):
+        self.path = path
+        self.count = 0
+        directory = os.path.dirname(path)
+        try:
+            os.makedirs(directory, exist_ok=True)
+        except OSError:
+            # Directory already exists or cannot be created; let _create_temp_file() raise.
+            pass
+        fd, self._temp_path = _create_temp_file(path)
+        self._file = io.open(fd, "wb")
+        self._file.write(_COLUMNAR_HEADER.pack(_COLUMNAR_MAGIC, COLUMNAR_SCHEMA_VERSION))
+        self._offset = _COLUMNAR_HEADER.size
+        # The file is meant to be passed around for analysis, so it never holds the token
+        self._azdo = _azdo_to_dict(azdo_parameters)
+        self._azdo.pop("access_token", None)
+        self._dictionaries = dict((name, {}) for name in _DICTIONARY_COLUMNS)
+        self._codes = dict((name, array("I")) for name in _DICTIONARY_COLUMNS)
+        self._durations = array("d")
+        self._ignored = array("B")
+        self._offsets = dict((name, array("q")) for name in _BLOB_COLUMNS)
+        self._lengths = dict((name, array("i")) for name in _BLOB_COLUMNS)
+
+    def _write_blob(self, name, data):
+        if data is None:
+            self._offsets[name].append(0)
+            self._lengths[name].append(-1)
+            return
+        self._file.write(data)
+        self._offsets[name].append(self._offset)
+        self._lengths[name].append(len(data))
+        self._offset += len(data)
+
+    def write(self, result):
+        d = _result_to_dict(result)
+        for name in _DICTIONARY_COLUMNS:
+            value = d[name]
+            codes = self._dictionaries[name]
+            code = codes.get(value)
+            if code is None:
+                code = codes[value] = len(codes)
+            self._codes[name].append(code)
+        duration = d["duration_seconds"]
+        self._durations.append(_NAN if duration is None else float(duration))
+        self._ignored.append(1 if d["ignored"] else 0)
+        for name in _STRING_COLUMNS:
+            value = d[name]
+            self._write_blob(name, None if value is None else str(value).encode("utf-8"))
+        attachments = d["attachments"]
+        self._write_blob("attachments", _json_encoder.encode(attachments).encode("utf-8") if attachments else None)
+        self.count += 1
+
+    def _write_column(self, values):
+        # Columns start 8 byte aligned, so that they can be read in place from a memory map
+        padding = -self._offset % 8
+        self._file.write(b"\0" * padding)
+        offset = self._offset + padding
+        data = _to_little_endian(values)
+        self._file.write(data)
+        self._offset = offset + len(data)
+        return offset
+
+    def close(self):
+        columns = {}
+        for name in _DICTIONARY_COLUMNS:
+            values = sorted(self._dictionaries[name], key=self._dictionaries[name].get)
+            columns[name] = {"encoding": "dictionary", "values": values,
+                             "codes": self._write_column(self._codes[name])}
+        columns["duration_seconds"] = {"encoding": "float64", "data": self._write_column(self._durations)}
+        columns["ignored"] = {"encoding": "bool", "data": self._write_column(self._ignored)}
+        for name in _BLOB_COLUMNS:
+            columns[name] = {"encoding": "json" if name == "attachments" else "string",
+                             "offsets": self._write_column(self._offsets[name]),
+                             "lengths": self._write_column(self._lengths[name])}
+        footer = _json_encoder.encode({
+            "schema_version": COLUMNAR_SCHEMA_VERSION,
+            "count": self.count,
+            "azdo": self._azdo,
+            "columns": columns,
+        }).encode("utf-8")
+        self._file.write(footer)
+        self._file.write(_COLUMNAR_TRAILER.pack(len(footer), _COLUMNAR_MAGIC))
+        self._file.close()
+        os.replace(self._temp_path, self.path)
+
+    def abort(self):
+        self._file.close()
+        try:
+            os.remove(self._temp_path)
+        except OSError:
+            pass
+
+
+class ColumnarReporter(object):
+    """Writes the test results to a columnar file, for analysis over many results.
+
+    The JSON results file repeats every field name, and the same handful of
+    kinds, types and outcomes, on every result, and has to be decoded whole to
+    look at any one field. This file stores each field as a column instead:
+
+        header   - b"HXRC" and the layout version, as a little-endian uint32
+        blobs    - the UTF-8 text of the string fields and the JSON-encoded
+                   attachments of every result, one after the other
+        columns  - kind, type, result and exception_type as uint32 codes into
+                   per-column dictionaries; duration_seconds as float64 (NaN
+                   for none); ignored as uint8; and for every blob field an
+                   int64 file offset and an int32 length (-1 for null) per
+                   result. Little-endian, each starting 8 byte aligned.
+        footer   - JSON: the layout version, the number of results, the azdo
+                   object (without its access token), the dictionaries and
+                   where each column starts
+        trailer  - the footer's length as a little-endian uint64, and b"HXRC"
+
+    It is written in addition to, never instead of, the JSON results file.
+    ColumnarResults reads it.
+    """
+
+    __test__ = False
+
+    def __init__(self, azdo_parameters, log=None):
+        self._azdo = azdo_parameters
+        self._log = log or logging.getLogger(__name__)
+
+    def report_results(self, results):
+        path = columnar_results_path()
+        self._log.info("Writing test results to '%s' (columnar v%d)", path, COLUMNAR_SCHEMA_VERSION)
+        writer = _ColumnarResultsWriter(path, self._azdo)
+        try:
+            for r in (results or []):
+                if r is not None:
+                    writer.write(r)
+            writer.close()
+        except BaseException:
+            writer.abort()
+            # Don't leave an earlier run's file next to this run's JSON results file
+            remove_columnar_results()
+            raise
+        self._log.info("Wrote %d test results (%d bytes) to '%s'", writer.count, os.path.getsize(path), path)
+
+
+class ColumnarResults(object):
+    """Reads a results file written by ColumnarReporter, without decoding it up front.
+
+    The file is memory-mapped, and each column is only read when asked for:
+    durations() and codes() return the column itself, backed by the map, so
+    scanning every duration or outcome touches nothing else in the file.
+    where() finds the results with given values in a dictionary column, and
+    results() decodes whole TestResults, for every result or only the ones
+    listed. Raises ValueError for a file that is not a columnar results file
+    or has an unknown layout version.
+
+    The columns returned are only valid until close(), and must be released
+    (or dropped) before it.
+    """
+
+    __test__ = False
+
+    def __init__(self, path=None):
+        self.path = path or columnar_results_path()
+        with open(self.path, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            if size < _COLUMNAR_HEADER.size + _COLUMNAR_TRAILER.size:
+                raise ValueError("'%s' is not a columnar results file" % self.path)
+            # The map stays valid once the file is closed
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            magic, version = _COLUMNAR_HEADER.unpack_from(self._map, 0)
+            footer_length, end_magic = _COLUMNAR_TRAILER.unpack_from(self._map, size - _COLUMNAR_TRAILER.size)
+            if magic != _COLUMNAR_MAGIC or end_magic != _COLUMNAR_MAGIC:
+                raise ValueError("'%s' is not a columnar results file" % self.path)
+            if version != COLUMNAR_SCHEMA_VERSION:
+                raise ValueError("Unsupported columnar version %r in '%s'" % (version, self.path))
+            footer_end = size - _COLUMNAR_TRAILER.size
+            footer = json.loads(self._map[footer_end - footer_length:footer_end].decode("utf-8"))
+        except BaseException:
+            self._map.close()
+            raise
+        self.count = footer["count"]
+        self.azdo = footer["azdo"]
+        self._columns = footer["columns"]
+        self._arrays = {}
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        return self.results()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        for values in self._arrays.values():
+            if isinstance(values, memoryview):
+                values.release()
+        self._arrays = {}
+        self._map.close()
+
+    def _array(self, name, part, typecode):
+        key = (name, part)
+        values = self._arrays.get(key)
+        if values is None:
+            start = self._columns[name][part]
+            end = start + self.count * struct.calcsize(typecode)
+            if sys.byteorder == "little":
+                values = memoryview(self._map)[start:end].cast(typecode)
+            else:
+                values = array(typecode, self._map[start:end])
+                values.byteswap()
+            self._arrays[key] = values
+        return values
+
+    def durations(self):
+        """The duration_seconds of every result, as float64s; NaN where a result has none."""
+        return self._array("duration_seconds", "data", "d")
+
+    def codes(self, name):
+        """The uint32 codes of every result in a dictionary column, indices into dictionary(name)."""
+        return self._array(name, "codes", "I")
+
+    def dictionary(self, name):
+        """The distinct values of a dictionary column (kind, type, result or exception_type)."""
+        return self._columns[name]["values"]
+
+    def where(self, name, values):
+        """Indices of the results whose value in the dictionary column `name` is one of `values`."""
+        wanted = set(code for code, value in enumerate(self.dictionary(name)) if value in values)
+        if not wanted:
+            return []
+        return [index for index, code in enumerate(self.codes(name)) if code in wanted]
+
+    def _blob(self, name, index):
+        length = self._array(name, "lengths", "i")[index]
+        if length < 0:
+            return None
+        offset = self._array(name, "offsets", "q")[index]
+        return self._map[offset:offset + length].decode("utf-8")
+
+    def value(self, name, index):
+        """The value of one result's field."""
+        column = self._columns[name]
+        encoding = column["encoding"]
+        if encoding == "dictionary":
+            return column["values"][self.codes(name)[index]]
+        if encoding == "float64":
+            duration = self.durations()[index]
+            return None if duration != duration else duration
+        if encoding == "bool":
+            return bool(self._array(name, "data", "B")[index])
+        text = self._blob(name, index)
+        if encoding == "json":
+            return json.loads(text) if text is not None else []
+        return text
+
+    def results(self, indices=None, include_attachments=True):
+        """Yields the TestResults at `indices` (every result by default), in that order."""
+        if indices is None:
+            indices = range(self.count)
+        dictionaries = [(self.dictionary(name), self.codes(name)) for name in _DICTIONARY_COLUMNS]
+        durations = self.durations()
+        ignored = self._array("ignored", "data", "B")
+        blobs = [(self._array(name, "offsets", "q"), self._array(name, "lengths", "i"))
+                 for name in (_BLOB_COLUMNS if include_attachments else _STRING_COLUMNS)]
+        data = self._map
+        for index in indices:
+            kind, type_name, result, exception_type = [values[codes[index]] for values, codes in dictionaries]
+            duration = durations[index]
+            texts = []
+            for offsets, lengths in blobs:
+                length = lengths[index]
+                if length < 0:
+                    texts.append(None)
+                else:
+                    offset = offsets[index]
+                    texts.append(data[offset:offset + length].decode("utf-8"))
+            attachments = []
+            if include_attachments and texts[-1] is not None:
+                attachments = [TestResultAttachment(name=a.get("name"), text=a.get("text"))
+                               for a in json.loads(texts[-1])]
+            name, method, failure_message, stack_trace, skip_reason = texts[:len(_STRING_COLUMNS)]
+            test_result = TestResult(name, kind, type_name, method, None if duration != duration else duration,
+                                     result, exception_type, failure_message, stack_trace, skip_reason, attachments)
+            test_result.ignored = bool(ignored[index])
+            yield test_result
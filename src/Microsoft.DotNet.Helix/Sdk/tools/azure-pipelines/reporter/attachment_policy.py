@@ -0,0 +1,152 @@
+import hashlib
+import logging
+from typing import TYPE_CHECKING, Iterable
+from _helix_compat import result_types
+if TYPE_CHECKING:
+    from helix.public import TestResult
+
+
+log = logging.getLogger(__name__)
+
+# Attachments smaller than this are never replaced by a pointer to an earlier
+# copy; the pointer text would save next to nothing.
+_MIN_DEDUPE_BYTES = 1024
+
+_TRUNCATED_MARKER = u"\n\n... [{} bytes truncated by the Helix test reporter] ...\n\n"
+_DUPLICATE_TEXT = u"[Identical to attachment '{}' of test '{}', omitted by the Helix test reporter]"
+_OMITTED_TEXT = u"[{} bytes omitted by the Helix test reporter: work item attachment budget exhausted]"
+
+
+def _is_continuation(data, index):
+    return index < len(data) and data[index] & 0xC0 == 0x80
+
+
+def _head_tail(data, max_bytes):
+    """Keeps the first and last bytes of UTF-8 encoded data around a truncation marker.
+
+    The marker gives the number of bytes actually dropped, which depends on
+    the length of the marker itself; the cuts are moved to character
+    boundaries, so a character cut in two is dropped whole and counted.
+    """
+    # At least this much is dropped; each pass is exact for the marker of the previous
+    # one, and the count only grows, so this settles within a pass or two
+    dropped = len(data) - max_bytes
+    while True:
+        marker = _TRUNCATED_MARKER.format(dropped)
+        keep = max(max_bytes - len(marker), 0)
+        head_end = keep // 2
+        while head_end > 0 and _is_continuation(data, head_end):
+            head_end -= 1
+        tail_start = len(data) - (keep - keep // 2)
+        while _is_continuation(data, tail_start):
+            tail_start += 1
+        if tail_start - head_end == dropped:
+            break
+        dropped = tail_start - head_end
+    return data[:head_end].decode("utf-8") + marker + data[tail_start:].decode("utf-8")
+
+
+def _with_attachments(result, attachments, test_result):
+    copy = test_result(result.name, result.kind, result.type, result.method, result.duration_seconds,
+                       result.result, result.exception_type, result.failure_message, result.stack_trace,
+                       result.skip_reason, attachments)
+    # Results are created with ignored = False
+    if getattr(result, "ignored", False):
+        copy.ignored = True
+    return copy
+
+
+class AttachmentPolicy(object):
+    """Bounds the attachment text carried by test results.
+
+    Sits between the format parsers and the reporters. The JUnit and TRX
+    parsers attach the whole stdout/stderr of every failing test, so a
+    failing shared fixture can make thousands of results carry the same
+    multi-megabyte log. With dedupe set, an attachment whose text is identical
+    to one already seen is replaced by a short pointer to the first copy.
+    Attachments larger than max_attachment_bytes keep their head and tail
+    around a truncation marker, and once max_total_bytes of attachment text
+    has been passed on for the work item, later attachments are truncated to
+    what is left of it or omitted. Sizes are in UTF-8 bytes.
+    """
+
+    def __init__(self, max_attachment_bytes=None, max_total_bytes=None, dedupe=False):
+        self._max_attachment_bytes = max_attachment_bytes
+        self._max_total_bytes = max_total_bytes
+        self._dedupe = dedupe
+        self._seen = {}
+        self._total_bytes = 0
+        self._truncated = 0
+        self._deduplicated = 0
+        self._omitted = 0
+        self._dropped_bytes = 0
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self._max_attachment_bytes or self._max_total_bytes or self._dedupe)
+
+    def apply(self, results: Iterable['TestResult']) -> Iterable['TestResult']:
+        """Passes results through with their attachments bounded, then logs a summary.
+
+        A result whose attachments are changed is passed on as a copy, so the
+        parsed result, which the parse cache or another consumer may hold on
+        to, keeps its attachments.
+        """
+        test_result, test_result_attachment = result_types()
+        for result in results:
+            if result.attachments:
+                attachments = []
+                changed = False
+                for attachment in result.attachments:
+                    text = self._bound(result, attachment)
+                    if text is not attachment.text:
+                        attachment = test_result_attachment(name=attachment.name, text=text)
+                        changed = True
+                    attachments.append(attachment)
+                if changed:
+                    result = _with_attachments(result, attachments, test_result)
+            yield result
+        self._log_summary()
+
+    def _bound(self, result, attachment):
+        text = attachment.text
+        if not text:
+            return text
+        data = text.encode("utf-8")
+        size = len(data)
+
+        if self._dedupe and size >= _MIN_DEDUPE_BYTES:
+            digest = hashlib.sha1(data).digest()
+            first = self._seen.get(digest)
+            if first is not None:
+                self._deduplicated += 1
+                self._dropped_bytes += size
+                return _DUPLICATE_TEXT.format(first[1], first[0])
+            self._seen[digest] = (result.name, attachment.name)
+
+        limit = self._max_attachment_bytes
+        if self._max_total_bytes is not None:
+            remaining = max(self._max_total_bytes - self._total_bytes, 0)
+            if limit is None or remaining < limit:
+                limit = remaining
+
+        if limit is not None and size > limit:
+            if limit < len(_TRUNCATED_MARKER) * 2:
+                self._omitted += 1
+                self._dropped_bytes += size
+                return _OMITTED_TEXT.format(size)
+            text = _head_tail(data, limit)
+            self._truncated += 1
+            kept = len(text.encode("utf-8"))
+            self._dropped_bytes += size - kept
+            size = kept
+
+        self._total_bytes += size
+        return text
+
+    def _log_summary(self):
+        if not (self._truncated or self._deduplicated or self._omitted):
+            return
+        log.info('Attachment policy: {} truncated, {} replaced by a pointer to an identical attachment, '
+                 '{} omitted; {} bytes dropped, {} bytes kept'.format(
+                     self._truncated, self._deduplicated, self._omitted, self._dropped_bytes, self._total_bytes))
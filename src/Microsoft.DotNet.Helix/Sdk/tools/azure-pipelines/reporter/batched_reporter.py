@@ -0,0 +1,256 @@
+import gzip
+import logging
+from abc import ABCMeta, abstractmethod, abstractproperty
+import time
+import urllib.error
+import urllib.request
+from collections import OrderedDict
+from queue import Queue
+from threading import Lock, Thread
+from typing import TYPE_CHECKING, Iterable, List, Optional
+
+import _helix_compat
+from helpers import batch
+
+if TYPE_CHECKING:
+    from helix.public import TestResult
+
+
+class ResultSink(metaclass=ABCMeta):
+    """Destination for the batches of results published by BatchedReporter.
+
+    publish() is called from the reporter's worker threads, possibly for
+    several batches at once, so implementations must be thread-safe. Sinks
+    that set ordered get one batch at a time instead, in the order the
+    results were parsed in. Once every batch has been published, close() is
+    called; if reporting fails, abort() is called instead.
+    """
+
+    ordered = False
+
+    @abstractproperty
+    def name(self) -> str:
+        pass
+
+    @abstractmethod
+    def publish(self, results: List['TestResult']) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+    def abort(self) -> None:
+        pass
+
+
+class JsonFileSink(ResultSink):
+    """Writes the batches to the work item's JSON results file.
+
+    The file has the same layout as the one written by JsonReporter, and is
+    likewise renamed into place by close(). Results are written in the order
+    they were parsed in, however many workers publish them.
+    """
+
+    ordered = True
+
+    def __init__(self, azdo_parameters, log=None, compression=None):
+        self._log = log or logging.getLogger(__name__)
+        self._compression = _helix_compat._resolve_compression(compression, self._log)
+        self._lock = Lock()
+        self._writer = _helix_compat._JsonResultsWriter(
+            _helix_compat.json_results_path(self._compression), azdo_parameters, self._compression)
+
+    @property
+    def name(self):
+        return self._writer.path
+
+    def publish(self, results):
+        with self._lock:
+            for r in results:
+                self._writer.write(r)
+
+    def close(self):
+        self._writer.close()
+        self._log.info("Wrote %d test results to '%s'", self._writer.count, self._writer.path)
+        _helix_compat._remove_stale_results([self._writer.path])
+
+    def abort(self):
+        self._writer.abort()
+
+
+class HttpSink(ResultSink):
+    """POSTs each batch as a gzip'd JSON document to an HTTP endpoint.
+
+    The body has the layout of the JSON results file, holding just the
+    batch's results and without the access token:
+
+        {"schema_version": 1, "azdo": {...}, "results": [...]}
+
+    The access token is sent as a bearer token, and only over https.
+    Connection errors, 429 and 5xx responses are retried with exponential
+    backoff; any other error response fails the batch.
+    """
+
+    def __init__(self, url, azdo_parameters, timeout=60, retries=3, retry_delay=1.0, log=None):
+        self._url = url
+        self._timeout = timeout
+        self._retries = retries
+        self._retry_delay = retry_delay
+        self._log = log or logging.getLogger(__name__)
+        self._headers = {
+            "Content-Type": "application/json; charset=utf-8",
+            "Content-Encoding": "gzip",
+        }
+        access_token = getattr(azdo_parameters, "access_token", None)
+        if access_token and url.lower().startswith("https://"):
+            self._headers["Authorization"] = "Bearer " + access_token
+        self._prefix = ('{"schema_version": ' + _helix_compat._json_encoder.encode(_helix_compat.SCHEMA_VERSION) +
+                        ', "azdo": ' + _helix_compat._json_encoder.encode(_azdo_without_token(azdo_parameters)) +
+                        ', "results": [')
+
+    @property
+    def name(self):
+        return self._url
+
+    def publish(self, results):
+        body = self._prefix + ", ".join(
+            _helix_compat._json_encoder.encode(_helix_compat._result_to_dict(r)) for r in results) + "]}"
+        data = gzip.compress(body.encode("utf-8"), compresslevel=1)
+
+        attempt = 0
+        while True:
+            request = urllib.request.Request(self._url, data=data, headers=self._headers, method="POST")
+            try:
+                with urllib.request.urlopen(request, timeout=self._timeout) as response:
+                    response.read()
+                return
+            except urllib.error.HTTPError as e:
+                if e.code != 429 and e.code < 500:
+                    raise
+                error = e
+            except (urllib.error.URLError, OSError) as e:
+                error = e
+            if attempt >= self._retries:
+                raise error
+            delay = self._retry_delay * (2 ** attempt)
+            attempt += 1
+            self._log.warning("Publishing %d results to %s failed (%s); retrying in %.1fs",
+                              len(results), self._url, error, delay)
+            time.sleep(delay)
+
+
+def _azdo_without_token(p):
+    d = _helix_compat._azdo_to_dict(p)
+    d.pop("access_token", None)
+    return d
+
+
+class BatchedReporter(object):
+    """Publishes results to one or more sinks in fixed-size batches.
+
+    Results are grouped into batches of batch_size as they are parsed and
+    handed to a pool of worker threads, so publishing overlaps with parsing
+    instead of starting once every file has been read. At most workers * 2
+    batches wait for a worker; beyond that, parsing blocks until one frees
+    up, which bounds the memory held by unpublished results.
+
+    Every batch goes to every sink. Batches that finish out of order are held
+    back from ordered sinks until the batches before them have been
+    published. A sink that fails is aborted and gets no further batches while
+    the others carry on; parsing stops once every sink has failed. Once the
+    remaining sinks are closed, the first error is raised.
+    """
+
+    __test__ = False
+
+    def __init__(self, sinks: List[ResultSink], batch_size=1000, workers=4, log=None):
+        self._sinks = sinks
+        self._batch_size = batch_size
+        self._workers = max(1, workers)
+        self._log = log or logging.getLogger(__name__)
+
+    def report_results(self, results: Iterable[Optional['TestResult']]):
+        queue = Queue(maxsize=self._workers * 2)
+        # The first error of each failed sink, in the order they failed
+        failures = OrderedDict()
+        stats = {"batches": 0, "results": 0, "first": None}
+        lock = Lock()
+        start = time.perf_counter()
+        # Batches waiting for the ones before them, for the ordered sinks
+        ordered_sinks = [sink for sink in self._sinks if sink.ordered]
+        ordered_lock = Lock()
+        held_back = {}
+        next_sequence = [0]
+
+        def publish(sink, item):
+            try:
+                sink.publish(item)
+            except Exception as e:
+                self._log.exception("Publishing %d results to %s failed", len(item), sink.name)
+                with lock:
+                    failures.setdefault(sink, e)
+
+        def work():
+            while True:
+                entry = queue.get()
+                if entry is None:
+                    return
+                sequence, item = entry
+                # Keep draining when every sink has failed, so the producer never
+                # blocks on a full queue.
+                # The ordered sinks go first: a batch is only held back until the
+                # batches taken before it get here, never while they are sent elsewhere.
+                if ordered_sinks:
+                    with ordered_lock:
+                        held_back[sequence] = item
+                        while next_sequence[0] in held_back:
+                            ready = held_back.pop(next_sequence[0])
+                            next_sequence[0] += 1
+                            for sink in ordered_sinks:
+                                if sink not in failures:
+                                    publish(sink, ready)
+                for sink in self._sinks:
+                    if not sink.ordered and sink not in failures:
+                        publish(sink, item)
+                with lock:
+                    stats["batches"] += 1
+                    stats["results"] += len(item)
+                    if stats["first"] is None:
+                        stats["first"] = time.perf_counter() - start
+                        self._log.info("Published the first %d results after %.2fs", len(item), stats["first"])
+
+        threads = [Thread(target=work, name="reporter-publish-{}".format(i), daemon=True)
+                   for i in range(self._workers)]
+        for thread in threads:
+            thread.start()
+
+        completed = False
+        try:
+            for sequence, results_batch in enumerate(batch(results or [], self._batch_size)):
+                if len(failures) == len(self._sinks):
+                    break
+                queue.put((sequence, results_batch))
+            completed = True
+        finally:
+            for _ in threads:
+                queue.put(None)
+            for thread in threads:
+                thread.join()
+            for sink in self._sinks:
+                if completed and sink not in failures:
+                    try:
+                        sink.close()
+                        continue
+                    except Exception as e:
+                        self._log.exception("Failed to close %s", sink.name)
+                        failures.setdefault(sink, e)
+                try:
+                    sink.abort()
+                except Exception:
+                    self._log.exception("Failed to abort %s", sink.name)
+
+        self._log.info("Published %d test results in %d batches to %s in %.2fs",
+                       stats["results"], stats["batches"],
+                       ", ".join(s.name for s in self._sinks if s not in failures), time.perf_counter() - start)
+        if failures:
+            raise next(iter(failures.values()))
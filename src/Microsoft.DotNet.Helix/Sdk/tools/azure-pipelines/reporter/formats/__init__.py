@@ -1,12 +1,73 @@
+import importlib
 from typing import List
 from .result_format import ResultFormat
-from .xunit import XUnitFormat
-from .junit import JUnitFormat
-from .trx import TRXFormat
+
+
+# (name, module, class name, file suffixes). The suffixes are repeated here so
+# that discovery can match file names without importing the format modules;
+# _LazyFormat.load() checks that they match each format's acceptable_file_suffixes.
+_registry = [
+    ('xunit', '.xunit', 'XUnitFormat', ('testResults.xml', 'test-results.xml', 'test_results.xml')),
+    ('junit', '.junit', 'JUnitFormat', ('junit-results.xml', 'junitresults.xml')),
+    ('trx', '.trx', 'TRXFormat', ('.trx',)),
+]
+
+
+class _LazyFormat(ResultFormat):
+    """Stands in for a format until a file with one of its suffixes is read.
+
+    Importing a format module pulls in its XML backend; most work items only
+    have files of one format, so the others are never imported.
+    """
+
+    def __init__(self, name, module, class_name, suffixes):
+        super(_LazyFormat, self).__init__()
+        self._name = name
+        self._module = module
+        self._class_name = class_name
+        self._suffixes = suffixes
+        self._format = None
+
+    @property
+    def name(self):
+        return self._name
+
+    @property
+    def acceptable_file_suffixes(self):
+        return iter(self._suffixes)
+
+    def load(self) -> ResultFormat:
+        if self._format is None:
+            module = importlib.import_module(self._module, __name__)
+            loaded = getattr(module, self._class_name)()
+            assert tuple(loaded.acceptable_file_suffixes) == self._suffixes, \
+                "_registry suffixes for '{}' differ from {}.acceptable_file_suffixes".format(
+                    self._name, self._class_name)
+            self._format = loaded
+        return self._format
+
+    @property
+    def result_tags(self):
+        return self.load().result_tags
+
+    @property
+    def read_element(self):
+        # Raises AttributeError, like the format itself, for formats that can only be read whole
+        return self.load().read_element
+
+    def read_results(self, path):
+        return self.load().read_results(path)
 
 
 all_formats = [
-    XUnitFormat(),
-    JUnitFormat(),
-    TRXFormat()
+    _LazyFormat(name, module, class_name, suffixes)
+    for name, module, class_name, suffixes in _registry
 ]  # type: List[ResultFormat]
+
+
+def __getattr__(name):
+    # Keeps 'from formats import XUnitFormat' working without importing every format up front
+    for _, module, class_name, _ in _registry:
+        if name == class_name:
+            return getattr(importlib.import_module(module, __name__), class_name)
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
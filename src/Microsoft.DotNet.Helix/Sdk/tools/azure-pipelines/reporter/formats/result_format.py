@@ -1,9 +1,7 @@
 from abc import ABCMeta, abstractmethod, abstractproperty
-try:
+from typing import TYPE_CHECKING, Iterable, Optional, Tuple
+if TYPE_CHECKING:
     from helix.public import TestResult
-except ImportError:
-    from _helix_compat import TestResult
-from typing import Iterable
 
 
 class ResultFormat:
@@ -21,5 +19,15 @@ class ResultFormat:
         pass
 
     @abstractmethod
-    def read_results(self, path) -> Iterable[TestResult]:
+    def read_results(self, path) -> Iterable['TestResult']:
         pass
+
+    # Formats whose results are self-contained elements can also be read an
+    # element at a time while the file is still being written (see
+    # test_results_reader.watch); result_tags names those elements, and the
+    # format's read_element(element) turns one of them into a TestResult.
+    # None means the file can only be read whole, and such formats have no
+    # read_element.
+    @property
+    def result_tags(self) -> Optional[Tuple[str, ...]]:
+        return None
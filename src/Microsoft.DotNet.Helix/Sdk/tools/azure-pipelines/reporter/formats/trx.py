@@ -1,17 +1,111 @@
 import glob
-import xml.etree.ElementTree
+from collections import deque, namedtuple
+from . import xml_backend
 from .result_format import ResultFormat
-try:
-    from helix.public import TestResult, TestResultAttachment
-except ImportError:
-    from _helix_compat import TestResult, TestResultAttachment
+from _helix_compat import result_types
+
+
+_ns = {'vstest' : 'http://microsoft.com/schemas/VisualStudio/TeamTest/2010'}
+
+# Everything we need from a UnitTestResult element except the class/method names,
+# which live in the TestDefinitions section.
+_ResultRecord = namedtuple('_ResultRecord', [
+    'test_id', 'test_name', 'duration', 'result', 'failure_message', 'stack_trace', 'skip_reason', 'attachments'])
+
+# vstest writes the Results section before TestDefinitions, so results have to be held
+# until their definitions are seen. Past this many buffered characters we stop holding
+# them and re-read the remaining results in a second pass instead.
+_MAX_BUFFERED_CHARS = 64 * 1024 * 1024
+
+
+def _read_record(element, test_result_attachment):
+    test_name = element.get("testName")
+    test_id = element.get("testId")
+    duration = 0.0
+    result = "Pass"
+    outcome = element.get("outcome")
+    failure_message = None
+    stack_trace = None
+    skip_reason = None
+    attachments = []
+
+    if element.get("duration") is not None:
+        hour, minute, second = element.get("duration").split(':')
+        duration = float(hour)*60*60 + float(minute)*60 + float(second)
+
+    if outcome == "NotExecuted":
+        result = "Skip"
+        output_element = element.find("vstest:Output", _ns)
+        if output_element is not None:
+            stdout_element = output_element.find("vstest:StdOut", _ns)
+            if stdout_element is not None:
+                skip_reason = stdout_element.text
+
+    elif outcome == "Failed":
+        result = "Fail"
+        output_element = element.find("vstest:Output", _ns)
+        if output_element is not None:
+            error_element = output_element.find("vstest:ErrorInfo", _ns)
+            if error_element is not None:
+                message_element = error_element.find("vstest:Message", _ns)
+                if message_element is not None:
+                    failure_message = message_element.text
+                stacktrace_element = error_element.find("vstest:StackTrace", _ns)
+                if stacktrace_element is not None:
+                    stack_trace = stacktrace_element.text
+
+            stdout_element = output_element.find("vstest:StdOut", _ns)
+            if stdout_element is not None:
+                attachments.append(test_result_attachment(
+                    name=u"Console_Output.log",
+                    text=stdout_element.text,
+                ))
+
+            stderr_element = output_element.find("vstest:StdErr", _ns)
+            if stderr_element is not None:
+                attachments.append(test_result_attachment(
+                    name=u"Error_Output.log",
+                    text=stderr_element.text,
+                ))
+    else:
+        result = "Pass"
+
+    return _ResultRecord(test_id, test_name, duration, result, failure_message, stack_trace, skip_reason, attachments)
+
+
+def _record_size(record):
+    size = len(record.test_name or '')
+    for text in (record.failure_message, record.stack_trace, record.skip_reason):
+        size += len(text or '')
+    for attachment in record.attachments:
+        size += len(attachment.text or '')
+    return size
+
+
+def _to_test_result(record, test_classes, test_methods, test_result):
+    # Find the class name from the TestDefinitions section
+    classname = test_classes[record.test_id]
+    method = test_methods[record.test_id]
+    test_name = record.test_name
+
+    # xunit reports testName as the fully qualified name
+    # (ClassName.MethodName), while MSTest uses just the method name.
+    # Avoid duplicating the class prefix when it's already present.
+    if test_name.startswith(classname + '.'):
+        name = test_name
+    else:
+        name = classname + '.' + test_name
+    type_name = classname
+
+    return test_result(name, u'trx', type_name, method, record.duration, record.result, None, record.failure_message,
+                      record.stack_trace, record.skip_reason, record.attachments)
 
 
 class TRXFormat(ResultFormat):
 
     def __init__(self):
         super(TRXFormat, self).__init__()
-        pass
+        self._test_result, self._test_result_attachment = result_types()
 
     @property
     def name(self):
@@ -26,89 +120,56 @@ class TRXFormat(ResultFormat):
     def read_results(self, path):
         test_classes = {}
         test_methods = {}
-        ns = {'vstest' : 'http://microsoft.com/schemas/VisualStudio/TeamTest/2010'}
 
-        # class names are stored separately from the results. Gather testName->className information
-        # and store it away first, since it is smaller than storing the results
-        for (_, element) in xml.etree.ElementTree.iterparse(path, events=['end']):
-            if element.tag.endswith("UnitTest"):
+        # Results whose UnitTest definition has not been seen yet, in document order
+        pending = deque()
+        pending_chars = 0
+        # Index of the first UnitTestResult that did not fit in the buffer, if any
+        resume_index = None
+        result_index = 0
+
+        # Read the file once. Results are emitted as soon as their class name is known and
+        # every earlier result has been emitted, so the output order is the document order.
+        for element in xml_backend.iterparse(path, ('{*}UnitTest', '{*}UnitTestResult')):
+            if element.tag.endswith("UnitTestResult"):
+                if resume_index is None:
+                    record = _read_record(element, self._test_result_attachment)
+                    if not pending and record.test_id in test_classes:
+                        yield _to_test_result(record, test_classes, test_methods, self._test_result)
+                    else:
+                        pending.append(record)
+                        pending_chars += _record_size(record)
+                        if pending_chars > _MAX_BUFFERED_CHARS:
+                            resume_index = result_index + 1
+                result_index += 1
+
+                # remove the element's content so we don't keep it around too long.
+                element.clear()
+
+            elif element.tag.endswith("UnitTest"):
                 test_id = element.get("id")
-                testMethod_element = element.find("vstest:TestMethod", ns)
+                testMethod_element = element.find("vstest:TestMethod", _ns)
                 if testMethod_element is not None:
                     test_classes[test_id] = testMethod_element.get("className")
                     test_methods[test_id] = testMethod_element.get("name")
                 element.clear()
 
-        for (_, element) in xml.etree.ElementTree.iterparse(path, events=['end']):
-            if element.tag.endswith("UnitTestResult"):
-                test_name = element.get("testName")
-                test_id = element.get("testId")
-
-                # Find the class name from the dictionary we created earlier
-                classname = test_classes[test_id]
-                method = test_methods[test_id]
-
-                # xunit reports testName as the fully qualified name
-                # (ClassName.MethodName), while MSTest uses just the method name.
-                # Avoid duplicating the class prefix when it's already present.
-                if test_name.startswith(classname + '.'):
-                    name = test_name
-                else:
-                    name = classname + '.' + test_name
-                type_name = classname
-                duration = 0.0
-                result = "Pass"
-                outcome = element.get("outcome")
-                exception_type = None
-                failure_message = None
-                stack_trace = None
-                skip_reason = None
-                attachments = []
-
-                if element.get("duration") is not None:
-                    hour, minute, second = element.get("duration").split(':')
-                    duration = float(hour)*60*60 + float(minute)*60 + float(second)
-
-                if outcome == "NotExecuted":
-                    result = "Skip"
-                    output_element = element.find("vstest:Output", ns)
-                    if output_element is not None:
-                        stdout_element = output_element.find("vstest:StdOut", ns)
-                        if stdout_element is not None:
-                            skip_reason = stdout_element.text
-
-                elif outcome == "Failed":
-                    result = "Fail"
-                    output_element = element.find("vstest:Output", ns)
-                    if output_element is not None:
-                        error_element = output_element.find("vstest:ErrorInfo", ns)
-                        if error_element is not None:
-                            message_element = error_element.find("vstest:Message", ns)
-                            if message_element is not None:
-                                failure_message = message_element.text
-                            stacktrace_element = error_element.find("vstest:StackTrace", ns)
-                            if stacktrace_element is not None:
-                                stack_trace = stacktrace_element.text
-
-                        stdout_element = output_element.find("vstest:StdOut", ns)
-                        if stdout_element is not None:
-                            attachments.append(TestResultAttachment(
-                                name=u"Console_Output.log",
-                                text=stdout_element.text,
-                            ))
-
-                        stderr_element = output_element.find("vstest:StdErr", ns)
-                        if stderr_element is not None:
-                            attachments.append(TestResultAttachment(
-                                name=u"Error_Output.log",
-                                text=stderr_element.text,
-                            ))
-                else:
-                    result = "Pass"
-
-                res = TestResult(name, u'trx', type_name, method, duration, result, exception_type, failure_message, stack_trace,
-                                 skip_reason, attachments)
-                yield res
+                while pending and pending[0].test_id in test_classes:
+                    yield _to_test_result(pending.popleft(), test_classes, test_methods, self._test_result)
 
-                # remove the element's content so we don't keep it around too long.
+        for record in pending:
+            yield _to_test_result(record, test_classes, test_methods, self._test_result)
+        pending = None
+
+        if resume_index is None:
+            return
+
+        # The buffer overflowed; every definition is known now, so stream the rest of the results.
+        result_index = 0
+        for element in xml_backend.iterparse(path, ('{*}UnitTestResult',)):
+            if element.tag.endswith("UnitTestResult"):
+                if result_index >= resume_index:
+                    record = _read_record(element, self._test_result_attachment)
+                    yield _to_test_result(record, test_classes, test_methods, self._test_result)
+                result_index += 1
                 element.clear()
@@ -0,0 +1,243 @@
+"""Streaming XML readers shared by the result format parsers.
+
+`iterparse(path, tags)` yields every element whose tag matches one of
+`tags`, once the element has been fully read. A tag is either a plain name
+(`"test"`), a qualified name (`"{namespace}name"`) or `"{*}name"`, which
+matches the name in any namespace or in none.
+
+The yielded elements only support the part of the ElementTree API the
+parsers use: `tag`, `text`, `get()`, `find()` on direct children and
+`clear()`. Three backends implement it:
+
+    etree  - xml.etree.ElementTree.iterparse. The default.
+    lxml   - lxml.etree.iterparse with the tag filtering done in C. Only
+             available when lxml is installed.
+    expat  - xml.parsers.expat with a handler that only builds nodes inside
+             the requested elements and ignores the rest of the document.
+
+The backend is picked with HELIX_REPORTER_XML_BACKEND=etree|lxml|expat.
+All three produce the same results for the same file. ElementTree stays the
+default because its C tree builder measured fastest end to end on CPython
+(see reporter-benchmarks/bench_xml_backends.py); lxml only wins on raw
+parsing and loses it back on per-element attribute access, and the Python
+level expat handler is slower than both.
+"""
+
+import logging
+import os
+import xml.etree.ElementTree
+import xml.parsers.expat
+
+# lxml.etree once _load_lxml() has imported it; lxml is slow to import and only
+# used when it is picked as the backend.
+lxml = None
+
+
+log = logging.getLogger(__name__)
+
+_READ_SIZE = 64 * 1024
+
+_backend = None
+
+
+def _load_lxml():
+    """Imports lxml.etree, returning False when lxml is not installed."""
+    global lxml
+    if lxml is None:
+        try:
+            import lxml.etree
+        except ImportError:
+            return False
+    return True
+
+
+def _tag_matcher(tags):
+    exact = set()
+    local_names = set()
+    for tag in tags:
+        if tag.startswith('{*}'):
+            local_names.add(tag[3:])
+        else:
+            exact.add(tag)
+
+    def matches(tag):
+        if tag in exact:
+            return True
+        if local_names:
+            return tag[tag.rfind('}') + 1:] in local_names
+        return False
+
+    return matches
+
+
+def _etree_iterparse(path, tags):
+    matches = _tag_matcher(tags)
+    for (_, element) in xml.etree.ElementTree.iterparse(path, events=['end']):
+        if matches(element.tag):
+            yield element
+
+
+def _lxml_iterparse(path, tags):
+    # huge_tree lifts libxml2's 10MB limit on a single text node, which large
+    # stdout attachments exceed. Comments are dropped so that text around them
+    # is joined the same way ElementTree joins it.
+    for (_, element) in lxml.etree.iterparse(path, events=('end',), tag=tuple(tags), huge_tree=True,
+                                             remove_comments=True, remove_pis=True):
+        yield element
+        # The caller is done with the element and everything before it; drop the
+        # already processed siblings so the tree does not grow with the file.
+        parent = element.getparent()
+        if parent is not None:
+            while element.getprevious() is not None:
+                del parent[0]
+
+
+class _Node(object):
+    """Minimal element built by the expat backend."""
+
+    __slots__ = ('tag', 'attrib', 'text', '_children')
+
+    def __init__(self, tag, attrib):
+        self.tag = tag
+        self.attrib = attrib
+        self.text = None
+        self._children = []
+
+    def get(self, key, default=None):
+        return self.attrib.get(key, default)
+
+    def find(self, path, namespaces=None):
+        if namespaces and ':' in path:
+            prefix, name = path.split(':', 1)
+            path = '{' + namespaces[prefix] + '}' + name
+        for child in self._children:
+            if child.tag == path:
+                return child
+        return None
+
+    def clear(self):
+        self.attrib = {}
+        self.text = None
+        self._children = []
+
+
+def _fixname(name):
+    # expat reports namespaced names as "namespace}name"; ElementTree spells them "{namespace}name"
+    if '}' in name:
+        return '{' + name
+    return name
+
+
+class _ExpatHandler(object):
+
+    def __init__(self, matches):
+        self._matches = matches
+        # Nodes being built, outermost first. Empty while outside of a requested element.
+        self._stack = []
+        # Character data seen since the last start tag of the innermost node
+        self._data = []
+        self.completed = []
+
+    def start(self, name, attributes):
+        tag = _fixname(name)
+        if not self._stack and not self._matches(tag):
+            return
+        attrib = {}
+        for i in range(0, len(attributes), 2):
+            attrib[_fixname(attributes[i])] = attributes[i + 1]
+        node = _Node(tag, attrib)
+        if self._stack:
+            parent = self._stack[-1]
+            if not parent._children and self._data:
+                parent.text = ''.join(self._data)
+            parent._children.append(node)
+        self._data = []
+        self._stack.append(node)
+
+    def end(self, name):
+        if not self._stack:
+            return
+        node = self._stack.pop()
+        if not node._children and self._data:
+            node.text = ''.join(self._data)
+        # Text after a child is its tail, which the parsers never look at
+        self._data = []
+        if self._matches(node.tag):
+            self.completed.append(node)
+
+    def data(self, text):
+        if self._stack and not self._stack[-1]._children:
+            self._data.append(text)
+
+
+def _expat_iterparse(path, tags):
+    handler = _ExpatHandler(_tag_matcher(tags))
+    parser = xml.parsers.expat.ParserCreate(None, '}')
+    parser.buffer_text = True
+    parser.ordered_attributes = True
+    parser.StartElementHandler = handler.start
+    parser.EndElementHandler = handler.end
+    parser.CharacterDataHandler = handler.data
+
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(_READ_SIZE)
+            parser.Parse(chunk, not chunk)
+            completed = handler.completed
+            handler.completed = []
+            for node in completed:
+                yield node
+            if not chunk:
+                break
+
+
+_backends = {
+    'etree': _etree_iterparse,
+    'expat': _expat_iterparse,
+    'lxml': _lxml_iterparse,
+}
+
+
+def backend_name():
+    global _backend
+    if _backend is None:
+        requested = os.environ.get('HELIX_REPORTER_XML_BACKEND', '').lower() or 'etree'
+        if requested not in _backends:
+            log.warning("Unknown XML backend '%s'; using ElementTree", requested)
+            _backend = 'etree'
+        elif requested == 'lxml' and not _load_lxml():
+            log.warning("lxml requested as the XML backend but it is not installed; using ElementTree")
+            _backend = 'etree'
+        else:
+            _backend = requested
+    return _backend
+
+
+def iterparse(path, tags):
+    return _backends[backend_name()](path, tags)
+
+
+class TailParser(object):
+    """Parses a file that is still being written, as its bytes are fed in.
+
+    feed() returns the requested elements completed by the data, the same
+    elements iterparse() yields for the whole file; the caller clears them once
+    it is done with them. Always uses ElementTree's XMLPullParser, whichever
+    backend iterparse() uses.
+    """
+
+    def __init__(self, tags):
+        self._matches = _tag_matcher(tags)
+        self._parser = xml.etree.ElementTree.XMLPullParser(events=('end',))
+
+    def _completed(self):
+        return [element for (_, element) in self._parser.read_events() if self._matches(element.tag)]
+
+    def feed(self, data):
+        self._parser.feed(data)
+        return self._completed()
+
+    def close(self):
+        """Ends the document, raising xml.etree.ElementTree.ParseError when it is incomplete."""
+        self._parser.close()
+        return self._completed()
@@ -1,5 +1,7 @@
 import sys
 import os
+from queue import Queue
+from threading import Thread
 
 
 def get_env(name):
@@ -8,6 +10,33 @@ def get_env(name):
     return os.environ[name]
 
 
+def get_env_int(name, default=None):
+    value = os.environ.get(name)
+    if not value:
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        sys.exit(name + " env var must be an integer, got '" + value + "'")
+
+
+def get_env_float(name, default=None):
+    value = os.environ.get(name)
+    if not value:
+        return default
+    try:
+        return float(value)
+    except ValueError:
+        sys.exit(name + " env var must be a number, got '" + value + "'")
+
+
+def get_env_list(name):
+    value = os.environ.get(name)
+    if not value:
+        return []
+    return [item for item in value.split(os.pathsep) if item]
+
+
 def batch(iterable, n=1):
     current_batch = []
     for item in iterable:
@@ -17,3 +46,101 @@ def batch(iterable, n=1):
             current_batch = []
     if current_batch:
         yield current_batch
+
+
+# Items are handed to fan_out's consumers in chunks of up to this many, so the
+# queue's locking is paid per chunk rather than per item.
+_FAN_OUT_CHUNK = 100
+
+_FAN_OUT_END = object()
+
+
+class _FanOutError(object):
+
+    def __init__(self, error):
+        self.error = error
+
+
+def fan_out(iterable, consumers, buffer_size=1000):
+    """Feeds every item of iterable, read once, to each of consumers.
+
+    Each consumer is a callable that takes an iterable and runs in its own
+    thread, seeing every item in order. At most about buffer_size items wait
+    for any one consumer; beyond that, reading blocks until the slowest one
+    catches up, which bounds the memory held. A consumer that raises gets no
+    further items while the others carry on, and reading stops once every
+    consumer has failed. If reading raises, the error is raised inside every
+    consumer, from its iterable, so that none of them takes what was read for
+    the complete results; a SystemExit or KeyboardInterrupt is then raised
+    again once they are done.
+
+    Returns what each consumer raised, or None for the ones that finished.
+    A single consumer is simply called with iterable.
+    """
+    if len(consumers) == 1:
+        try:
+            consumers[0](iterable)
+            return [None]
+        except Exception as e:
+            return [e]
+
+    chunk_size = max(1, min(_FAN_OUT_CHUNK, buffer_size))
+    queues = [Queue(maxsize=max(1, buffer_size // chunk_size)) for _ in consumers]
+    errors = [None] * len(consumers)
+
+    def items(queue, ended):
+        while True:
+            chunk = queue.get()
+            if chunk is _FAN_OUT_END or isinstance(chunk, _FanOutError):
+                ended.append(True)
+                if chunk is _FAN_OUT_END:
+                    return
+                raise chunk.error
+            for item in chunk:
+                yield item
+
+    def consume(index):
+        queue = queues[index]
+        ended = []
+        try:
+            consumers[index](items(queue, ended))
+        except BaseException as e:
+            errors[index] = e
+        # Drain whatever is left, so reading never blocks on this consumer's full queue
+        while not ended:
+            chunk = queue.get()
+            if chunk is _FAN_OUT_END or isinstance(chunk, _FanOutError):
+                return
+
+    def put(chunk):
+        for index, queue in enumerate(queues):
+            if errors[index] is None:
+                queue.put(chunk)
+
+    threads = [Thread(target=consume, args=(i,), name="reporter-fan-out-{}".format(i), daemon=True)
+               for i in range(len(consumers))]
+    for thread in threads:
+        thread.start()
+
+    end = _FAN_OUT_END
+    try:
+        chunk = []
+        for item in iterable:
+            chunk.append(item)
+            if len(chunk) >= chunk_size:
+                put(chunk)
+                chunk = []
+                if all(error is not None for error in errors):
+                    break
+        if chunk:
+            put(chunk)
+    except BaseException as e:
+        end = _FanOutError(e)
+        if not isinstance(e, Exception):
+            raise
+    finally:
+        for queue in queues:
+            queue.put(end)
+        for thread in threads:
+            thread.join()
+    return errors
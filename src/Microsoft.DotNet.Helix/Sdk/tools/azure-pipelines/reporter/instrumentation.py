@@ -0,0 +1,266 @@
+import heapq
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Iterable, Optional, TypeVar
+
+import _helix_compat
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows; peak RSS is reported as null there.
+    resource = None
+
+
+log = logging.getLogger(__name__)
+
+INSTRUMENTATION_FILENAME = "__test_report_v2.instrumentation.json"
+
+INSTRUMENTATION_SCHEMA_VERSION = 1
+
+_LARGEST_FILES = 10
+
+T = TypeVar("T")
+
+
+def instrumentation_path():
+    """Absolute path to the instrumentation file for the current work item."""
+    return os.path.join(_helix_compat._results_dir(), INSTRUMENTATION_FILENAME)
+
+
+class _Timer(object):
+    __slots__ = ("wall", "cpu", "child_wall", "child_cpu", "items")
+
+    def __init__(self):
+        self.wall = 0.0
+        self.cpu = 0.0
+        # Time spent in timers entered while this one was running
+        self.child_wall = 0.0
+        self.child_cpu = 0.0
+        self.items = 0
+
+    def to_dict(self):
+        return OrderedDict([
+            ("wall_seconds", round(self.wall - self.child_wall, 6)),
+            ("cpu_seconds", round(self.cpu - self.child_cpu, 6)),
+            ("items", self.items),
+        ])
+
+
+class _FormatStats(object):
+    __slots__ = ("files", "results", "bytes", "wall", "cpu")
+
+    def __init__(self):
+        self.files = 0
+        self.results = 0
+        self.bytes = 0
+        self.wall = 0.0
+        self.cpu = 0.0
+
+    def to_dict(self):
+        return OrderedDict([
+            ("files", self.files),
+            ("results", self.results),
+            ("bytes", self.bytes),
+            ("wall_seconds", round(self.wall, 6)),
+            ("cpu_seconds", round(self.cpu, 6)),
+            ("results_per_second", int(self.results / self.wall) if self.wall else None),
+        ])
+
+
+class Instrumentation(object):
+    """Records where the reporter spends its time, for the instrumentation sidecar file.
+
+    Phases are timed with phase() around a block, or with timed() around an
+    iterable, which counts the time spent producing each item. As results are
+    pulled lazily through the parsers, the policies and the reporters, phases
+    nest: every phase is reported exclusive of the phases timed inside it, so
+    the time the JSON writer spends waiting on the parsers is counted as
+    parsing. Times are those of the thread that timed them; CPU time is the
+    process's. Phases may be timed from several threads at once (the
+    reporters run on their own threads), so the totals are only updated
+    under a lock.
+
+    Disabled instances hand back their iterables untouched and write nothing,
+    so callers need not check whether instrumentation is on.
+    """
+
+    enabled = True
+
+    def __init__(self):
+        self._start_wall = time.perf_counter()
+        self._start_cpu = time.process_time()
+        self._phases = OrderedDict()
+        self._formats = OrderedDict()
+        self._files = []
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def _timer(self, name):
+        with self._lock:
+            timer = self._phases.get(name)
+            if timer is None:
+                timer = self._phases[name] = _Timer()
+            return timer
+
+    def _stack(self):
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def _enter(self, timer):
+        self._stack().append(timer)
+        return time.perf_counter(), time.process_time()
+
+    def _exit(self, timer, start, items):
+        wall = time.perf_counter() - start[0]
+        cpu = time.process_time() - start[1]
+        stack = self._stack()
+        stack.pop()
+        with self._lock:
+            timer.wall += wall
+            timer.cpu += cpu
+            timer.items += items
+            if stack:
+                stack[-1].child_wall += wall
+                stack[-1].child_cpu += cpu
+
+    @contextmanager
+    def phase(self, name: str):
+        timer = self._timer(name)
+        start = self._enter(timer)
+        try:
+            yield
+        finally:
+            self._exit(timer, start, 1)
+
+    def timed(self, name: str, iterable: Iterable[T]) -> Iterable[T]:
+        return self._timed(self._timer(name), iter(iterable))
+
+    def _timed(self, timer, iterator):
+        while True:
+            start = self._enter(timer)
+            items = 0
+            try:
+                item = next(iterator)
+                items = 1
+            except StopIteration:
+                return
+            finally:
+                self._exit(timer, start, items)
+            yield item
+
+    def file_results(self, format_name: str, path: str, results: Iterable[T]) -> Iterable[T]:
+        """Times the results read from one results file, counting them in the "parse" phase."""
+        timer = _Timer()
+        try:
+            for result in self._timed(timer, iter(results)):
+                yield result
+        finally:
+            try:
+                size = os.path.getsize(path)
+            except OSError:
+                size = 0
+            parse = self._timer("parse")
+            with self._lock:
+                parse.wall += timer.wall
+                parse.cpu += timer.cpu
+                parse.child_wall += timer.child_wall
+                parse.child_cpu += timer.child_cpu
+                parse.items += timer.items
+
+                stats = self._formats.get(format_name)
+                if stats is None:
+                    stats = self._formats[format_name] = _FormatStats()
+                stats.files += 1
+                stats.results += timer.items
+                stats.bytes += size
+                stats.wall += timer.wall - timer.child_wall
+                stats.cpu += timer.cpu - timer.child_cpu
+                self._files.append((size, path, format_name, timer.items, timer.wall - timer.child_wall))
+
+    def to_dict(self):
+        peak_rss = None
+        peak_rss_children = None
+        if resource is not None:
+            # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+            scale = 1 if sys.platform == "darwin" else 1024
+            peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+            peak_rss_children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale
+        with self._lock:
+            phases = OrderedDict((name, timer.to_dict()) for name, timer in self._phases.items())
+            formats = OrderedDict((name, stats.to_dict()) for name, stats in self._formats.items())
+            largest_files = heapq.nlargest(_LARGEST_FILES, self._files, key=lambda f: f[0])
+        return OrderedDict([
+            ("schema_version", INSTRUMENTATION_SCHEMA_VERSION),
+            ("python", sys.version.split()[0]),
+            ("platform", sys.platform),
+            ("wall_seconds", round(time.perf_counter() - self._start_wall, 6)),
+            ("cpu_seconds", round(time.process_time() - self._start_cpu, 6)),
+            ("peak_rss_bytes", peak_rss),
+            ("peak_rss_children_bytes", peak_rss_children),
+            ("phases", phases),
+            ("formats", formats),
+            ("largest_files", [
+                OrderedDict([
+                    ("path", path),
+                    ("format", format_name),
+                    ("bytes", size),
+                    ("results", results),
+                    ("wall_seconds", round(wall, 6)),
+                ])
+                for size, path, format_name, results, wall in largest_files
+            ]),
+        ])
+
+    def write(self, path: Optional[str] = None):
+        """Writes the instrumentation file, replacing any earlier one."""
+        path = path or instrumentation_path()
+        fd, temp_path = _helix_compat._create_temp_file(path)
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(self.to_dict(), f, indent=2)
+                f.write("\n")
+            os.replace(temp_path, path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+        log.info("Wrote reporter instrumentation to '%s'", path)
+
+
+class _DisabledInstrumentation(Instrumentation):
+
+    enabled = False
+
+    def __init__(self):
+        pass
+
+    @contextmanager
+    def phase(self, name):
+        yield
+
+    def timed(self, name, iterable):
+        return iterable
+
+    def file_results(self, format_name, path, results):
+        return results
+
+    def write(self, path=None):
+        pass
+
+
+DISABLED = _DisabledInstrumentation()
+
+
+def instrumentation_from_env() -> Instrumentation:
+    """Instrumentation enabled by HELIX_REPORTER_INSTRUMENTATION=1, or DISABLED."""
+    if os.environ.get("HELIX_REPORTER_INSTRUMENTATION") == "1":
+        return Instrumentation()
+    return DISABLED
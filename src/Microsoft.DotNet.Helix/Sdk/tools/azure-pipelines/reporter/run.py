@@ -1,37 +1,34 @@
 import os
-import re
 import sys
-import time
-import traceback
 import logging
-import shutil
-from queue import Queue
-from threading import Thread, Lock
 from typing import Tuple, Optional
  
-from helpers import get_env
-from test_results_reader import read_results
+from attachment_policy import AttachmentPolicy
+from helpers import fan_out, get_env, get_env_float, get_env_int, get_env_list
+from instrumentation import instrumentation_from_env
+from test_results_reader import parse_cache_from_env, read_results, watch_results
 
 # Bundled, dependency-free shim. Always importable. Provides the JSON writer
 # plus stand-ins for TestResult / TestResultAttachment / AzureDevOpsReportingParameters
 # used when helix-scripts is not installed (e.g. AOT Helix client).
 import _helix_compat
 
-# Try to use the real helix-scripts types so the legacy pickle (which keys on
-# fully-qualified class names) stays byte-identical with previous releases.
-# Fall back to the shim when helix-scripts is not present on the machine.
-try:
-    from helix.public import (
-        DefaultTestReporter,
-        AzureDevOpsReportingParameters,
-        PackingTestReporter,
-    )
-    _HELIX_SCRIPTS_AVAILABLE = True
-except ImportError:
-    DefaultTestReporter = None
-    PackingTestReporter = None
-    AzureDevOpsReportingParameters = _helix_compat.AzureDevOpsReportingParameters
-    _HELIX_SCRIPTS_AVAILABLE = False
+
+def _import_helix_reporting():
+    """Returns helix-scripts' (DefaultTestReporter, AzureDevOpsReportingParameters), or None.
+
+    The real helix-scripts types keep the legacy pickle (which keys on
+    fully-qualified class names) byte-identical with previous releases. They
+    are imported once main() gets to reporting, not when run.py is loaded, and
+    the shim is used instead when helix-scripts is not present on the machine.
+    The parsers look up the result types the same way (_helix_compat.result_types).
+    """
+    try:
+        from helix.public import DefaultTestReporter, AzureDevOpsReportingParameters
+    except ImportError:
+        return None
+    return DefaultTestReporter, AzureDevOpsReportingParameters
+
 
 def process_args() -> Tuple[str, str, str, Optional[str]]:
     if len(sys.argv) < 4 or len(sys.argv) > 5:
@@ -53,6 +50,8 @@ def process_args() -> Tuple[str, str, str, Optional[str]]:
 
 
 def main():
+    collection_uri, team_project, test_run_id, access_token = process_args()
+
     logging.basicConfig(
         format='%(asctime)s: %(levelname)s: %(thread)d: %(module)s(%(lineno)d): %(funcName)s: %(message)s',
         level=logging.INFO,
@@ -62,15 +61,80 @@ def main():
     )
     log = logging.getLogger(__name__)
 
-    collection_uri, team_project, test_run_id, access_token = process_args()
-
     log.info("Beginning reading of test results.")
 
+    # HELIX_REPORTER_INSTRUMENTATION=1 writes where the time went (search, parsing per format,
+    # attachment policy, legacy pickle, JSON) and peak RSS to __test_report_v2.instrumentation.json.
+    instrumentation = instrumentation_from_env()
+
     # In case the user puts the results in HELIX_WORKITEM_UPLOAD_ROOT for upload, check there too.
-    all_results = read_results([
+    # Work items that write many results files can opt into parsing them in a process
+    # pool by setting HELIX_REPORTER_PARSE_WORKERS to the number of processes to use.
+    # Upload roots full of dumps and logs can be kept out of the search with
+    # HELIX_REPORTER_PRUNE_DIRS (directory name globs, separated by os.pathsep) and
+    # HELIX_REPORTER_MAX_DEPTH. When the reporter runs more than once in a work item,
+    # HELIX_REPORTER_PARSE_CACHE=1 lets later runs reuse what earlier runs parsed.
+    # Work items that know where their results files are (or that write none) can skip the
+    # search by listing globs in HELIX_REPORTER_RESULT_GLOBS (relative to these directories,
+    # separated by os.pathsep), or bound it with HELIX_REPORTER_SEARCH_MAX_FILES and
+    # HELIX_REPORTER_SEARCH_MAX_SECONDS.
+    dirs_to_check = [
         os.getcwd(),
         get_env("HELIX_WORKITEM_UPLOAD_ROOT"),
-    ])
+    ]
+    # Watch mode: with HELIX_REPORTER_WATCH_STOP_FILE set, the reporter is started before the tests
+    # and reads the results files as they are written (polling every HELIX_REPORTER_WATCH_INTERVAL
+    # seconds), until that file exists. See test_results_reader/watch.py. The options that only
+    # apply to a single pass over finished files are ignored then.
+    watch_stop_file = os.environ.get("HELIX_REPORTER_WATCH_STOP_FILE")
+    if watch_stop_file:
+        ignored = [name for name in ("HELIX_REPORTER_PARSE_WORKERS", "HELIX_REPORTER_PARSE_CACHE",
+                                     "HELIX_REPORTER_SEARCH_MAX_FILES", "HELIX_REPORTER_SEARCH_MAX_SECONDS")
+                   if os.environ.get(name)]
+        if ignored:
+            log.warning("Ignoring {}: not supported with HELIX_REPORTER_WATCH_STOP_FILE".format(", ".join(ignored)))
+        if instrumentation.enabled:
+            log.warning("With HELIX_REPORTER_WATCH_STOP_FILE, the instrumentation file times reading the "
+                        "results as a whole; the search and each file's parsing are not broken out")
+        all_results = watch_results(
+            dirs_to_check,
+            watch_stop_file,
+            poll_interval=get_env_float("HELIX_REPORTER_WATCH_INTERVAL", 1.0),
+            prune_dirs=get_env_list("HELIX_REPORTER_PRUNE_DIRS"),
+            max_depth=get_env_int("HELIX_REPORTER_MAX_DEPTH"),
+            result_globs=get_env_list("HELIX_REPORTER_RESULT_GLOBS"),
+        )
+    else:
+        all_results = read_results(
+            dirs_to_check,
+            parse_workers=get_env_int("HELIX_REPORTER_PARSE_WORKERS"),
+            prune_dirs=get_env_list("HELIX_REPORTER_PRUNE_DIRS"),
+            max_depth=get_env_int("HELIX_REPORTER_MAX_DEPTH"),
+            parse_cache=parse_cache_from_env(),
+            result_globs=get_env_list("HELIX_REPORTER_RESULT_GLOBS"),
+            max_files=get_env_int("HELIX_REPORTER_SEARCH_MAX_FILES"),
+            max_seconds=get_env_float("HELIX_REPORTER_SEARCH_MAX_SECONDS"),
+            instrumentation=instrumentation,
+        )
+    all_results = instrumentation.timed("read", all_results)
+
+    # Failing suites can attach the same multi-MB log to thousands of results. Opt into
+    # bounding the attachment text with HELIX_REPORTER_MAX_ATTACHMENT_BYTES (per attachment),
+    # HELIX_REPORTER_MAX_TOTAL_ATTACHMENT_BYTES (per work item) and
+    # HELIX_REPORTER_DEDUPE_ATTACHMENTS=1.
+    attachment_policy = AttachmentPolicy(
+        max_attachment_bytes=get_env_int("HELIX_REPORTER_MAX_ATTACHMENT_BYTES"),
+        max_total_bytes=get_env_int("HELIX_REPORTER_MAX_TOTAL_ATTACHMENT_BYTES"),
+        dedupe=os.environ.get("HELIX_REPORTER_DEDUPE_ATTACHMENTS") == "1",
+    )
+    if attachment_policy.enabled:
+        all_results = instrumentation.timed("attachment_policy", attachment_policy.apply(all_results))
+
+    helix_reporting = _import_helix_reporting()
+    if helix_reporting is not None:
+        DefaultTestReporter, AzureDevOpsReportingParameters = helix_reporting
+    else:
+        AzureDevOpsReportingParameters = _helix_compat.AzureDevOpsReportingParameters
 
     azdo_parameters = AzureDevOpsReportingParameters(
         collection_uri,
@@ -83,30 +147,100 @@ def main():
     #    {HELIX_WORKITEM_ROOT}/__test_report.json that the Python Helix client
     #    (helix.executor) consumes. Behavior here is byte-identical to the
     #    pre-change reporter so existing consumers see no difference.
-    if _HELIX_SCRIPTS_AVAILABLE:
-        try:
+    def write_legacy_results(results):
+        with instrumentation.phase("legacy_pickle"):
             reporter = DefaultTestReporter(azdo_parameters)
-            reporter.report_results(all_results)
-        except Exception:
-            log.exception("Legacy pickle reporter failed; continuing to write JSON results")
+            reporter.report_results(results)
+
+    # 2) New: always write a portable JSON results file alongside. This is
+    #    language-neutral and lets non-Python Helix clients (e.g. the AOT
+    #    client) consume results without installing helix-scripts.
+    #    HELIX_REPORTER_BATCH_SIZE opts into publishing results in batches from a pool of
+    #    HELIX_REPORTER_PUBLISH_WORKERS threads while parsing is still running, to the
+    #    JSON file and, when HELIX_REPORTER_RESULTS_URL is set, to that HTTP endpoint.
+    def write_json_results(results):
+        with instrumentation.phase("json_write"):
+            # HELIX_REPORTER_JSON_COMPRESSION=gzip|zstd writes a compressed results file instead.
+            compression = os.environ.get("HELIX_REPORTER_JSON_COMPRESSION")
+            batch_size = get_env_int("HELIX_REPORTER_BATCH_SIZE")
+            if batch_size:
+                # Imported only when used: urllib.request accounts for a good part of startup time
+                from batched_reporter import BatchedReporter, HttpSink, JsonFileSink
+
+                sinks = [JsonFileSink(azdo_parameters, log=log, compression=compression)]
+                results_url = os.environ.get("HELIX_REPORTER_RESULTS_URL")
+                if results_url:
+                    sinks.append(HttpSink(results_url, azdo_parameters, log=log))
+                BatchedReporter(
+                    sinks,
+                    batch_size=batch_size,
+                    workers=get_env_int("HELIX_REPORTER_PUBLISH_WORKERS", 4),
+                    log=log,
+                ).report_results(results)
+            else:
+                # HELIX_REPORTER_SHARD_MAX_RESULTS / HELIX_REPORTER_SHARD_MAX_BYTES split the results
+                # over numbered shard files listed by a manifest, see RESULTS_FORMAT.md.
+                _helix_compat.JsonReporter(
+                    azdo_parameters,
+                    log=log,
+                    compression=compression,
+                    shard_max_results=get_env_int("HELIX_REPORTER_SHARD_MAX_RESULTS"),
+                    shard_max_bytes=get_env_int("HELIX_REPORTER_SHARD_MAX_BYTES"),
+                ).report_results(results)
+
+    # 3) Optional: HELIX_REPORTER_COLUMNAR=1 also writes __test_report_v2.columns, a columnar
+    #    copy of the results for analysis across many work items, see RESULTS_FORMAT.md.
+    def write_columnar_results(results):
+        with instrumentation.phase("columnar_write"):
+            _helix_compat.ColumnarReporter(azdo_parameters, log=log).report_results(results)
+
+    def waiting_on_results(write):
+        # In fan_out's threads, the time spent waiting for results goes to parsing, not writing
+        return lambda results: write(instrumentation.timed("fan_out_wait", results))
+
+    writers = []
+    if helix_reporting is not None:
+        writers.append(write_legacy_results)
     else:
         log.warning(
             "helix-scripts not available; skipping legacy pickle reporter. "
             "Consumers must read the JSON results file at '%s'.",
             _helix_compat.json_results_path(),
         )
+    writers.append(write_json_results)
+    if os.environ.get("HELIX_REPORTER_COLUMNAR") == "1":
+        writers.append(write_columnar_results)
+    else:
+        _helix_compat.remove_columnar_results()
 
-    # 2) New: always write a portable JSON results file alongside. This is
-    #    language-neutral and lets non-Python Helix clients (e.g. the AOT
-    #    client) consume results without installing helix-scripts.
+    # All outputs are written from a single pass over the results files: fan_out feeds them
+    # from one stream, each in its own thread, holding at most about
+    # HELIX_REPORTER_FAN_OUT_BUFFER results for the slowest one.
     try:
-        _helix_compat.JsonReporter(azdo_parameters, log=log).report_results(all_results)
-    except Exception:
-        log.exception("Failed to write JSON results file")
+        errors = fan_out(
+            all_results,
+            [waiting_on_results(write) for write in writers] if len(writers) > 1 else writers,
+            buffer_size=get_env_int("HELIX_REPORTER_FAN_OUT_BUFFER", 1000),
+        )
+    finally:
+        try:
+            instrumentation.write()
+        except Exception:
+            log.exception("Failed to write the reporter instrumentation file")
+    errors = dict(zip(writers, errors))
+
+    if errors.get(write_legacy_results) is not None:
+        log.error("Legacy pickle reporter failed; continuing to write JSON results",
+                  exc_info=errors[write_legacy_results])
+    if errors.get(write_columnar_results) is not None:
+        log.error("Failed to write columnar results file", exc_info=errors[write_columnar_results])
+    json_error = errors[write_json_results]
+    if json_error is not None:
+        log.error("Failed to write JSON results file", exc_info=json_error)
         # Don't fail the work item solely because of the new path; the legacy
         # pickle file (if it was written above) is still the primary contract.
-        if not _HELIX_SCRIPTS_AVAILABLE:
-            raise
+        if helix_reporting is None:
+            raise json_error
 
 if __name__ == '__main__':
     main()
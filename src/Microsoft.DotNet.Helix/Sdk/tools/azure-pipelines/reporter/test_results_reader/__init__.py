@@ -1,32 +1,38 @@
 import logging
 import os
-try:
-    # Preferred: real helix-scripts types (allows pickle round-trip via the
-    # legacy PackingTestReporter path).
-    from helix.public import TestResult, TestResultAttachment
-except ImportError:
-    # Fallback: bundled shim used when helix-scripts is not installed on
-    # the test machine (e.g. AOT Helix client images).
-    from _helix_compat import TestResult, TestResultAttachment
-from typing import Iterable, List
-from formats import all_formats
+from collections import deque
+from typing import TYPE_CHECKING, Iterable, List, Optional, Tuple
+from _helix_compat import result_types
+from formats import all_formats, ResultFormat
 from helpers import get_env
+from instrumentation import DISABLED, Instrumentation
+from .discovery import find_results_files
+from .parse_cache import ParseCache, parse_cache_from_env
+if TYPE_CHECKING:
+    from helix.public import TestResult
 
 
 log = logging.getLogger(__name__)
 
-def __no_results_result():
-    exitCode = get_env("_commandExitCode")
+def __no_results_result(exit_code: Optional[str] = None, search_stopped: Optional[str] = None):
+    # exit_code overrides _commandExitCode, for callers that learn it after the reporter started
+    exitCode = exit_code if exit_code is not None else get_env("_commandExitCode")
     work_item_name = get_env("HELIX_WORKITEM_FRIENDLYNAME")
     
     if exitCode != "0":
         # if we have a catastrophic failure, we want to create the fake test result with attached dump files and logs (if available)
         return
+    elif search_stopped:
+        # The results files may well be past the point where the search gave up
+        result = 'Fail'
+        failure_message = ('{} (HELIX_REPORTER_SEARCH_MAX_FILES / HELIX_REPORTER_SEARCH_MAX_SECONDS) '
+                           'without finding a test results file'.format(search_stopped))
     else:
         result = 'Pass'
         failure_message = None
 
-    return TestResult(
+    test_result = result_types()[0]
+    return test_result(
         name=u'{}.WorkItemExecution'.format(work_item_name),
         kind=u'unknown',
         type_name=u'{}'.format(work_item_name),
@@ -41,23 +47,138 @@ def __no_results_result():
     )
 
 
-def read_results(dirs_to_check: List[str]) -> Iterable[TestResult]:
+def _read_file_results(f: ResultFormat, file_path: str, parse_cache: Optional[ParseCache]) -> Iterable['TestResult']:
+    if parse_cache is None:
+        return f.read_results(file_path)
+    return parse_cache.read_results(f, file_path)
+
+
+def _read_file(format_name: str, file_path: str) -> List['TestResult']:
+    # Runs in a worker process, so it takes the format by name and hands back a list
+    # (which is pickled to the parent) instead of a generator.
+    f = next(f for f in all_formats if f.name == format_name)
+    return list(f.read_results(file_path))
+
+
+def _read_files_parallel(results_files: List[Tuple[ResultFormat, str]], parse_workers: int,
+                         parse_cache: Optional[ParseCache], instrumentation: Instrumentation) -> Iterable['TestResult']:
+    # Imported here: concurrent.futures.process pulls in multiprocessing, which most
+    # work items never use
+    from concurrent.futures import ProcessPoolExecutor
+
+    log.info('Parsing {} results files with {} worker processes'.format(len(results_files), parse_workers))
+    with ProcessPoolExecutor(max_workers=parse_workers) as executor:
+        # Only keep a couple of files per worker in flight so the parsed results waiting
+        # to be consumed stay bounded. Results are yielded in submission order, which keeps
+        # the output identical to the serial path.
+        in_flight = deque()
+
+        def drain_one():
+            f, file_path, cache_key, future, cached = in_flight.popleft()
+            return instrumentation.file_results(f.name, file_path, results_of(file_path, cache_key, future, cached))
+
+        def results_of(file_path, cache_key, future, cached):
+            # A generator, so that waiting for the worker is timed as parsing the file
+            if cached is not None:
+                results = cached
+            else:
+                results = future.result()
+                if parse_cache is not None:
+                    results = parse_cache.store(file_path, cache_key, results)
+            for result in results:
+                yield result
+
+        for f, file_path in results_files:
+            cache_key = None
+            cached = None
+            future = None
+            if parse_cache is not None:
+                cache_key = parse_cache.key(f, file_path)
+                cached = parse_cache.load(f, file_path, cache_key)
+            if cached is None:
+                future = executor.submit(_read_file, f.name, file_path)
+            in_flight.append((f, file_path, cache_key, future, cached))
+            if len(in_flight) >= 2 * parse_workers:
+                for result in drain_one():
+                    yield result
+        while in_flight:
+            for result in drain_one():
+                yield result
+
+
+def read_results(dirs_to_check: List[str], parse_workers: Optional[int] = None,
+                 prune_dirs: Optional[List[str]] = None, max_depth: Optional[int] = None,
+                 parse_cache: Optional[ParseCache] = None, result_globs: Optional[List[str]] = None,
+                 max_files: Optional[int] = None, max_seconds: Optional[float] = None,
+                 instrumentation: Instrumentation = DISABLED) -> Iterable['TestResult']:
+    """Yields the results from every results file found under dirs_to_check.
+
+    When parse_workers is greater than 1 the files are parsed in a pool of that many
+    processes. The results are yielded in the same order either way.
+
+    Directories whose name matches one of the prune_dirs glob patterns, or that are more
+    than max_depth levels below a directory in dirs_to_check, are not searched.
+
+    With a parse_cache, files whose cache entry is still valid are not parsed again.
+
+    result_globs limits the search to the files matching them, without walking
+    dirs_to_check, and max_files / max_seconds bound the walk otherwise (see
+    find_results_files). When no results file is found, a single passing
+    WorkItemExecution result is yielded instead, or a failing one when the
+    search was cut short by max_files / max_seconds.
+
+    The search and the parsing of each file are timed by instrumentation.
+    """
 
     found = False
+    search_stopped = []
+    results_files = instrumentation.timed("search", find_results_files(
+        dirs_to_check, prune_dirs, max_depth, result_globs, max_files, max_seconds,
+        on_truncated=search_stopped.append))
 
-    for dir in dirs_to_check:
-        log.info("Searching '{}' for test results files".format(dir))
-        for root, dirs, files in os.walk(dir):
-            for file_name in files:
-                for f in all_formats:
-                    if file_name.endswith(tuple(f.acceptable_file_suffixes)):
-                        file_path = os.path.join(root, file_name)
-                        log.info('Found results file {} with format {}'.format(file_path, f.name))
-                        found = True
-                        file_results = f.read_results(file_path)
-                        for result in file_results:
-                            yield result
+    if parse_workers is not None and parse_workers > 1:
+        results_files = list(results_files)
+        found = bool(results_files)
+        if len(results_files) > 1:
+            for result in _read_files_parallel(results_files, parse_workers, parse_cache, instrumentation):
+                yield result
+        else:
+            for f, file_path in results_files:
+                for result in instrumentation.file_results(
+                        f.name, file_path, _read_file_results(f, file_path, parse_cache)):
+                    yield result
+    else:
+        for f, file_path in results_files:
+            found = True
+            file_results = instrumentation.file_results(
+                f.name, file_path, _read_file_results(f, file_path, parse_cache))
+            for result in file_results:
+                yield result
+
+    if parse_cache is not None:
+        parse_cache.evict()
 
     if not found:
         log.warn('No results file found in any of the following formats: {}'.format(', '.join((f.name for f in all_formats))))
-        yield __no_results_result()
+        yield __no_results_result(search_stopped=search_stopped[0] if search_stopped else None)
+
+
+def watch_results(dirs_to_check: List[str], stop_file: str, poll_interval: float = 1.0,
+                  prune_dirs: Optional[List[str]] = None, max_depth: Optional[int] = None,
+                  result_globs: Optional[List[str]] = None) -> Iterable['TestResult']:
+    """Like read_results, but reads the results files while the tests are writing them.
+
+    Results are yielded as they are written until stop_file exists, then the
+    rest of every file is read; see watch.ResultsWatcher. Text in stop_file is
+    taken as the test command's exit code.
+    """
+    from .watch import ResultsWatcher
+
+    watcher = ResultsWatcher(dirs_to_check, stop_file, poll_interval, prune_dirs, max_depth, result_globs)
+    for result in watcher:
+        yield result
+
+    if not watcher.files_found:
+        log.warn('No results file found in any of the following formats: {}'.format(', '.join((f.name for f in all_formats))))
+        # The watcher was started before the exit code was known
+        yield __no_results_result(watcher.stop_text or None)
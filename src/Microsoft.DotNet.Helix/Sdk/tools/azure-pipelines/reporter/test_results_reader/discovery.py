@@ -0,0 +1,182 @@
+import fnmatch
+import glob
+import logging
+import os
+import re
+import time
+from typing import Callable, Iterable, List, Optional, Set, Tuple
+from formats import all_formats, ResultFormat
+
+
+log = logging.getLogger(__name__)
+
+# acceptable_file_suffixes is a generator, so build the suffix tuples once per
+# process rather than once per file and format.
+_format_suffixes = [(tuple(f.acceptable_file_suffixes), f) for f in all_formats]
+_all_suffixes = tuple(suffix for suffixes, _ in _format_suffixes for suffix in suffixes)
+
+
+def formats_for(file_name: str) -> List[ResultFormat]:
+    """Returns the formats that claim file_name, in all_formats order."""
+    if not file_name.endswith(_all_suffixes):
+        return []
+    return [f for suffixes, f in _format_suffixes if file_name.endswith(suffixes)]
+
+
+def _prune_matcher(prune_dirs: Optional[List[str]]) -> Optional[Callable[[str], bool]]:
+    if not prune_dirs:
+        return None
+    pattern = re.compile('|'.join(fnmatch.translate(os.path.normcase(p)) for p in prune_dirs))
+    return lambda name: pattern.match(os.path.normcase(name)) is not None
+
+
+def _canonical(path: str) -> str:
+    return os.path.normcase(os.path.realpath(path))
+
+
+def _is_within(path: str, directory: str) -> bool:
+    return path == directory or path.startswith(directory.rstrip(os.sep) + os.sep)
+
+
+def _walk(top: str, prune: Optional[Callable[[str], bool]], max_depth: Optional[int],
+          skip: Set[str]) -> Iterable[Tuple[str, List[str]]]:
+    """Yields (directory, file names) in the same order as os.walk(top).
+
+    Like os.walk, symbolic links to directories are not followed and
+    directories that cannot be listed are skipped. Directories whose name
+    matches prune, that are deeper than max_depth below top, or whose
+    canonical path is in skip are not descended into.
+    """
+    stack = [(top, _canonical(top) if skip else None, 0)]
+    while stack:
+        directory, canonical, depth = stack.pop()
+        file_names = []
+        subdirs = []
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    try:
+                        is_dir = entry.is_dir()
+                    except OSError:
+                        is_dir = False
+                    if not is_dir:
+                        file_names.append(entry.name)
+                        continue
+                    try:
+                        is_symlink = entry.is_symlink()
+                    except OSError:
+                        is_symlink = False
+                    if not is_symlink:
+                        subdirs.append(entry.name)
+        except OSError:
+            continue
+
+        yield directory, file_names
+
+        if max_depth is not None and depth >= max_depth:
+            continue
+        for name in reversed(subdirs):
+            if prune is not None and prune(name):
+                continue
+            child_canonical = None
+            if canonical is not None:
+                child_canonical = os.path.join(canonical, os.path.normcase(name))
+                if child_canonical in skip:
+                    continue
+            stack.append((os.path.join(directory, name), child_canonical, depth + 1))
+
+
+def _ignore(*args):
+    pass
+
+
+def _glob_results_files(dirs_to_check: List[str], result_globs: List[str],
+                        info: Callable[..., None]) -> Iterable[Tuple[ResultFormat, str]]:
+    """Yields (format, path) for the files matching result_globs, without walking the directories.
+
+    Relative patterns are matched under each of dirs_to_check, absolute ones
+    as they are, and '**' matches any number of directories. A file matched
+    more than once is only yielded once.
+    """
+    seen = set()
+    for dir in dirs_to_check:
+        for pattern in result_globs:
+            for file_path in sorted(glob.iglob(os.path.join(dir, pattern), recursive=True)):
+                canonical = _canonical(file_path)
+                if canonical in seen or not os.path.isfile(file_path):
+                    continue
+                seen.add(canonical)
+                file_formats = formats_for(os.path.basename(file_path))
+                if not file_formats:
+                    log.warning("'{}' matches the result globs but is not a results file of any known format".format(
+                        file_path))
+                for f in file_formats:
+                    info('Found results file {} with format {}'.format(file_path, f.name))
+                    yield f, file_path
+
+
+def find_results_files(dirs_to_check: List[str], prune_dirs: Optional[List[str]] = None,
+                       max_depth: Optional[int] = None, result_globs: Optional[List[str]] = None,
+                       max_files: Optional[int] = None,
+                       max_seconds: Optional[float] = None,
+                       verbose: bool = True,
+                       on_truncated: Optional[Callable[[str], None]] = None) -> Iterable[Tuple[ResultFormat, str]]:
+    """Yields (format, path) for every results file under dirs_to_check.
+
+    A directory is only searched once even when dirs_to_check overlap, e.g.
+    when the working directory is inside HELIX_WORKITEM_UPLOAD_ROOT.
+
+    With result_globs, only the files matching them are considered and the
+    directories are not walked. Otherwise, the search stops once it has seen
+    max_files files or has spent max_seconds walking the directories (the
+    time the caller spends between files doesn't count); results files past
+    that point are not found, and on_truncated is called with a description
+    of where the search stopped.
+
+    verbose=False leaves out the info messages about the search and the files
+    found, for callers that search the same directories repeatedly.
+    """
+    info = log.info if verbose else _ignore
+    if result_globs:
+        info("Searching {} for test results files matching {}".format(
+            ", ".join("'{}'".format(d) for d in dirs_to_check), ", ".join(result_globs)))
+        for result in _glob_results_files(dirs_to_check, result_globs, info):
+            yield result
+        return
+
+    prune = _prune_matcher(prune_dirs)
+    searched = set()
+    files_seen = 0
+    # Only the time spent walking counts towards max_seconds, not the time the caller takes between files
+    search_seconds = 0.0
+    for dir in dirs_to_check:
+        canonical = _canonical(dir)
+        if any(_is_within(canonical, s) for s in searched):
+            info("Skipping '{}', it was already searched for test results files".format(dir))
+            continue
+
+        info("Searching '{}' for test results files".format(dir))
+        walk = _walk(dir, prune, max_depth, searched)
+        while True:
+            start = time.monotonic()
+            try:
+                root, file_names = next(walk)
+            except StopIteration:
+                break
+            finally:
+                search_seconds += time.monotonic() - start
+            for file_name in file_names:
+                for f in formats_for(file_name):
+                    file_path = os.path.join(root, file_name)
+                    info('Found results file {} with format {}'.format(file_path, f.name))
+                    yield f, file_path
+            files_seen += len(file_names)
+            if ((max_files is not None and files_seen >= max_files) or
+                    (max_seconds is not None and search_seconds >= max_seconds)):
+                stopped = "Stopped searching for test results files after {} files ({:.1f}s) in {}".format(
+                    files_seen, search_seconds, root)
+                log.warning("{}; results files past that point are not reported".format(stopped))
+                if on_truncated is not None:
+                    on_truncated(stopped)
+                return
+        searched.add(canonical)
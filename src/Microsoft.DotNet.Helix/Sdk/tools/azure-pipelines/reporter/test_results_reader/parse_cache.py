@@ -0,0 +1,189 @@
+import gzip
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import zlib
+from typing import TYPE_CHECKING, Iterable, Optional
+from _helix_compat import _json_encoder, _result_from_json, _result_to_dict, result_types
+from helpers import get_env_int
+from formats import ResultFormat
+if TYPE_CHECKING:
+    from helix.public import TestResult
+
+
+log = logging.getLogger(__name__)
+
+# Bump whenever a parser starts producing different results for the same file,
+# so entries written by an older reporter are not reused.
+_CACHE_VERSION = 1
+
+_ENTRY_SUFFIX = ".results.gz"
+
+_DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+
+
+class ParseCache(object):
+    """On-disk cache of the results parsed from each results file.
+
+    Lets a second reporter run in the same work item (a retry, or another run
+    from post-commands) skip the files it has already parsed. Entries are keyed
+    by the file's path, size and modification time, plus a SHA-256 of its
+    content when use_content_hash is set. Each entry is a gzip'd JSON line per
+    result, written as the file is parsed. The least recently used entries are
+    evicted once the cache grows past max_bytes. With refresh set, existing
+    entries are ignored and rewritten.
+    """
+
+    def __init__(self, directory, max_bytes=_DEFAULT_MAX_BYTES, use_content_hash=False, refresh=False):
+        self._directory = directory
+        self._max_bytes = max_bytes
+        self._use_content_hash = use_content_hash
+        self._refresh = refresh
+
+    def read_results(self, f: ResultFormat, path: str) -> Iterable['TestResult']:
+        key = self.key(f, path)
+        cached = self.load(f, path, key)
+        if cached is not None:
+            return cached
+        return self.store(path, key, f.read_results(path))
+
+    def key(self, f: ResultFormat, path: str) -> dict:
+        st = os.stat(path)
+        key = {
+            "version": _CACHE_VERSION,
+            "format": f.name,
+            "path": os.path.abspath(path),
+            "size": st.st_size,
+            "mtime_ns": st.st_mtime_ns,
+        }
+        if self._use_content_hash:
+            digest = hashlib.sha256()
+            with open(path, "rb") as content:
+                for chunk in iter(lambda: content.read(1024 * 1024), b""):
+                    digest.update(chunk)
+            key["sha256"] = digest.hexdigest()
+        return key
+
+    def _entry_path(self, key):
+        name = hashlib.sha1(key["path"].encode("utf-8")).hexdigest()
+        return os.path.join(self._directory, name + _ENTRY_SUFFIX)
+
+    def load(self, f: ResultFormat, path: str, key: dict) -> Optional[Iterable['TestResult']]:
+        """Returns the cached results for path, or None if there is no valid entry."""
+        if self._refresh:
+            return None
+        entry_path = self._entry_path(key)
+        try:
+            entry = gzip.open(entry_path, "rt", encoding="utf-8")
+        except OSError:
+            return None
+        try:
+            header = json.loads(entry.readline())
+        except (OSError, EOFError, ValueError, zlib.error):
+            header = None
+        if header != key:
+            entry.close()
+            return None
+
+        log.info('Using cached results for {}'.format(path))
+        try:
+            # Mark the entry as recently used for eviction
+            os.utime(entry_path)
+        except OSError:
+            pass
+        return self._read_entry(f, path, entry)
+
+    def _read_entry(self, f, path, entry):
+        test_result, test_result_attachment = result_types()
+        count = 0
+        try:
+            for line in entry:
+                yield _result_from_json(json.loads(line), test_result, test_result_attachment)
+                count += 1
+            return
+        except (OSError, EOFError, ValueError, zlib.error) as e:
+            log.warning('Cached results for {} are unreadable ({}); parsing the file instead'.format(path, e))
+        finally:
+            entry.close()
+
+        # Parsing is deterministic, so skip what was already yielded from the cache
+        for index, result in enumerate(f.read_results(path)):
+            if index >= count:
+                yield result
+
+    def store(self, path: str, key: dict, results: Iterable['TestResult']) -> Iterable['TestResult']:
+        """Passes results through, writing them to the cache entry for path."""
+        try:
+            os.makedirs(self._directory, exist_ok=True)
+            fd, temp_path = tempfile.mkstemp(suffix=".tmp", dir=self._directory)
+        except OSError as e:
+            log.warning('Cannot write the parse cache in {}: {}'.format(self._directory, e))
+            for result in results:
+                yield result
+            return
+
+        complete = False
+        try:
+            with os.fdopen(fd, "wb") as raw, gzip.GzipFile(fileobj=raw, mode="wb", compresslevel=1, mtime=0) as entry:
+                entry.write(_json_encoder.encode(key).encode("utf-8") + b"\n")
+                for result in results:
+                    entry.write(_json_encoder.encode(_result_to_dict(result)).encode("utf-8") + b"\n")
+                    yield result
+            complete = True
+        finally:
+            if complete:
+                os.replace(temp_path, self._entry_path(key))
+            else:
+                try:
+                    os.remove(temp_path)
+                except OSError:
+                    pass
+
+    def evict(self):
+        """Deletes least recently used entries until the cache fits in max_bytes."""
+        entries = []
+        total = 0
+        try:
+            with os.scandir(self._directory) as it:
+                for e in it:
+                    try:
+                        st = e.stat()
+                    except OSError:
+                        continue
+                    if e.name.endswith(_ENTRY_SUFFIX):
+                        entries.append((st.st_mtime, st.st_size, e.path))
+                        total += st.st_size
+        except OSError:
+            return
+
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self._max_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+
+
+def parse_cache_from_env() -> Optional[ParseCache]:
+    """Creates the cache configured by the HELIX_REPORTER_PARSE_CACHE* variables.
+
+    HELIX_REPORTER_PARSE_CACHE             1 to use the cache, refresh to reparse every
+                                           file and rewrite its entry; off when unset or 0
+    HELIX_REPORTER_PARSE_CACHE_HASH        1 to also key entries on a SHA-256 of the file
+    HELIX_REPORTER_PARSE_CACHE_MAX_BYTES   size the cache is trimmed to (default 512MB)
+    """
+    mode = os.environ.get("HELIX_REPORTER_PARSE_CACHE", "").lower()
+    if mode in ("", "0", "false", "off"):
+        return None
+    directory = os.path.join(os.environ.get("HELIX_WORKITEM_ROOT") or os.getcwd(), ".reporter-parse-cache")
+    return ParseCache(
+        directory,
+        max_bytes=get_env_int("HELIX_REPORTER_PARSE_CACHE_MAX_BYTES", _DEFAULT_MAX_BYTES),
+        use_content_hash=os.environ.get("HELIX_REPORTER_PARSE_CACHE_HASH") == "1",
+        refresh=mode == "refresh",
+    )
@@ -0,0 +1,229 @@
+"""Reads results files while the tests that write them are still running.
+
+The reporter normally runs from HelixPostCommands, so all of its parsing
+lands at the end of the work item. In watch mode it is started before the
+tests instead, and follows the xunit and junit results files as they are
+written: each poll parses what was appended since the last one, so most
+results have been read (and written to the results file) by the time the
+tests finish. TRX files, whose results refer to definitions further down
+the file, are read whole at the end.
+
+Watching stops once the stop file exists; the remainder of every file is
+then read and the iteration ends. A work item opts in with something like
+
+    HelixPreCommands:  export HELIX_REPORTER_WATCH_STOP_FILE=$HELIX_WORKITEM_ROOT/reporter.stop
+                       $HELIX_PYTHONPATH .../reporter/run.py ... &
+                       REPORTER_PID=$!
+    HelixPostCommands: echo $_commandExitCode > $HELIX_REPORTER_WATCH_STOP_FILE
+                       wait $REPORTER_PID
+
+The stop file may hold the test command's exit code, which is then used
+in place of _commandExitCode, as the reporter was started before it was
+known. A stop file last written before the reporter started, e.g. left
+behind by an earlier run, is ignored.
+
+Files are parsed on the reporter's own thread as they grow, so
+HELIX_REPORTER_PARSE_WORKERS, HELIX_REPORTER_PARSE_CACHE and the search
+limits (HELIX_REPORTER_SEARCH_MAX_FILES / _MAX_SECONDS) do not apply in
+watch mode, and instrumentation does not break the time down by search,
+format or file; run.py logs a warning when any of them is set.
+"""
+
+import logging
+import os
+import time
+import xml.etree.ElementTree
+from collections import OrderedDict
+from itertools import islice
+from typing import TYPE_CHECKING, Iterable, List, Optional
+from formats import ResultFormat, xml_backend
+from .discovery import find_results_files
+if TYPE_CHECKING:
+    from helix.public import TestResult
+
+
+log = logging.getLogger(__name__)
+
+_READ_SIZE = 1024 * 1024
+
+# A stop file counts when it was written after the watcher started, give or take the
+# resolution of file modification times
+_STOP_FILE_MTIME_SLACK = 2.0
+
+# Searching for new results files is skipped on the polls after a slow search, so that
+# searching takes at most about this share of the time spent watching
+_SEARCH_SHARE = 0.1
+
+
+class _TailedFile(object):
+    """Follows one results file, parsing what has been appended to it since the last poll."""
+
+    def __init__(self, f: ResultFormat, path: str):
+        self.format = f
+        self.path = path
+        self.incremental = f.result_tags is not None and hasattr(f, 'read_element')
+        # Results read from the file so far, all of which have been yielded
+        self.count = 0
+        self._identity = None
+        self._offset = 0
+        self._parser = None
+        # Results the current parser has read; behind count after a restart
+        self._parsed = 0
+        self._broken = False
+
+    def _read(self, elements):
+        for element in elements:
+            self._parsed += 1
+            if self._parsed > self.count:
+                self.count += 1
+                yield self.format.read_element(element)
+            # remove the element's content so we don't keep it around too long.
+            element.clear()
+
+    def poll(self) -> Iterable['TestResult']:
+        """Yields the results completed since the last poll."""
+        if not self.incremental or self._broken:
+            return
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return
+        identity = (st.st_dev, st.st_ino)
+        if self._parser is None or identity != self._identity or st.st_size < self._offset:
+            if self._parser is not None:
+                log.info("'{}' was rewritten; reading it again, skipping the {} results already read".format(
+                    self.path, self.count))
+            self._identity = identity
+            self._offset = 0
+            self._parsed = 0
+            self._parser = xml_backend.TailParser(self.format.result_tags)
+        if st.st_size == self._offset:
+            return
+
+        try:
+            with open(self.path, 'rb') as stream:
+                stream.seek(self._offset)
+                while True:
+                    data = stream.read(_READ_SIZE)
+                    if not data:
+                        break
+                    self._offset += len(data)
+                    for result in self._read(self._parser.feed(data)):
+                        yield result
+        except OSError as e:
+            log.warning("Cannot read '{}' ({}); trying again on the next poll".format(self.path, e))
+            # Start over from scratch next time; the results read so far are skipped then
+            self._parser = None
+        except xml.etree.ElementTree.ParseError as e:
+            log.warning("Cannot follow '{}' ({}); it will be read whole once the tests have finished".format(
+                self.path, e))
+            self._broken = True
+
+    def finish(self) -> Iterable['TestResult']:
+        """Yields the rest of the results, once the file has been written completely."""
+        for result in self.poll():
+            yield result
+        if self.incremental and not self._broken and self._parser is not None:
+            try:
+                for result in self._read(self._parser.close()):
+                    yield result
+            except xml.etree.ElementTree.ParseError as e:
+                log.warning("'{}' is incomplete ({}); reporting the {} results read from it".format(
+                    self.path, e, self.count))
+            return
+        # Not followed, or following it failed: read it whole, skipping what was already read
+        if not os.path.exists(self.path):
+            log.warning("'{}' was removed before it could be read".format(self.path))
+            return
+        for result in islice(self.format.read_results(self.path), self.count, None):
+            self.count += 1
+            yield result
+
+
+class ResultsWatcher(object):
+    """Yields the results of the results files under dirs_to_check as they are written.
+
+    Every poll_interval seconds, the new results of every file found so far
+    are yielded, until stop_file exists. The rest of every file is then read.
+    dirs_to_check are searched for new results files (with prune_dirs,
+    max_depth and result_globs as in find_results_files) on the first and
+    the last poll, and in between on as many polls as keeps the search under
+    a tenth of the time spent watching. Results are
+    yielded in the order they are read, which can differ from the order
+    read_results yields them in.
+    """
+
+    def __init__(self, dirs_to_check: List[str], stop_file: str, poll_interval: float = 1.0,
+                 prune_dirs: Optional[List[str]] = None, max_depth: Optional[int] = None,
+                 result_globs: Optional[List[str]] = None):
+        self._dirs_to_check = dirs_to_check
+        self._stop_file = stop_file
+        self._poll_interval = poll_interval
+        self._prune_dirs = prune_dirs
+        self._max_depth = max_depth
+        self._result_globs = result_globs
+        self._files = OrderedDict()
+        self._next_search = 0.0
+        self._started = time.time()
+        self._stale_stop_file = False
+        # The text of the stop file, once watching has stopped
+        self.stop_text = None
+
+    @property
+    def files_found(self) -> int:
+        return len(self._files)
+
+    def _stop_file_written(self) -> bool:
+        try:
+            mtime = os.stat(self._stop_file).st_mtime
+        except OSError:
+            return False
+        if mtime < self._started - _STOP_FILE_MTIME_SLACK:
+            if not self._stale_stop_file:
+                log.info("Ignoring '{}', it was written before the reporter started".format(self._stop_file))
+                self._stale_stop_file = True
+            return False
+        return True
+
+    def _discover(self, force: bool):
+        search_start = time.monotonic()
+        if not force and search_start < self._next_search:
+            return
+        for f, file_path in find_results_files(self._dirs_to_check, self._prune_dirs, self._max_depth,
+                                               self._result_globs, verbose=False):
+            if file_path not in self._files:
+                tailed = _TailedFile(f, file_path)
+                log.info('Found results file {} with format {}{}'.format(
+                    file_path, f.name, '' if tailed.incremental else ', it will be read once the tests have finished'))
+                self._files[file_path] = tailed
+        self._next_search = search_start + (time.monotonic() - search_start) / _SEARCH_SHARE
+
+    def __iter__(self) -> Iterable['TestResult']:
+        log.info("Watching {} for test results until '{}' exists".format(
+            ", ".join("'{}'".format(d) for d in self._dirs_to_check), self._stop_file))
+        start = time.monotonic()
+        while True:
+            # Checked before the last poll, so that it sees everything written before the stop file
+            stopping = self._stop_file_written()
+            self._discover(force=stopping)
+            for tailed in self._files.values():
+                for result in tailed.poll():
+                    yield result
+            if stopping:
+                break
+            time.sleep(self._poll_interval)
+
+        before = sum(tailed.count for tailed in self._files.values())
+        finish_start = time.monotonic()
+        for tailed in self._files.values():
+            for result in tailed.finish():
+                yield result
+        after = sum(tailed.count for tailed in self._files.values())
+        log.info("Read {} results while the tests ran ({:.1f}s) and the last {} in {:.2f}s after they finished".format(
+            before, finish_start - start, after - before, time.monotonic() - finish_start))
+
+        try:
+            with open(self._stop_file, 'r') as stop:
+                self.stop_text = stop.read().strip()
+        except OSError:
+            self.stop_text = None
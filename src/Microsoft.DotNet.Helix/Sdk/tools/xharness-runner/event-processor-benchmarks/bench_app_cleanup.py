@@ -0,0 +1,186 @@
+# Licensed to the .NET Foundation under one or more agreements.
+# The .NET Foundation licenses this file to you under the MIT license.
+
+"""Measures how long xharness-event-processor.py takes to clear the apps off a device.
+
+When an app fails to install on an Android device (exit code 78), the
+processor removes every net.dot app from it. It is run here on a
+diagnostics.json with such an operation, with XHARNESS_CLI_PATH pointing
+at a stub of the XHarness CLI: each call of the stub sleeps for --startup
+seconds, standing in for the .NET runtime's startup, and runs the adb
+command against a fake device whose `pm` keeps the installed packages in a
+directory. One of the packages cannot be removed. Each mode runs the
+processor in a fresh process on --apps installed apps:
+
+    one_by_one - the device's shell rejects the bulk `pm uninstall`, and apps are
+                 removed with one `adb uninstall` at a time, as they used to be
+    pool       - the same, with the default pool of `adb uninstall` workers
+    bulk       - the default: `pm uninstall` from one adb shell session
+
+Records wall time, the number of XHarness calls and the apps left on the
+device, which must be the same in every mode. Prints the report as JSON.
+POSIX only, as the fake device's shell is sh.
+
+    python bench_app_cleanup.py [--apps 40] [--startup 0.2] [--repeat 1]
+"""
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import fakes
+
+STUCK_APP = "net.dot.stuck"
+
+# The XHarness CLI, for `version` and `android adb -- <adb arguments>`. Like adb,
+# `shell` joins its arguments and runs them with the device's shell.
+STUB_XHARNESS = '''#!{python}
+import os
+import subprocess
+import sys
+import time
+
+time.sleep(float(os.environ["STUB_STARTUP"]))
+with open(os.environ["STUB_LOG"], "a") as log:
+    log.write(" ".join(sys.argv[1:]) + "\\n")
+
+args = sys.argv[1:]
+if args == ["version"]:
+    print("1.0.0-prerelease.22269.1+6e87004b51c89c59ac4a34536e9bc22da0124f39")
+    sys.exit(0)
+
+assert args[:3] == ["android", "adb", "--"], args
+args = args[3:]
+if args[:1] == ["-s"]:
+    args = args[2:]
+
+device_env = dict(os.environ, PATH=os.environ["STUB_DEVICE_BIN"] + os.pathsep + os.environ["PATH"])
+if args[0] == "shell":
+    if len(args) == 2 and os.environ.get("STUB_SHELL_FAILS") == "1":
+        print("error: closed")
+        sys.exit(1)
+    sys.exit(subprocess.call(["sh", "-c", " ".join(args[1:])], env=device_env))
+if args[0] == "uninstall":
+    output = subprocess.check_output(["pm", "uninstall", args[1]], env=device_env).decode()
+    print(output.strip())
+    sys.exit(0 if output.strip() == "Success" else 1)
+sys.exit("Unexpected adb command: " + " ".join(args))
+'''
+
+# The device's package manager, for `pm list packages <filter>` and `pm uninstall <package>`
+FAKE_PM = '''#!{python}
+import os
+import sys
+
+packages = os.environ["STUB_PACKAGES"]
+if sys.argv[1] == "list":
+    for package in sorted(os.listdir(packages)):
+        if sys.argv[3] in package:
+            print("package:" + package)
+elif sys.argv[1] == "uninstall":
+    path = os.path.join(packages, sys.argv[2])
+    if os.path.exists(path) and sys.argv[2] != "{stuck}":
+        os.remove(path)
+        print("Success")
+    else:
+        print("Failure [DELETE_FAILED_INTERNAL_ERROR]")
+'''
+
+MODES = {
+    "one_by_one": {"STUB_SHELL_FAILS": "1", "XHARNESS_UNINSTALL_WORKERS": "1"},
+    "pool": {"STUB_SHELL_FAILS": "1"},
+    "bulk": {},
+}
+
+
+def _run(work_dir, fake_dir, mode, args):
+    packages = os.path.join(work_dir, "packages")
+    shutil.rmtree(packages, ignore_errors=True)
+    os.makedirs(packages)
+    for i in range(args.apps - 1):
+        open(os.path.join(packages, "net.dot.app%03d" % i), "w").close()
+    open(os.path.join(packages, STUCK_APP), "w").close()
+    open(os.path.join(packages, "com.android.settings"), "w").close()
+
+    stub_log = os.path.join(work_dir, "xharness-calls.log")
+    if os.path.exists(stub_log):
+        os.remove(stub_log)
+    env = dict(os.environ)
+    env.update(MODES[mode])
+    env.update({
+        "PYTHONPATH": fake_dir,
+        "FAKE_HELIX_LOG": os.path.join(work_dir, "helix.jsonl"),
+        "STUB_STARTUP": str(args.startup),
+        "STUB_LOG": stub_log,
+        "STUB_PACKAGES": packages,
+        "STUB_DEVICE_BIN": os.path.join(work_dir, "device"),
+        "XHARNESS_CLI_PATH": os.path.join(work_dir, "xharness"),
+        "HELIX_WORKITEM_ROOT": work_dir,
+        "HELIX_WORKITEM_UPLOAD_ROOT": work_dir,
+        # Keeps the XHarness version cache in the work directory
+        "TMPDIR": work_dir,
+    })
+    start = time.perf_counter()
+    subprocess.run([sys.executable, fakes.PROCESSOR, "-d", os.path.join(work_dir, "diagnostics.json")],
+                   cwd=work_dir, env=env, stdout=subprocess.DEVNULL, check=True)
+    wall = time.perf_counter() - start
+    with open(stub_log) as f:
+        calls = [line for line in f.read().splitlines() if line != "version"]
+    return {
+        "wall_seconds": round(wall, 4),
+        "xharness_calls": len(calls),
+        "apps_left": sorted(os.listdir(packages)),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--apps", type=int, default=40, help="net.dot apps installed on the device")
+    parser.add_argument("--startup", type=float, default=0.2, help="seconds per XHarness call")
+    parser.add_argument("--repeat", type=int, default=1, help="runs per mode; the fastest one is reported")
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix="event-processor-bench-")
+    try:
+        fake_dir = fakes.write_fake_helix(work_dir)
+        fakes.write_script(os.path.join(work_dir, "xharness"), STUB_XHARNESS.format(python=sys.executable))
+        os.makedirs(os.path.join(work_dir, "device"))
+        fakes.write_script(os.path.join(work_dir, "device", "pm"),
+                           FAKE_PM.format(python=sys.executable, stuck=STUCK_APP))
+        with open(os.path.join(work_dir, "diagnostics.json"), "w") as f:
+            json.dump([{
+                "command": "install",
+                "platform": "android",
+                "device": "emulator-5554",
+                "target": "arm64-v8a",
+                "isDevice": True,
+                "exitCode": 78,
+                "duration": 12.5,
+            }], f)
+
+        report = {
+            "python": sys.version.split()[0],
+            "parameters": {"apps": args.apps, "startup_seconds": args.startup},
+            "modes": {},
+        }
+        for mode in MODES:
+            runs = [_run(work_dir, fake_dir, mode, args) for _ in range(args.repeat)]
+            report["modes"][mode] = min(runs, key=lambda run: run["wall_seconds"])
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    report["speedup"] = round(report["modes"]["one_by_one"]["wall_seconds"] /
+                              report["modes"]["bulk"]["wall_seconds"], 2)
+    json.dump(report, sys.stdout, indent=2)
+    sys.stdout.write("\n")
+    if len(set(json.dumps(run["apps_left"]) for run in report["modes"].values())) != 1:
+        sys.exit("The modes left different apps on the device")
+
+
+if __name__ == "__main__":
+    main()
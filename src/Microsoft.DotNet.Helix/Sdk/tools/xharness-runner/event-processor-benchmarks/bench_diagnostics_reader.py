@@ -0,0 +1,144 @@
+# Licensed to the .NET Foundation under one or more agreements.
+# The .NET Foundation licenses this file to you under the MIT license.
+
+"""Measures the time and memory it takes to read a large diagnostics.json.
+
+Generates a diagnostics file with --operations XHarness commands, as left
+behind by a device stuck retrying, and reads every operation from it with
+the event processor, loaded as a module. Each mode reads the file in a
+fresh process, whose peak RSS is reported:
+
+    load      - json.load, the whole array at once
+    streaming - read_operations, one operation at a time
+
+Both modes must read the same operations. Also reports how much of the
+file is printed when it can't be parsed, with a syntax error in the
+middle. Prints the report as JSON. POSIX only, because of the peak RSS.
+
+    python bench_diagnostics_reader.py [--operations 500000] [--repeat 3]
+"""
+
+import argparse
+import hashlib
+import io
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import redirect_stdout
+
+import fakes
+
+
+def _write_diagnostics(path, operations):
+    with open(path, "w") as f:
+        f.write("[")
+        for i in range(operations):
+            if i:
+                f.write(",\n")
+            json.dump({
+                "command": ["install", "test", "uninstall"][i % 3],
+                "platform": "android",
+                "device": "emulator-5554",
+                "target": "x86_64",
+                "targetOS": "API 29",
+                "isDevice": False,
+                "exitCode": 78 if i % 3 == 0 else 0,
+                "duration": 1.5 + i % 7,
+            }, f)
+        f.write("]")
+
+
+def _read(mode, path):
+    # Runs in the child process
+    processor = fakes.load_processor()
+    digest = hashlib.sha256()
+    count = 0
+    start = time.perf_counter()
+    if mode == "load":
+        with open(path) as f:
+            operations = json.load(f)
+    else:
+        operations = processor.read_operations(path)
+    for operation in operations:
+        digest.update(json.dumps(operation, sort_keys=True).encode())
+        count += 1
+    wall = time.perf_counter() - start
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    scale = 1 if sys.platform == "darwin" else 1024
+    json.dump({
+        "wall_seconds": round(wall, 4),
+        "peak_rss_bytes": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale,
+        "operations": count,
+        "sha256": digest.hexdigest(),
+    }, sys.stdout)
+
+
+def _error_output_size(path):
+    processor = fakes.load_processor()
+    broken = path + ".broken"
+    size = os.path.getsize(path)
+    with open(path) as source, open(broken, "w") as f:
+        f.write(source.read(size // 2))
+        f.write("}")
+        shutil.copyfileobj(source, f)
+    output = io.StringIO()
+    with redirect_stdout(output):
+        try:
+            for _ in processor.read_operations(broken):
+                pass
+        except processor.DiagnosticsFileError as e:
+            processor.print_diagnostics_file_excerpt(broken, e.offset)
+    os.remove(broken)
+    return {"file_bytes": size, "printed_characters": len(output.getvalue())}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--operations", type=int, default=500000, help="XHarness commands in the diagnostics file")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per mode; the fastest one is reported")
+    parser.add_argument("--child", nargs=2, metavar=("MODE", "PATH"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        _read(*args.child)
+        return
+
+    work_dir = tempfile.mkdtemp(prefix="event-processor-bench-")
+    try:
+        diagnostics = os.path.join(work_dir, "diagnostics.json")
+        _write_diagnostics(diagnostics, args.operations)
+
+        report = {
+            "python": sys.version.split()[0],
+            "parameters": {"operations": args.operations, "file_bytes": os.path.getsize(diagnostics)},
+            "modes": {},
+        }
+        digests = {}
+        for mode in ("load", "streaming"):
+            runs = []
+            for _ in range(args.repeat):
+                output = subprocess.run([sys.executable, __file__, "--child", mode, diagnostics],
+                                        stdout=subprocess.PIPE, check=True).stdout
+                runs.append(json.loads(output))
+            best = min(runs, key=lambda run: run["wall_seconds"])
+            digests[mode] = best.pop("sha256")
+            report["modes"][mode] = best
+        report["parse_error"] = _error_output_size(diagnostics)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    report["peak_rss_ratio"] = round(report["modes"]["load"]["peak_rss_bytes"] /
+                                     report["modes"]["streaming"]["peak_rss_bytes"], 2)
+    json.dump(report, sys.stdout, indent=2)
+    sys.stdout.write("\n")
+    if digests["load"] != digests["streaming"]:
+        sys.exit("Streaming read different operations than json.load")
+
+
+if __name__ == "__main__":
+    main()
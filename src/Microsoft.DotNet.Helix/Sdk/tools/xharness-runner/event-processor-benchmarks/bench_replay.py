@@ -0,0 +1,141 @@
+# Licensed to the .NET Foundation under one or more agreements.
+# The .NET Foundation licenses this file to you under the MIT license.
+
+"""Replays generated diagnostics files through the event processor's rule table, offline.
+
+Loads xharness-event-processor.py as a module (which has no side effects
+and does not need helix-scripts) and runs analyze() on --files generated
+diagnostics.json files with a mix of platforms, devices and exit codes.
+Each file is replayed twice:
+
+    compiled - analyze(), which looks the rules up in the table compiled into a dict
+    linear   - the same rules tried one by one in table order, as a reference
+
+Records files and operations per second for both and how many decisions
+each rule made. Both must decide the same about every operation. Prints
+the report as JSON.
+
+    python bench_replay.py [--files 5000] [--operations 20] [--repeat 3]
+"""
+
+import argparse
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+import fakes
+
+PLATFORMS = ["android", "apple", "wasm"]
+EXIT_CODES = [0] * 12 + [1, 1, 78, 80, 81, 82, 83, 86, 88, 89, 90, 91, 92]
+TARGETS = ["x86_64", "arm64_v8a", "ios-simulator-64", "ios-simulator-64_13.5", "ios-device", "browser"]
+
+
+def _write_diagnostics(work_dir, files, operations):
+    rng = random.Random(0)
+    paths = []
+    for i in range(files):
+        diagnostics = [{
+            "command": rng.choice(["install", "test", "run", "uninstall"]),
+            "platform": rng.choice(PLATFORMS),
+            "target": rng.choice(TARGETS),
+            "isDevice": rng.choice([True, False]),
+            "exitCode": rng.choice(EXIT_CODES),
+            "duration": round(rng.uniform(0.5, 60), 2),
+        } for _ in range(operations)]
+        path = os.path.join(work_dir, "diagnostics-{}.json".format(i))
+        with open(path, "w") as f:
+            json.dump(diagnostics, f)
+        paths.append(path)
+    return paths
+
+
+def _analyze_linear(processor, operations):
+    # What the compiled table must be equivalent to: the first rule in table order that matches
+    applied = set()
+    decisions = []
+    for operation in operations:
+        exit_code = operation["exitCode"]
+        platform = operation["platform"]
+        is_device = bool(operation.get("isDevice"))
+        match = None
+        for rule in processor.RULES:
+            if rule.exit_code is None and exit_code == 0 or rule.exit_code is not None and rule.exit_code != exit_code:
+                continue
+            if rule.platform is not None and rule.platform != platform:
+                continue
+            if rule.is_device is not None and rule.is_device != is_device:
+                continue
+            if rule.once and id(rule) in applied or not rule.matches_target(operation.get("target")):
+                continue
+            match = rule
+            break
+        if match is not None and match.once:
+            applied.add(id(match))
+        decisions.append(processor.Decision(operation, processor.get_custom_dimensions(operation, None), match))
+    return decisions
+
+
+def _replay(paths, analyze):
+    start = time.perf_counter()
+    decisions = []
+    for path in paths:
+        with open(path) as f:
+            decisions.append(analyze(json.load(f)))
+    return time.perf_counter() - start, decisions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--files", type=int, default=5000, help="diagnostics files to replay")
+    parser.add_argument("--operations", type=int, default=20, help="XHarness commands per diagnostics file")
+    parser.add_argument("--repeat", type=int, default=3, help="replays per mode; the fastest one is reported")
+    args = parser.parse_args()
+
+    processor = fakes.load_processor()
+    modes = {
+        "compiled": processor.analyze,
+        "linear": lambda operations: _analyze_linear(processor, operations),
+    }
+
+    work_dir = tempfile.mkdtemp(prefix="event-processor-bench-")
+    try:
+        paths = _write_diagnostics(work_dir, args.files, args.operations)
+
+        report = {
+            "python": sys.version.split()[0],
+            "parameters": {"files": args.files, "operations_per_file": args.operations, "rules": len(processor.RULES)},
+            "modes": {},
+        }
+        decisions = {}
+        for mode, analyze in modes.items():
+            wall = None
+            for _ in range(args.repeat):
+                seconds, decisions[mode] = _replay(paths, analyze)
+                wall = seconds if wall is None else min(wall, seconds)
+            report["modes"][mode] = {
+                "wall_seconds": round(wall, 4),
+                "files_per_second": int(args.files / wall),
+                "operations_per_second": int(args.files * args.operations / wall),
+            }
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    counts = {}
+    for file_decisions in decisions["compiled"]:
+        for decision in file_decisions:
+            name = decision.rule.name if decision.rule is not None else "(none)"
+            counts[name] = counts.get(name, 0) + 1
+    report["decisions_per_rule"] = dict(sorted(counts.items()))
+    json.dump(report, sys.stdout, indent=2)
+    sys.stdout.write("\n")
+    rules = {mode: [[decision.rule for decision in file_decisions] for file_decisions in decisions[mode]] for mode in modes}
+    if rules["compiled"] != rules["linear"]:
+        sys.exit("The compiled rule table decided differently than trying the rules in order")
+
+
+if __name__ == "__main__":
+    main()
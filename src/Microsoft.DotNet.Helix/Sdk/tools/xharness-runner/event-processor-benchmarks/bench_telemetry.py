@@ -0,0 +1,139 @@
+# Licensed to the .NET Foundation under one or more agreements.
+# The .NET Foundation licenses this file to you under the MIT license.
+
+"""Measures how long xharness-event-processor.py blocks on sending telemetry.
+
+Runs the processor on a generated diagnostics.json against a local fake of
+helix.public, whose send_metric / send_metrics sleep for --latency seconds
+to stand in for a round-trip to the telemetry service, and record every
+call. A fake `dotnet` on PATH answers the XHarness version lookup. Each
+mode runs the processor in a fresh process:
+
+    synchronous - XHARNESS_TELEMETRY_WORKERS=0, every event sent as it is recorded
+    batched     - the default batch size, sent from the background thread
+
+Records wall time, the number of telemetry calls and how many of them
+blocked the processor's main thread. Both modes must send the same events.
+Prints the report as JSON. POSIX only, because of the fake `dotnet`.
+
+    python bench_telemetry.py [--operations 300] [--latency 0.02] [--repeat 3]
+"""
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import fakes
+
+FAKE_DOTNET = '''#!/bin/sh
+echo "1.0.0-prerelease.22269.1+6e87004b51c89c59ac4a34536e9bc22da0124f39"
+'''
+
+MODES = {
+    "synchronous": {"XHARNESS_TELEMETRY_WORKERS": "0"},
+    "batched": {},
+}
+
+
+def _write_fakes(work_dir):
+    fake_dir = fakes.write_fake_helix(work_dir)
+    bin_dir = os.path.join(work_dir, "bin")
+    os.makedirs(bin_dir)
+    fakes.write_script(os.path.join(bin_dir, "dotnet"), FAKE_DOTNET)
+    return fake_dir, bin_dir
+
+
+def _write_diagnostics(path, operations):
+    # Mostly successful commands, with the odd test failure and one app crash (which asks for a retry and reboot)
+    diagnostics = []
+    for i in range(operations):
+        exit_code = 0
+        if i % 10 == 9:
+            exit_code = 1
+        if i == operations // 2:
+            exit_code = 80
+        diagnostics.append({
+            "command": ["install", "test", "uninstall"][i % 3],
+            "platform": "android",
+            "target": "x86_64",
+            "targetOS": "API 29",
+            "isDevice": False,
+            "exitCode": exit_code,
+            "duration": 1.5 + i % 7,
+        })
+    with open(path, "w") as f:
+        json.dump(diagnostics, f)
+
+
+def _run(work_dir, fake_dir, bin_dir, diagnostics, mode, latency):
+    log = os.path.join(work_dir, "telemetry-" + mode + ".jsonl")
+    if os.path.exists(log):
+        os.remove(log)
+    env = dict(os.environ)
+    env.update(MODES[mode])
+    env.update({
+        "PYTHONPATH": fake_dir,
+        "PATH": bin_dir + os.pathsep + env.get("PATH", ""),
+        "FAKE_HELIX_LATENCY": str(latency),
+        "FAKE_HELIX_LOG": log,
+        "XHARNESS_CLI_PATH": os.path.join(work_dir, "Microsoft.DotNet.XHarness.CLI.dll"),
+        "HELIX_WORKITEM_ROOT": work_dir,
+        "HELIX_WORKITEM_UPLOAD_ROOT": work_dir,
+    })
+    start = time.perf_counter()
+    subprocess.run([sys.executable, fakes.PROCESSOR, "-d", diagnostics], cwd=work_dir, env=env,
+                   stdout=subprocess.DEVNULL, check=True)
+    wall = time.perf_counter() - start
+    calls = fakes.read_helix_calls(log)
+    telemetry = [call for call in calls if call["call"].startswith("send_")]
+    return {
+        "wall_seconds": round(wall, 4),
+        "telemetry_calls": len(telemetry),
+        "blocking_telemetry_calls": sum(1 for call in telemetry if call["main_thread"]),
+        "requests": sorted(call["call"] for call in calls if call["call"].startswith("request_")),
+    }, sorted(json.dumps([call["call"], call["args"], call["event_type"]], sort_keys=True) for call in telemetry)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--operations", type=int, default=300, help="XHarness commands in the diagnostics file")
+    parser.add_argument("--latency", type=float, default=0.02, help="seconds per telemetry round-trip")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per mode; the fastest one is reported")
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix="event-processor-bench-")
+    try:
+        fake_dir, bin_dir = _write_fakes(work_dir)
+        diagnostics = os.path.join(work_dir, "diagnostics.json")
+        _write_diagnostics(diagnostics, args.operations)
+
+        report = {
+            "python": sys.version.split()[0],
+            "parameters": {"operations": args.operations, "latency_seconds": args.latency},
+            "modes": {},
+        }
+        events = {}
+        for mode in MODES:
+            runs = []
+            for _ in range(args.repeat):
+                run, events[mode] = _run(work_dir, fake_dir, bin_dir, diagnostics, mode, args.latency)
+                runs.append(run)
+            report["modes"][mode] = min(runs, key=lambda run: run["wall_seconds"])
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    report["speedup"] = round(report["modes"]["synchronous"]["wall_seconds"] /
+                              report["modes"]["batched"]["wall_seconds"], 2)
+    json.dump(report, sys.stdout, indent=2)
+    sys.stdout.write("\n")
+    if events["synchronous"] != events["batched"]:
+        sys.exit("The batched processor sent different telemetry than the synchronous one")
+
+
+if __name__ == "__main__":
+    main()
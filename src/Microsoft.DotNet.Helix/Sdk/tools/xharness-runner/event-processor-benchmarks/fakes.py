@@ -0,0 +1,80 @@
+# Licensed to the .NET Foundation under one or more agreements.
+# The .NET Foundation licenses this file to you under the MIT license.
+
+"""Not a benchmark: local fakes the benchmarks run xharness-event-processor.py against."""
+
+import importlib.util
+import json
+import os
+
+PROCESSOR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "xharness-event-processor.py")
+
+# helix.public, recording every call to FAKE_HELIX_LOG. Telemetry calls take
+# FAKE_HELIX_LATENCY seconds, standing in for a round-trip to the service.
+FAKE_HELIX_PUBLIC = '''
+import importlib.util
+import json
+import os
+import threading
+import time
+
+_lock = threading.Lock()
+
+
+def _record(call, *args, event_type=None):
+    if call.startswith("send_"):
+        time.sleep(float(os.environ.get("FAKE_HELIX_LATENCY", "0")))
+    with _lock, open(os.environ["FAKE_HELIX_LOG"], "a") as f:
+        f.write(json.dumps({
+            "call": call,
+            "args": args,
+            "event_type": event_type,
+            "main_thread": threading.current_thread() is threading.main_thread(),
+        }) + "\\n")
+
+
+def send_metric(metric_name, metric_value, custom_dimensions=None, event_type=None):
+    _record("send_metric", metric_name, metric_value, custom_dimensions, event_type=event_type)
+
+
+def send_metrics(metrics, custom_dimensions=None, event_type=None):
+    _record("send_metrics", metrics, custom_dimensions, event_type=event_type)
+
+
+def request_infra_retry(reason):
+    _record("request_infra_retry", reason)
+
+
+def request_reboot(reason):
+    _record("request_reboot", reason)
+'''
+
+
+def write_script(path, text):
+    with open(path, "w") as f:
+        f.write(text)
+    os.chmod(path, 0o755)
+
+
+def write_fake_helix(work_dir):
+    """Writes the fake helix package and returns the directory to put on PYTHONPATH."""
+    fake_dir = os.path.join(work_dir, "fake")
+    package = os.path.join(fake_dir, "helix")
+    os.makedirs(package)
+    open(os.path.join(package, "__init__.py"), "w").close()
+    with open(os.path.join(package, "public.py"), "w") as f:
+        f.write(FAKE_HELIX_PUBLIC)
+    return fake_dir
+
+
+def read_helix_calls(log):
+    with open(log) as f:
+        return [json.loads(line) for line in f]
+
+
+def load_processor():
+    """Loads the processor as a module; that has no side effects and does not need helix.public."""
+    spec = importlib.util.spec_from_file_location("xharness_event_processor", PROCESSOR)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
@@ -1,15 +1,22 @@
 import getopt
+import glob
 import json
 import os
+import re
 import subprocess
 import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from typing import Tuple
 
-from helix.public import request_reboot, request_infra_retry, send_metric, send_metrics
-
 ### This script's purpose is to parse the diagnostics.json file produced by XHarness, evaluate it and send it to AppInsights
 ### The diagnostics.json file contains information about each XHarness command executed during the job
 ### In case of events that suggest infrastructure issues, we request a retry and for some reboot the agent
+### Which events those are is decided by the RULES table below. analyze() applies it without side effects,
+### so that the script can also be loaded as a module (importlib.util.spec_from_file_location) to replay
+### diagnostics files offline; running it as a script carries out the decisions on a Helix machine
 
 # Name of metrics we send (to Kusto)
 EVENT_TYPE = 'MobileDeviceOperation'
@@ -19,57 +26,112 @@ RETRY_METRIC_NAME = 'Retry'
 REBOOT_METRIC_NAME = 'Reboot'
 NETWORK_CONNECTIVITY_METRIC_NAME = 'NoInternet'
 
-opts, args = getopt.gnu_getopt(sys.argv[1:], 'd:', ['diagnostics-data='])
-opt_dict = dict(opts)
-
-diagnostics_file = None
-
-if '--data' in opt_dict:
-    diagnostics_file = opt_dict['--data']
-elif '-d' in opt_dict:
-    diagnostics_file = opt_dict['-d']
-else:
-    diagnostics_file = os.getenv('XHARNESS_DIAGNOSTICS_PATH')
-
-if not diagnostics_file:
-    print('ERROR: Expected path to the diagnostics JSON file generated by XHarness')
-    exit(1)
+def get_env_int(name: str, default: int) -> int:
+    """ Reads a non-negative integer from the environment, falling back to default when it is unset or not one
+    """
 
-if not os.path.isfile(diagnostics_file):
-    print(f"WARNING: Diagnostics file not found at `{diagnostics_file}`")
-    exit(2)
+    value = os.getenv(name)
+    if not value:
+        return default
+    try:
+        parsed = int(value)
+    except ValueError:
+        parsed = -1
+    if parsed < 0:
+        print(f'    Ignoring {name}={value!r}, expected a non-negative integer; using {default}')
+        return default
+    return parsed
+
+# Telemetry is sent in batches of this many events, each batch by one of a pool of this many
+# background threads (0 sends every event synchronously, as soon as it is recorded). The sends
+# themselves are made one at a time whatever the number of threads, see BatchedTelemetry
+TELEMETRY_BATCH_SIZE = get_env_int('XHARNESS_TELEMETRY_BATCH_SIZE', 25)
+TELEMETRY_WORKERS = get_env_int('XHARNESS_TELEMETRY_WORKERS', 1)
+
+class BatchedTelemetry:
+    """Collects metric events and sends them to Helix in batches, in the background
+
+    Every send_metric/send_metrics call is a blocking round-trip to the telemetry service and there is one
+    per XHarness command in the diagnostics file. Events are queued instead and once max_batch_size of them
+    are pending, the batch is handed over to a pool of background threads that send it while the analysis
+    carries on. close() sends the rest and waits until everything is sent. When sending falls behind, the
+    analysis waits once there are two batches per thread in flight, so that they don't pile up in memory.
+
+    The send functions are passed in (helix.public's send_metric and send_metrics) so that they can be faked.
+    Nothing says they are safe to call from several threads at once, so calls to them are serialized: a single
+    background thread (the default) sends every batch, and with more threads they take turns.
+    With workers=0, events are sent synchronously as soon as they are recorded.
+    """
 
-output_directory = os.getenv('HELIX_WORKITEM_UPLOAD_ROOT')
+    def __init__(self, send_metric, send_metrics, max_batch_size: int = 25, workers: int = 1):
+        self._send_metric = send_metric
+        self._send_metrics = send_metrics
+        self._max_batch_size = max(1, max_batch_size)
+        self._executor = ThreadPoolExecutor(max_workers=workers) if workers > 0 else None
+        self._batches = threading.BoundedSemaphore(2 * workers) if workers > 0 else None
+        self._pending = []
+        self._lock = threading.Lock()
+        self._send_lock = threading.Lock()
+        self.events = 0
+        self.failures = 0
+
+    def send_metric(self, metric_name, metric_value, custom_dimensions, event_type):
+        self._record((self._send_metric, metric_name, metric_value, custom_dimensions, event_type))
+
+    def send_metrics(self, metrics, custom_dimensions, event_type):
+        self._record((self._send_metrics, metrics, custom_dimensions, event_type))
+
+    def _record(self, event):
+        self.events += 1
+        if self._executor is None:
+            self._send([event])
+            return
 
-# For the first operation that causes a retry/reboot, we send a metric to Helix
-# Retry/reboot can be also asked for by the client (by creating .retry/.reboot files)
-retry = False
-reboot = False
-retry_dimensions = dict()
-reboot_dimensions = dict()
-retry_exit_code = -1
-reboot_exit_code = -1
-android_connectivity_verified = False
+        self._pending.append(event)
+        if len(self._pending) >= self._max_batch_size:
+            self.flush()
+
+    def _send(self, batch):
+        for send, *args, event_type in batch:
+            try:
+                with self._send_lock:
+                    send(*args, event_type=event_type)
+            except Exception as e:
+                with self._lock:
+                    self.failures += 1
+                print(f'    Failed to send telemetry: {e}')
+
+    def flush(self):
+        """Hands the pending events over to the background threads, or sends them when there are none"""
+        if not self._pending:
+            return
+        batch, self._pending = self._pending, []
+        if self._executor is None:
+            self._send(batch)
+            return
 
-class AdditionalTelemetryRequired(Exception):
-    """Exception raised when we need to send additional telemetry during analysis
+        self._batches.acquire()
+        future = self._executor.submit(self._send, batch)
+        future.add_done_callback(lambda _: self._batches.release())
 
-    Attributes:
-        metric_name -- name of the event
-        metric_value -- value of the metric event
-    """
+    def close(self):
+        """Sends all remaining events and waits for every batch to be sent"""
+        if self._executor is None:
+            return
 
-    def __init__(self, metric_name, metric_value):
-        self.metric_name = metric_name
-        self.metric_value = metric_value
-        super().__init__("Additional telemetry required")
+        self.flush()
+        self._executor.shutdown(wait=True)
 
 def call_xharness(args: list, capture_output: bool = False) -> Tuple[int, str]:
     """ Calls the XHarness CLI with given arguments
     """
 
     xharness_cli_path = os.getenv('XHARNESS_CLI_PATH')
-    args = ['dotnet', 'exec', xharness_cli_path] + args
+    if xharness_cli_path.lower().endswith('.dll'):
+        args = ['dotnet', 'exec', xharness_cli_path] + args
+    else:
+        # An executable, such as the CLI's apphost or a stub standing in for it
+        args = [xharness_cli_path] + args
 
     if capture_output:
         process = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
@@ -78,18 +140,181 @@ def call_xharness(args: list, capture_output: bool = False) -> Tuple[int, str]:
     else:
         return subprocess.run(args, stdout=None, stderr=None, text=True).returncode, None
 
+# Resolved XHarness versions, keyed by the CLI's path, mtime and size, shared by the work items on the machine
+VERSION_CACHE_FILE = os.path.join(tempfile.gettempdir(), 'xharness-version-cache.json')
+VERSION_CACHE_MAX_ENTRIES = 32
+
+# The AssemblyInformationalVersion attribute as stored in the assembly: the custom attribute prolog (0x0001),
+# the version's length and UTF-8 text, and no named arguments (0x0000)
+INFORMATIONAL_VERSION_PATTERN = re.compile(
+    rb'\x01\x00([\x05-\x7f])(\d+\.\d+\.\d+(?:-[0-9A-Za-z.\-]+)?(?:\+[0-9A-Za-z.\-]+)?)\x00\x00')
+
+def get_version_from_assembly(cli_path: str) -> str:
+    """ Reads the AssemblyInformationalVersion of the XHarness CLI assembly, which is what `xharness version` prints
+    """
+
+    with open(cli_path, 'rb') as f:
+        data = f.read()
+
+    versions = set(match.group(2).decode('ascii') for match in INFORMATIONAL_VERSION_PATTERN.finditer(data)
+                   if ord(match.group(1)) == len(match.group(2)))
+
+    # Anything else is not the attribute we are after
+    return versions.pop() if len(versions) == 1 else None
+
+def get_version_from_package(cli_path: str) -> str:
+    """ Reads the version from the files of the NuGet package the CLI was installed from
+        The CLI lives in <package id>/<version>/tools/<tfm>/any
+    """
+
+    cli_dir = os.path.dirname(os.path.abspath(cli_path))
+    package_dir = os.path.normpath(os.path.join(cli_dir, '..', '..', '..'))
+
+    for nuspec in glob.glob(os.path.join(package_dir, '*.nuspec')):
+        with open(nuspec, encoding='utf-8') as f:
+            match = re.search(r'<version>\s*([^<\s]+)\s*</version>', f.read())
+            if match:
+                return match.group(1)
+
+    # The .deps.json lists the CLI's own project with its version
+    assembly_name = os.path.splitext(os.path.basename(cli_path))[0]
+    deps_file = os.path.join(cli_dir, assembly_name + '.deps.json')
+    if os.path.isfile(deps_file):
+        with open(deps_file, encoding='utf-8') as f:
+            libraries = json.load(f).get('libraries', {})
+        for library, details in libraries.items():
+            name, _, version = library.partition('/')
+            if name.lower() == assembly_name.lower() and details.get('type') == 'project':
+                return version
+
+    return None
+
+def get_xharness_version() -> str:
+    """ Returns the XHarness version, without the commit SHA (e.g. 1.0.0-prerelease.22269.1)
+        Starting the CLI just to print its version costs a .NET runtime startup, so the version is read from
+        the files of the CLI instead and cached on disk. The CLI is only called when neither works.
+    """
+
+    cli_path = os.getenv('XHARNESS_CLI_PATH')
+
+    cache_key = None
+    cache = dict()
+    try:
+        stat = os.stat(cli_path)
+        cache_key = f'{os.path.realpath(cli_path)}|{stat.st_mtime_ns}|{stat.st_size}'
+    except (OSError, TypeError):
+        pass
+
+    if cache_key:
+        try:
+            with open(VERSION_CACHE_FILE, encoding='utf-8') as f:
+                cache = json.load(f)
+            if cache_key in cache:
+                return cache[cache_key]
+        except (OSError, ValueError):
+            cache = dict()
+
+    version = None
+    if cache_key:
+        for get_version in (get_version_from_assembly, get_version_from_package):
+            try:
+                version = get_version(cli_path)
+            except Exception as e:
+                print(f'    Failed to read the XHarness version from files: {e}')
+            if version:
+                break
+
+    if not version:
+        # Example version: 1.0.0-prerelease.22269.1+6e87004b51c89c59ac4a34536e9bc22da0124f39
+        exit_code, output = call_xharness(['version'], capture_output=True)
+        if exit_code != 0:
+            # Not cached so that the next work item tries again
+            return output.strip().split("+")[0]
+        version = output
+
+    # We remove the commit SHA
+    version = version.strip().split("+")[0]
+
+    if cache_key:
+        # Drop the oldest entries; dicts keep their insertion order
+        cache.pop(cache_key, None)
+        cache[cache_key] = version
+        cache = dict(list(cache.items())[-VERSION_CACHE_MAX_ENTRIES:])
+        temp_path = None
+        try:
+            fd, temp_path = tempfile.mkstemp(prefix='xharness-version-cache.', dir=os.path.dirname(VERSION_CACHE_FILE))
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(cache, f)
+            os.replace(temp_path, VERSION_CACHE_FILE)
+        except OSError as e:
+            print(f'    Failed to cache the XHarness version: {e}')
+            if temp_path and os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    return version
+
 def call_adb(args: list, capture_output: bool = False):
     """ Calls the XHarness CLI with `android adb` command and given arguments
     """
 
     return call_xharness(['android', 'adb', '--'] + args, capture_output)
 
+# Apps are removed with `pm uninstall` from a single adb shell session per this many apps
+UNINSTALL_BATCH_SIZE = 50
+
+# Apps that could not be removed that way are removed with `adb uninstall`, by a pool of this many workers
+UNINSTALL_WORKERS = int(os.getenv('XHARNESS_UNINSTALL_WORKERS', '4'))
+
+# Only these are passed to the device's shell
+PACKAGE_NAME_PATTERN = re.compile(r'^[A-Za-z0-9_.]+$')
+
+def uninstall_android_apps_in_shell(apps: list, device: str = None) -> list:
+    """ Removes the given apps with `pm uninstall` in a single adb shell session
+        Returns the apps that were not removed
+    """
+
+    script = 'for p in ' + ' '.join(apps) + '; do echo "$p $(pm uninstall $p 2>&1)"; done'
+    args = ['shell', script]
+    if device:
+        args = ['-s', device] + args
+
+    exit_code, output = call_adb(args, capture_output=True)
+    if exit_code != 0:
+        print(f'        Failed to remove apps in an adb shell: {output}')
+        return apps
+
+    removed = set()
+    for line in output.splitlines():
+        app, _, result = line.strip().partition(' ')
+        if result.strip() == 'Success':
+            removed.add(app)
+
+    return [app for app in apps if app not in removed]
+
+def uninstall_android_app(app: str, device: str = None) -> int:
+    """ Removes a single app with `adb uninstall`
+    """
+
+    args = ['uninstall', app]
+    if device:
+        args = ['-s', device] + args
+
+    exit_code, output = call_adb(args, capture_output=True)
+    if exit_code != 0:
+        print(f'            Failed to remove app {app}: {output.strip()}')
+
+    return exit_code
+
 def remove_android_apps(device: str = None):
     """ Removes all Android applications from the target device/emulator
+        Every XHarness call starts the .NET runtime, so the apps are removed in bulk from one adb shell session
+        and only the ones that could not be removed that way are removed one by one, in parallel
     """
 
     print('    Removing installed apps after unsuccessful run' + (' from ' + device if device else ""))
 
+    start = time.monotonic()
+
     # Get list of installed apps
     args = ['shell', 'pm', 'list', 'packages', 'net.dot']
     if device:
@@ -101,288 +326,626 @@ def remove_android_apps(device: str = None):
         return
 
     installed_apps = output.splitlines()
-    installed_apps = [app.split(':')[1] for app in installed_apps if app and app.startswith('package:')]
+    installed_apps = [app.split(':')[1].strip() for app in installed_apps if app and app.startswith('package:')]
 
-    # Remove all installed apps
-    for app in installed_apps:
-        print(f'        Removing {app}')
-
-        args = ['uninstall', app]
-        if device:
-            args = ['-s', device] + args
+    listed = time.monotonic()
 
-        exit_code, _ = call_adb(args)
-
-        if exit_code != 0:
-            print(f'            Failed to remove app {app}')
-
-def analyze_operation(command: str, platform: str, device: str, is_device: bool, target: str, exit_code: int):
-    """ Analyzes the result and requests retry/reboot in case of an infra failure
-        Too see where the exit code values come from, see https://github.com/dotnet/xharness/blob/master/src/Microsoft.DotNet.XHarness.Common/CLI/ExitCode.cs
+    # Remove all installed apps
+    remaining = [app for app in installed_apps if not PACKAGE_NAME_PATTERN.match(app)]
+    apps = [app for app in installed_apps if PACKAGE_NAME_PATTERN.match(app)]
+    for i in range(0, len(apps), UNINSTALL_BATCH_SIZE):
+        batch = apps[i:i + UNINSTALL_BATCH_SIZE]
+        print(f'        Removing {", ".join(batch)}')
+        remaining += uninstall_android_apps_in_shell(batch, device)
+
+    removed_in_shell = time.monotonic()
+
+    failed = []
+    if remaining:
+        print(f'        Removing {len(remaining)} apps one by one')
+        with ThreadPoolExecutor(max_workers=max(1, UNINSTALL_WORKERS)) as executor:
+            exit_codes = list(executor.map(lambda app: uninstall_android_app(app, device), remaining))
+        failed = [app for app, exit_code in zip(remaining, exit_codes) if exit_code != 0]
+
+    end = time.monotonic()
+
+    print(f'    Removed {len(installed_apps) - len(failed)} of {len(installed_apps)} apps in {end - start:.2f}s '
+          f'(listing {listed - start:.2f}s, adb shell {removed_in_shell - listed:.2f}s, '
+          f'one by one {end - removed_in_shell:.2f}s)')
+
+# Rule actions with side effects, carried out by the command line after the analysis
+COLLECT_EMULATOR_BOOT_LOGS = 'collect_emulator_boot_logs'
+COPY_EMULATOR_LOGCAT = 'copy_emulator_logcat'
+REMOVE_ANDROID_APPS = 'remove_android_apps'
+CHECK_NETWORK_CONNECTIVITY = 'check_network_connectivity'
+
+class Rule:
+    """ One row of the rule table: what to do about an operation that exited with the given exit code
+
+        platform, is_device and exit_code left as None match any platform, both devices and emulators/simulators
+        and any non-zero exit code; target_pattern, when given, has to match the whole target. A rule with
+        once=True only applies to the first operation it matches.
     """
 
-    print(f'Analyzing {platform}/{command}@{target} ({exit_code})')
-
-    global retry, reboot, android_connectivity_verified
-
+    def __init__(self, name: str, exit_code: int = None, platform: str = None, is_device: bool = None,
+                 target_pattern: str = None, messages: list = (), retry: bool = False, reboot: bool = False,
+                 actions: list = (), once: bool = False):
+        self.name = name
+        self.exit_code = exit_code
+        self.platform = platform
+        self.is_device = is_device
+        self.target_pattern = re.compile(target_pattern) if target_pattern else None
+        self.messages = list(messages)
+        self.retry = retry
+        self.reboot = reboot
+        self.actions = list(actions)
+        self.once = once
+
+    def matches_target(self, target: str) -> bool:
+        return self.target_pattern is None or (target is not None and self.target_pattern.fullmatch(target) is not None)
+
+# Platforms with rules of their own; others only match rules for any platform
+PLATFORMS = ('android', 'apple')
+
+# Rules are tried in this order and the first one that matches an operation decides what happens to it.
+# Rules for a specific exit code take precedence over rules for any non-zero exit code.
+# To see where the exit code values come from, see https://github.com/dotnet/xharness/blob/master/src/Microsoft.DotNet.XHarness.Common/CLI/ExitCode.cs
+RULES = [
     # Apps crashing can be infra failures, retry except on Apple devices where retries can be costly due to small queue size
-    if exit_code == 80 and not (platform == "apple" and is_device): # APP_CRASH
-        print(f'    Application crashed - if persist, please investigate system logs from the run')
-        retry = True
-        reboot = True
-        return
+    Rule('APP_CRASH', 80, platform='apple', is_device=True),
+    Rule('APP_CRASH', 80, retry=True, reboot=True,
+         messages=['Application crashed - if persist, please investigate system logs from the run']),
 
     # Simulators are known to slow down which results in installation taking several minutes
     # Retry+reboot usually resolves this
-    if exit_code == 86: # APP_INSTALLATION_TIMEOUT
-        print(f'    Installation timed out')
-        reboot = True
-        retry = True
-        return
+    Rule('APP_INSTALLATION_TIMEOUT', 86, retry=True, reboot=True, messages=['Installation timed out']),
 
     # Simulators are known to slow/break down and a reboot usually helps
     # This manifest by us not being able to launch the simulator
-    if exit_code == 88: # SIMULATOR_FAILURE
-        print(f'    Failed to launch the emulator')
-        reboot = True
-        retry = True
-        return
+    Rule('SIMULATOR_FAILURE', 88, retry=True, reboot=True, messages=['Failed to launch the emulator']),
 
     # Devices can be locked or in a corrupted state, in this case we only retry the work item
-    if exit_code == 89: # DEVICE_FAILURE
-        print(f'    Failed to talk to the device')
-        retry = True
-        return
+    Rule('DEVICE_FAILURE', 89, retry=True, messages=['Failed to talk to the device']),
+
+    Rule('APP_LAUNCH_TIMEOUT', 90, is_device=True, retry=True, messages=['Failed to launch the app in alloted time']),
+    Rule('APP_LAUNCH_TIMEOUT', 90, is_device=False, retry=True, reboot=True,
+         messages=['Failed to launch the app in alloted time']),
+
+    Rule('TCP_CONNECTION_FAILED', 92, retry=True, reboot=True, messages=['Failed to communicate using TCP connection']),
+
+    # This handles issues where emulators fail to start or devices go silent.
+    # For emulators it makes sense to reboot to try to heal the emulator and we also attach logs from the
+    # emulator boot (which might tell us why there's no emulator)
+    Rule('DEVICE_NOT_FOUND', 81, platform='android', is_device=True, retry=True,
+         messages=['Encountered DEVICE_NOT_FOUND',
+                   'If this occurs repeatedly, please check for architectural mismatch, e.g. sending arm64_v8a APKs to an x86_64 / x86 only queue']),
+    Rule('DEVICE_NOT_FOUND', 81, platform='android', is_device=False, retry=True, reboot=True,
+         actions=[COLLECT_EMULATOR_BOOT_LOGS],
+         messages=['Encountered DEVICE_NOT_FOUND',
+                   'If this occurs repeatedly, please check for architectural mismatch, e.g. sending arm64_v8a APKs to an x86_64 / x86 only queue']),
+
+    # This happens when emulator crashes halfway through
+    Rule('RETURN_CODE_NOT_SET', 82, platform='android', is_device=False, retry=True, reboot=True,
+         messages=['Failed to read the instrumentation result']),
+
+    # This handles issues where APKs fail to install.
+    # We already reboot a device inside XHarness and now request a work item retry when this happens
+    Rule('PACKAGE_INSTALLATION_FAILURE', 78, platform='android', is_device=True, retry=True,
+         actions=[REMOVE_ANDROID_APPS],
+         messages=['Encountered PACKAGE_INSTALLATION_FAILURE',
+                   'If this occurs repeatedly, please check for architectural mismatch, e.g. requesting installation on arm64_v8a-only queue for x86 or x86_64 APKs']),
+    Rule('PACKAGE_INSTALLATION_FAILURE', 78, platform='android', is_device=False, retry=True,
+         messages=['Encountered PACKAGE_INSTALLATION_FAILURE',
+                   'If this occurs repeatedly, please check for architectural mismatch, e.g. requesting installation on arm64_v8a-only queue for x86 or x86_64 APKs']),
+
+    # This handles issues where we have problems with ADB
+    # The only solution is to reboot the machine, so we request a work item retry + agent reboot when this happens
+    Rule('ADB_FAILURE', 91, platform='android', is_device=True, retry=True, reboot=True,
+         messages=['Encountered ADB_FAILURE',
+                   'If this occurs repeatedly, please check for architectural mismatch, e.g. sending arm64_v8a APKs to an x86_64 / x86 only queue']),
+    Rule('ADB_FAILURE', 91, platform='android', is_device=False, retry=True, reboot=True,
+         actions=[COPY_EMULATOR_LOGCAT],
+         messages=['Encountered ADB_FAILURE',
+                   'If this occurs repeatedly, please check for architectural mismatch, e.g. sending arm64_v8a APKs to an x86_64 / x86 only queue']),
+
+    # Any issue can also be caused by network connectivity problems (devices sometimes lose the WiFi connection)
+    # In those cases, we want a retry and we want to report this
+    Rule('NETWORK_CONNECTIVITY', platform='android', is_device=True, once=True, actions=[CHECK_NETWORK_CONNECTIVITY],
+         messages=['Encountered non-zero exit code. Checking network connectivity...']),
+
+    # This code should only be retried for Apple as in Android this can mean failed tests or app crash
+    # See https://github.com/dotnet/xharness/issues/812
+    Rule('RETURN_CODE_NOT_SET', 82, platform='apple', retry=True, messages=['Failed to detect app\'s exit code']),
+
+    # If we have a launch failure on simulators, we want a reboot+retry
+    # We want retry only on devices (it happens quite rarely)
+    Rule('APP_LAUNCH_FAILURE', 83, platform='apple', is_device=True, retry=True,
+         messages=['Encountered APP_LAUNCH_FAILURE']),
+    Rule('APP_LAUNCH_FAILURE', 83, platform='apple', is_device=False, retry=True, reboot=True,
+         messages=['Encountered APP_LAUNCH_FAILURE']),
+
+    # If we fail to find a real device, it is unexpected as device queues should have one
+    Rule('DEVICE_NOT_FOUND', 81, platform='apple', is_device=True, retry=True, reboot=True,
+         messages=['Requested tethered Apple device not found']),
+
+    Rule('PACKAGE_INSTALLATION_FAILURE', 78, platform='apple', is_device=True, retry=True, reboot=True,
+         messages=['Encountered PACKAGE_INSTALLATION_FAILURE. This might be a transient issue with the device']),
+    Rule('PACKAGE_INSTALLATION_FAILURE', 78, platform='apple', is_device=False, retry=True, reboot=True,
+         messages=['Encountered PACKAGE_INSTALLATION_FAILURE. This might be caused by a corrupt simulator']),
+
+    # If we fail to find a simulator and we are not targeting a specific version (e.g. `ios-simulator_13.5`),
+    # it is probably an issue because Xcode should always have at least one runtime version inside
+    Rule('DEVICE_NOT_FOUND', 81, platform='apple', is_device=False, target_pattern=r'[^_]*', retry=True, reboot=True,
+         messages=['No simulator runtime found']),
+]
+
+def compile_rules(rules: list) -> dict:
+    """ Compiles the rule table into a dict of (platform, is_device, exit_code) -> rules to try, in table order
+        Rules for any platform or both kinds of devices are listed under every key they match and rules for any
+        non-zero exit code after those for specific ones. Platforms without rules of their own are listed under
+        the platform None, and the exit codes without rules of their own under the exit code None.
+    """
 
-    if exit_code == 90: # APP_LAUNCH_TIMEOUT
-        print(f'    Failed to launch the app in alloted time')
-        if not is_device:
-            reboot = True
-        retry = True
-        return
+    compiled = dict()
+    for rule in rules:
+        platforms = [rule.platform] if rule.platform else list(PLATFORMS) + [None]
+        devices = [rule.is_device] if rule.is_device is not None else [True, False]
+        for platform in platforms:
+            for is_device in devices:
+                compiled.setdefault((platform, is_device, rule.exit_code), []).append(rule)
 
-    if exit_code == 92: # TCP_CONNECTION_FAILED
-        print(f'    Failed to communicate using TCP connection')
-        retry = True
-        reboot = True
-        return
+    for (platform, is_device, exit_code), matching in compiled.items():
+        if exit_code is not None and exit_code != 0:
+            matching.extend(compiled.get((platform, is_device, None), []))
 
-    if platform == "android":
-        if exit_code == 81: # DEVICE_NOT_FOUND
-            # This handles issues where emulators fail to start or devices go silent.
-            print(f'    Encountered DEVICE_NOT_FOUND')
-            print('    If this occurs repeatedly, please check for architectural mismatch, e.g. sending arm64_v8a APKs to an x86_64 / x86 only queue')
-            retry = True
+    return compiled
 
-            if not is_device:
-                # For emulators it makes sense to reboot to try to heal the emulator
-                reboot = True
+COMPILED_RULES = compile_rules(RULES)
 
-                # We also attach logs from the emulator boot (which might tell us why there's no emulator)
-                if os.name != 'nt':
-                    # This is where Azure stores logs from custom extension script runs
-                    # More details here https://docs.microsoft.com/en-us/azure/virtual-machines/extensions/custom-script-linux#troubleshooting
-                    boot_log_location = '/var/lib/waagent/custom-script/download'
+def get_custom_dimensions(operation: dict, version: str) -> dict:
+    """ Returns the dimensions the operation's telemetry is sent with
+    """
 
-                    print(f'    Collecting emulator boot logs from {boot_log_location}..')
-                    boot_log_destination = output_directory + '/emulator_logs'
+    custom_dimensions = dict()
+    custom_dimensions['command'] = operation['command']
+    custom_dimensions['platform'] = operation['platform']
+    custom_dimensions['version'] = version
 
-                    # Only copy stdout/stderr files (however they might be in different folders based on how Azure executed extension scripts)
-                    subprocess.call(['sudo', 'rsync', '--recursive', '--include', 'stdout', '--include', 'stderr', '--filter', '-! */',
-                        boot_log_location, boot_log_destination])
+    is_device = operation.get('isDevice', None)
+    if is_device is not None:
+        custom_dimensions['isDevice'] = 'true' if str(is_device).lower() == 'true' else 'false'
 
-                    # The boot logs are owned by root, so make them readable for the Helix agent
-                    subprocess.call(['sudo', 'chmod', '-R', '777', boot_log_destination])
+    if 'target' in operation:
+        if 'targetOS' in operation:
+            custom_dimensions['target'] = operation['target'] + ':' + operation['targetOS']
+        else:
+            custom_dimensions['target'] = operation['target']
+    elif 'targetOS' in operation:
+        custom_dimensions['target'] = operation['targetOS']
 
-            return
+    return custom_dimensions
 
-        if exit_code == 82 and not is_device: # RETURN_CODE_NOT_SET - this happens when emulator crashes halfway through
-            print(f'    Failed to read the instrumentation result')
-            retry = True
-            reboot = True
-            return
+class Decision:
+    """ What the analysis decided about one operation from the diagnostics file
+    """
 
-        if exit_code == 78: # PACKAGE_INSTALLATION_FAILURE
-            # This handles issues where APKs fail to install.
-            # We already reboot a device inside XHarness and now request a work item retry when this happens
-            print(f'    Encountered PACKAGE_INSTALLATION_FAILURE')
-            print('    If this occurs repeatedly, please check for architectural mismatch, e.g. requesting installation on arm64_v8a-only queue for x86 or x86_64 APKs')
-            retry = True
+    def __init__(self, operation: dict, dimensions: dict, rule: Rule = None):
+        self.operation = operation
+        self.dimensions = dimensions
+        self.rule = rule
+        self.retry = rule.retry if rule else False
+        self.reboot = rule.reboot if rule else False
+        self.actions = rule.actions if rule else []
+        self.messages = rule.messages if rule else []
+
+    @property
+    def exit_code(self) -> int:
+        return self.operation['exitCode']
+
+    def describe(self) -> str:
+        operation = self.operation
+        return f'{operation["platform"]}/{operation["command"]}@{operation.get("target")} ({self.exit_code})'
+
+class Analyzer:
+    """ Decides, operation by operation, which infrastructure issues the operations in a diagnostics file point to
+
+        Has no side effects: the decisions say which retry/reboot to request and which actions to carry out, and
+        it is up to the caller to do so. Keeps track of the first operations that asked for a retry and a reboot,
+        as that is what we report them with.
+    """
 
-            if is_device:
-                try:
-                    remove_android_apps(device)
-                except Exception as e:
-                    print(f'    Failed to remove installed apps from device: {e}')
+    def __init__(self, rules: list = None, version: str = None):
+        self._rules = COMPILED_RULES if rules is None else compile_rules(rules)
+        self._applied = set()
+        self.version = version
+        self.retry = False
+        self.reboot = False
+        self.retry_decision = None
+        self.reboot_decision = None
+
+    def find_rule(self, platform: str, is_device: bool, exit_code: int, target: str) -> Rule:
+        if platform not in PLATFORMS:
+            platform = None
+
+        candidates = self._rules.get((platform, bool(is_device), exit_code))
+        if candidates is None:
+            if exit_code == 0:
+                return None
+            candidates = self._rules.get((platform, bool(is_device), None), [])
+
+        for rule in candidates:
+            if rule.once and id(rule) in self._applied:
+                continue
+            if rule.matches_target(target):
+                return rule
+
+        return None
+
+    def analyze_operation(self, operation: dict) -> Decision:
+        rule = self.find_rule(operation['platform'], operation.get('isDevice', None), operation['exitCode'],
+                              operation.get('target'))
+        if rule and rule.once:
+            self._applied.add(id(rule))
+
+        decision = Decision(operation, get_custom_dimensions(operation, self.version), rule)
+        if decision.retry:
+            self.request_retry(decision)
+        if decision.reboot:
+            self.request_reboot(decision)
+
+        return decision
+
+    def request_retry(self, decision: Decision):
+        """ Notes down that the decision calls for a retry, e.g. after one of its actions found an issue
+        """
+
+        decision.retry = True
+        self.retry = True
+        if self.retry_decision is None:
+            self.retry_decision = decision
+
+    def request_reboot(self, decision: Decision):
+        decision.reboot = True
+        self.reboot = True
+        if self.reboot_decision is None:
+            self.reboot_decision = decision
+
+def analyze(operations, rules: list = None, version: str = None) -> list:
+    """ Returns the decisions for the operations of a diagnostics file, without acting on them
+
+        The actions the decisions list (e.g. checking network connectivity) are not carried out, so their
+        outcome can't add to the decisions. This makes it possible to replay diagnostics files offline,
+        for example to try out changes to the rules.
+    """
 
-            return
+    analyzer = Analyzer(rules, version)
+    return [analyzer.analyze_operation(operation) for operation in operations]
 
-        if exit_code == 91: # ADB_FAILURE
-            # This handles issues where we have problems with ADB
-            # The only solution is to reboot the machine, so we request a work item retry + agent reboot when this happens
-            print(f'    Encountered ADB_FAILURE')
-            print('    If this occurs repeatedly, please check for architectural mismatch, e.g. sending arm64_v8a APKs to an x86_64 / x86 only queue')
+def collect_emulator_boot_logs(output_directory: str):
+    if os.name == 'nt':
+        return
 
-            if not is_device and os.name != 'nt':
-                # Copy emulator log
-                subprocess.call(['cp', '/tmp/*-logcat.log', output_directory])
+    # This is where Azure stores logs from custom extension script runs
+    # More details here https://docs.microsoft.com/en-us/azure/virtual-machines/extensions/custom-script-linux#troubleshooting
+    boot_log_location = '/var/lib/waagent/custom-script/download'
 
-            reboot = True
-            retry = True
-            return
+    print(f'    Collecting emulator boot logs from {boot_log_location}..')
+    boot_log_destination = output_directory + '/emulator_logs'
 
-        if exit_code != 0 and is_device and not android_connectivity_verified:
-            # Any issue can also be caused by network connectivity problems (devices sometimes lose the WiFi connection)
-            # In those cases, we want a retry and we want to report this
-            print('    Encountered non-zero exit code. Checking network connectivity...')
-            android_connectivity_verified = True
+    # Only copy stdout/stderr files (however they might be in different folders based on how Azure executed extension scripts)
+    subprocess.call(['sudo', 'rsync', '--recursive', '--include', 'stdout', '--include', 'stderr', '--filter', '-! */',
+        boot_log_location, boot_log_destination])
 
-            exitcode, _ = call_adb(['shell', 'ping', '-i', '0.2', '-c', '3', 'www.microsoft.com'])
+    # The boot logs are owned by root, so make them readable for the Helix agent
+    subprocess.call(['sudo', 'chmod', '-R', '777', boot_log_destination])
 
-            if exitcode != 0:
-                retry = True
-                print(f'    Detected network connectivity issue')
-                raise AdditionalTelemetryRequired(NETWORK_CONNECTIVITY_METRIC_NAME, 1)
+def copy_emulator_logcat(output_directory: str):
+    if os.name != 'nt':
+        subprocess.call(['cp', '/tmp/*-logcat.log', output_directory])
 
-    elif platform == "apple":
-        # This code should only be retried for Apple as in Android this can mean failed tests or app crash
-        if exit_code == 82: # RETURN_CODE_NOT_SET
-            # See https://github.com/dotnet/xharness/issues/812
-            print(f'    Failed to detect app\'s exit code')
-            retry = True
-            return
+def remove_apps_from_device(device: str):
+    try:
+        remove_android_apps(device)
+    except Exception as e:
+        print(f'    Failed to remove installed apps from device: {e}')
 
-        # If we have a launch failure on simulators, we want a reboot+retry
-        # We want retry only on devices (it happens quite rarely)
-        if exit_code == 83: # APP_LAUNCH_FAILURE
-            print(f'    Encountered APP_LAUNCH_FAILURE')
-            if not is_device:
-                reboot = True
-            retry = True
-            return
+def check_network_connectivity() -> bool:
+    """ Returns False when the device can't reach the internet
+    """
+
+    exitcode, _ = call_adb(['shell', 'ping', '-i', '0.2', '-c', '3', 'www.microsoft.com'])
+
+    if exitcode != 0:
+        print(f'    Detected network connectivity issue')
+        return False
+
+    return True
 
-        if is_device:
-            # If we fail to find a real device, it is unexpected as device queues should have one
-            if exit_code == 81: # DEVICE_NOT_FOUND
-                print(f'    Requested tethered Apple device not found')
-                reboot = True
-                retry = True
-                return
+# The diagnostics file is read this many characters at a time; an operation can take up to the maximum
+# (XHarness writes a couple hundred), anything bigger means the file is broken
+DIAGNOSTICS_READ_SIZE = 64 * 1024
+DIAGNOSTICS_MAX_OPERATION_SIZE = 1024 * 1024
 
-            if exit_code == 78: # PACKAGE_INSTALLATION_FAILURE
-                print(f'    Encountered PACKAGE_INSTALLATION_FAILURE. This might be a transient issue with the device')
-                retry = True
-                reboot = True
-                return
+# When the diagnostics file can't be parsed, this many characters either side of the problem are printed
+DIAGNOSTICS_ERROR_CONTEXT = 500
+
+WHITESPACE_PATTERN = re.compile(r'[ \t\n\r]*')
+
+class DiagnosticsFileError(Exception):
+    """Exception raised when the diagnostics file is not a JSON array
+
+    Attributes:
+        offset -- character in the file at which the problem was found
+    """
+
+    def __init__(self, message, offset):
+        self.offset = offset
+        super().__init__(f'{message} at character {offset}')
+
+class OperationsReader:
+    """ Reads the JSON array of operations from the diagnostics file one item at a time, as they are decoded
+
+        The diagnostics file of a device stuck retrying can be very large, so instead of loading it whole, it is
+        read in chunks of read_size characters and the part that was decoded already is dropped. The memory
+        needed is bounded by the size of the largest operation, which can be at most max_operation_size.
+        Items are yielded before the rest of the file is read, so a DiagnosticsFileError can be raised after some.
+    """
 
+    def __init__(self, f, read_size: int = DIAGNOSTICS_READ_SIZE,
+                 max_operation_size: int = DIAGNOSTICS_MAX_OPERATION_SIZE):
+        self._file = f
+        self._read_size = read_size
+        self._max_operation_size = max_operation_size
+        self._decoder = json.JSONDecoder()
+        self._buffer = ''
+        self._offset = 0     # of the start of the buffer in the file
+        self._position = 0   # in the buffer, of what is to be decoded next
+        self._eof = False
+
+    def _read(self) -> bool:
+        """ Reads more of the file, returns False at its end
+        """
+
+        if self._eof:
+            return False
+
+        # Reading at least as much as there is left in the buffer keeps decoding an item that spans many reads linear
+        try:
+            data = self._file.read(max(self._read_size, len(self._buffer) - self._position))
+        except UnicodeDecodeError as e:
+            raise DiagnosticsFileError(f'Invalid text ({e.reason})', self._offset + len(self._buffer))
+
+        if not data:
+            self._eof = True
+            return False
+
+        # What was decoded already is dropped
+        self._offset += self._position
+        self._buffer = self._buffer[self._position:] + data
+        self._position = 0
+        return True
+
+    def _error(self, message: str, position: int = None) -> DiagnosticsFileError:
+        return DiagnosticsFileError(message, self._offset + (self._position if position is None else position))
+
+    def _peek(self) -> str:
+        """ Skips whitespace and returns the next character, '' at the end of the file
+        """
+
+        while True:
+            self._position = WHITESPACE_PATTERN.match(self._buffer, self._position).end()
+            if self._position < len(self._buffer):
+                return self._buffer[self._position]
+            if not self._read():
+                return ''
+
+    def _expect(self, characters: str) -> str:
+        c = self._peek()
+        if not c or c not in characters:
+            raise self._error('Expecting ' + ' or '.join(f"'{expected}'" for expected in characters))
+
+        self._position += 1
+        return c
+
+    def _read_item(self) -> bool:
+        """ Reads more of the item being decoded, returns False at the end of the file or when it is too large
+        """
+
+        return len(self._buffer) - self._position <= self._max_operation_size and self._read()
+
+    def _decode(self):
+        self._peek()
+        while True:
+            try:
+                item, end = self._decoder.raw_decode(self._buffer, self._position)
+            except json.JSONDecodeError as e:
+                # Most likely the item goes on past what was read so far
+                if self._read_item():
+                    continue
+                raise self._error(e.msg, e.pos)
+
+            # A number might go on, too
+            if (end == len(self._buffer) or self._buffer[end] not in ' \t\n\r,]') and self._read_item():
+                continue
+
+            self._position = end
+            return item
+
+    def __iter__(self):
+        self._expect('[')
+        if self._peek() == ']':
+            self._position += 1
         else:
-            if exit_code == 78: # PACKAGE_INSTALLATION_FAILURE
-                print(f'    Encountered PACKAGE_INSTALLATION_FAILURE. This might be caused by a corrupt simulator')
-                retry = True
-                reboot = True
-                return
-
-            # If we fail to find a simulator and we are not targeting a specific version (e.g. `ios-simulator_13.5`),
-            # it is probably an issue because Xcode should always have at least one runtime version inside
-            if exit_code == 81 and '_' not in target: # DEVICE_NOT_FOUND
-                print(f'    No simulator runtime found')
-                retry = True
-                reboot = True
-                return
-
-# The JSON should be an array of objects (one per each executed XHarness command)
-try:
-    operations = json.load(open(diagnostics_file))
-except Exception as e:
-    print(f'    Failed to load the diagnostics file: {e}')
-    print('Diagnostics file contents:')
+            while True:
+                yield self._decode()
+                if self._expect(',]') == ']':
+                    break
+
+        if self._peek():
+            raise self._error('Extra data')
+
+def read_operations(diagnostics_file: str):
+    """ Yields the operations from the diagnostics file as they are read, see OperationsReader
+    """
+
     with open(diagnostics_file) as f:
-        print(f.read())
-    exit(1)
-
-if len(operations) == 0:
-    print('    No operations found in the diagnostics file')
-    exit(0)
-
-print(f"Reporting {len(operations)} events from diagnostics file `{diagnostics_file}`")
-
-# Example version: 1.0.0-prerelease.22269.1+6e87004b51c89c59ac4a34536e9bc22da0124f39
-# We remove the commit SHA
-_, version = call_xharness(['version'], capture_output=True)
-version = version.strip().split("+")[0]
-
-# Parse operations, analyze them and send them to Application Insights
-for operation in operations:
-    command = operation['command']
-    platform = operation['platform']
-    exit_code = operation['exitCode']
-    duration = operation['duration']
-    device = operation.get('device')
-    target = operation.get('target')
-    target_os = operation.get('targetOS')
-    is_device = operation.get('isDevice', None)
+        for operation in OperationsReader(f):
+            yield operation
 
-    custom_dimensions = dict()
-    custom_dimensions['command'] = command
-    custom_dimensions['platform'] = platform
-    custom_dimensions['version'] = version
+def print_diagnostics_file_excerpt(diagnostics_file: str, offset: int, context: int = DIAGNOSTICS_ERROR_CONTEXT):
+    """ Prints the part of the diagnostics file around the given character, without reading the whole file
+    """
 
-    if is_device is not None:
-        custom_dimensions['isDevice'] = 'true' if str(is_device).lower() == 'true' else 'false'
+    start = max(0, offset - context)
+    with open(diagnostics_file, errors='replace') as f:
+        skipped = 0
+        while skipped < start:
+            data = f.read(min(DIAGNOSTICS_READ_SIZE, start - skipped))
+            if not data:
+                break
+            skipped += len(data)
 
-    if 'target' in operation:
-        if 'targetOS' in operation:
-            custom_dimensions['target'] = target + ':' + target_os
-        else:
-            custom_dimensions['target'] = target
-    elif 'targetOS' in operation:
-        custom_dimensions['target'] = target_os
+        excerpt = f.read(offset - skipped + context)
+        truncated = f.read(1) != ''
 
-    try:
-        analyze_operation(command, platform, device, is_device, target, exit_code)
-    except AdditionalTelemetryRequired as e:
-        send_metric(e.metric_name, e.metric_value, custom_dimensions, event_type=EVENT_TYPE)
-    except Exception as e:
-        print(f'    Failed to analyze operation: {e}')
+    print(f'Diagnostics file contents around character {offset}:')
+    print(('...' if skipped > 0 else '') + excerpt + ('...' if truncated else ''))
 
-    # Note down the dimensions that caused retry/reboot
-    if retry and not retry_dimensions:
-        retry_dimensions = custom_dimensions
-        retry_exit_code = exit_code
+def report_operation(analyzer: Analyzer, telemetry: BatchedTelemetry, operation: dict, output_directory: str):
+    """ Analyzes the operation, carries out what the analysis decided and sends the operation's telemetry
+    """
 
-    if reboot and not reboot_dimensions:
-        reboot_dimensions = custom_dimensions
+    decision = analyzer.analyze_operation(operation)
+
+    print(f'Analyzing {decision.describe()}')
+    for message in decision.messages:
+        print(f'    {message}')
+
+    for action in decision.actions:
+        try:
+            if action == COLLECT_EMULATOR_BOOT_LOGS:
+                collect_emulator_boot_logs(output_directory)
+            elif action == COPY_EMULATOR_LOGCAT:
+                copy_emulator_logcat(output_directory)
+            elif action == REMOVE_ANDROID_APPS:
+                remove_apps_from_device(operation.get('device'))
+            elif action == CHECK_NETWORK_CONNECTIVITY and not check_network_connectivity():
+                # In those cases, we want a retry and we want to report this
+                analyzer.request_retry(decision)
+                telemetry.send_metric(NETWORK_CONNECTIVITY_METRIC_NAME, 1, decision.dimensions, event_type=EVENT_TYPE)
+        except Exception as e:
+            print(f'    Failed to analyze operation: {e}')
 
     kusto_metrics = dict()
-    kusto_metrics[OPERATION_METRIC_NAME] = exit_code
-    kusto_metrics[DURATION_METRIC_NAME] = duration
+    kusto_metrics[OPERATION_METRIC_NAME] = decision.exit_code
+    kusto_metrics[DURATION_METRIC_NAME] = operation['duration']
+
+    telemetry.send_metrics(kusto_metrics, decision.dimensions, event_type=EVENT_TYPE)
+
+def get_diagnostics_file() -> str:
+    opts, args = getopt.gnu_getopt(sys.argv[1:], 'd:', ['diagnostics-data='])
+    opt_dict = dict(opts)
+
+    if '--diagnostics-data' in opt_dict:
+        return opt_dict['--diagnostics-data']
+    elif '-d' in opt_dict:
+        return opt_dict['-d']
+    else:
+        return os.getenv('XHARNESS_DIAGNOSTICS_PATH')
+
+def main():
+    diagnostics_file = get_diagnostics_file()
+
+    if not diagnostics_file:
+        print('ERROR: Expected path to the diagnostics JSON file generated by XHarness')
+        sys.exit(1)
+
+    if not os.path.isfile(diagnostics_file):
+        print(f"WARNING: Diagnostics file not found at `{diagnostics_file}`")
+        sys.exit(2)
+
+    # Only available on Helix machines; the analysis itself doesn't need it
+    from helix.public import request_reboot, request_infra_retry, send_metric, send_metrics
+
+    output_directory = os.getenv('HELIX_WORKITEM_UPLOAD_ROOT')
+
+    # The JSON should be an array of objects (one per each executed XHarness command)
+    # It is read, analyzed and reported one operation at a time, as it can get large
+    operations = read_operations(diagnostics_file)
+    try:
+        first_operation = next(operations, None)
+    except DiagnosticsFileError as e:
+        print(f'    Failed to load the diagnostics file: {e}')
+        print_diagnostics_file_excerpt(diagnostics_file, e.offset)
+        sys.exit(1)
+
+    if first_operation is None:
+        print('    No operations found in the diagnostics file')
+        sys.exit(0)
+
+    print(f"Reporting events from diagnostics file `{diagnostics_file}`")
+
+    telemetry = BatchedTelemetry(send_metric, send_metrics, TELEMETRY_BATCH_SIZE, TELEMETRY_WORKERS)
+    analyzer = Analyzer(version=get_xharness_version())
+
+    # Whatever happens, the events recorded so far are sent
+    try:
+        # Parse operations, analyze them and send them to Application Insights
+        try:
+            report_operation(analyzer, telemetry, first_operation, output_directory)
+            for operation in operations:
+                report_operation(analyzer, telemetry, operation, output_directory)
+        except DiagnosticsFileError as e:
+            # What was read before the problem has been reported, but we don't act on a partial file
+            print(f'    Failed to load the diagnostics file: {e}')
+            print_diagnostics_file_excerpt(diagnostics_file, e.offset)
+            sys.exit(1)
+
+        # For the first operation that causes a retry/reboot, we send a metric to Helix
+        # Retry/reboot can be also asked for by the client (by creating .retry/.reboot files)
+        retry = analyzer.retry
+        reboot = analyzer.reboot
+        retry_dimensions = analyzer.retry_decision.dimensions if analyzer.retry_decision else dict()
+        reboot_dimensions = analyzer.reboot_decision.dimensions if analyzer.reboot_decision else dict()
+        retry_exit_code = analyzer.retry_decision.exit_code if analyzer.retry_decision else -1
+        reboot_exit_code = -1
+
+        # Retry / reboot is handled here
+        script_dir = os.getenv('HELIX_WORKITEM_ROOT')
+
+        if os.path.exists(os.path.join(script_dir, '.retry')):
+            retry = True
+
+        if os.path.exists(os.path.join(script_dir, '.reboot')):
+            reboot = True
 
-    send_metrics(kusto_metrics, custom_dimensions, event_type=EVENT_TYPE)
+        if retry:
+            telemetry.send_metric(RETRY_METRIC_NAME, retry_exit_code, retry_dimensions, event_type=EVENT_TYPE)
 
-# Retry / reboot is handled here
-script_dir = os.getenv('HELIX_WORKITEM_ROOT')
+        if reboot:
+            telemetry.send_metric(REBOOT_METRIC_NAME, reboot_exit_code, reboot_dimensions, event_type=EVENT_TYPE)
+    finally:
+        # Everything is sent before the retry/reboot is requested
+        telemetry.close()
 
-if os.path.exists(os.path.join(script_dir, '.retry')):
-    retry = True
+    print(f'Sent {telemetry.events - telemetry.failures} telemetry events')
 
-if os.path.exists(os.path.join(script_dir, '.reboot')):
-    reboot = True
+    if retry:
+        request_infra_retry('Requesting work item retry because an infrastructure issue was detected on this machine')
 
-if retry:
-    send_metric(RETRY_METRIC_NAME, retry_exit_code, retry_dimensions, event_type=EVENT_TYPE)
-    request_infra_retry('Requesting work item retry because an infrastructure issue was detected on this machine')
+        # TODO https://github.com/dotnet/core-eng/issues/15059
+        # We need to rename testResults.xml so that test results are not uploaded since this run will be discarded
+        # This is a workaround until we make AzDO reporter not upload test results
+        file_name = "testResults.xml"
+        test_results = os.path.join(output_directory, file_name)
+        if os.path.exists(test_results):
+            os.rename(test_results, test_results + ".retry")
 
-    # TODO https://github.com/dotnet/core-eng/issues/15059
-    # We need to rename testResults.xml so that test results are not uploaded since this run will be discarded
-    # This is a workaround until we make AzDO reporter not upload test results
-    file_name = "testResults.xml"
-    test_results = os.path.join(output_directory, file_name)
-    if os.path.exists(test_results):
-        os.rename(test_results, test_results + ".retry")
+        if os.path.exists(file_name):
+            os.rename(file_name, file_name + ".retry")
 
-    if os.path.exists(file_name):
-        os.rename(file_name, file_name + ".retry")
+    if reboot:
+        request_reboot('Requesting machine reboot as an infrastructure issue was detected on this machine')
 
-if reboot:
-    send_metric(REBOOT_METRIC_NAME, reboot_exit_code, reboot_dimensions, event_type=EVENT_TYPE)
-    request_reboot('Requesting machine reboot as an infrastructure issue was detected on this machine')
+if __name__ == '__main__':
+    main()